@@ -1,9 +1,11 @@
 import time
 import requests
 import json
-from typing import Generator, Optional
+from typing import AsyncGenerator, Generator, Optional
 import logging
 
+from .http_client import aiter_sse, http_client_pool
+
 logger = logging.getLogger(__name__)
 
 class AnthropicChat:
@@ -101,6 +103,86 @@ class AnthropicChat:
         
         return messages
     
+    def _build_request(self, message: str, stream: bool) -> tuple:
+        """
+        构建请求头和请求体
+        
+        Args:
+            message: 用户消息
+            stream: 是否流式返回
+            
+        Returns:
+            tuple: (请求头, 请求体)
+        """
+        payload = {
+            "model": self.model_name,
+            "max_tokens": 4096,
+            "messages": self._prepare_messages(message),
+            "temperature": self.temperature,
+            "stream": stream
+        }
+        
+        # Anthropic API需要系统提示词作为单独的字段
+        if self.system_prompt:
+            payload["system"] = self.system_prompt
+        
+        headers = {
+            "x-api-key": self.api_key,
+            "Content-Type": "application/json",
+            "anthropic-version": "2023-06-01"
+        }
+        return headers, payload
+    
+    def _update_history(self, message: str, ai_response: str):
+        """记录一轮对话，保持历史长度在合理范围内（最近10轮对话）"""
+        self.conversation_history.append({
+            "role": "user",
+            "content": message
+        })
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": ai_response
+        })
+        
+        if len(self.conversation_history) > 20:
+            self.conversation_history = self.conversation_history[-20:]
+    
+    def _parse_response(self, result: dict) -> str:
+        """从非流式响应中提取回复内容"""
+        return result["content"][0]["text"]
+    
+    def _parse_stream_data(self, data: str, state: dict) -> list:
+        """
+        解析一条流式数据
+        
+        Args:
+            data: SSE事件的data部分
+            state: 本次流式回复的累计状态
+            
+        Returns:
+            list: 需要输出的文本片段
+        """
+        try:
+            json_data = json.loads(data)
+        except json.JSONDecodeError:
+            return []
+        
+        chunks = []
+        # Anthropic的流式响应格式
+        if json_data.get("type") == "content_block_delta":
+            delta = json_data.get("delta", {})
+            content = delta.get("text", "")
+            
+            if content:
+                state["full_response"] += content
+                chunks.append(content)
+        return chunks
+    
+    def _finish_stream(self, message: str, state: dict):
+        """流式回复结束后更新对话历史"""
+        if state["full_response"]:
+            self._update_history(message, state["full_response"])
+    
     def chat(self, message: str) -> str:
         """
         发送消息并获取完整回复
@@ -112,25 +194,7 @@ class AnthropicChat:
             str: AI回复
         """
         try:
-            messages = self._prepare_messages(message)
-            
-            payload = {
-                "model": self.model_name,
-                "max_tokens": 4096,
-                "messages": messages,
-                "temperature": self.temperature,
-                "stream": False
-            }
-            
-            # Anthropic API需要系统提示词作为单独的字段
-            if self.system_prompt:
-                payload["system"] = self.system_prompt
-            
-            headers = {
-                "x-api-key": self.api_key,
-                "Content-Type": "application/json",
-                "anthropic-version": "2023-06-01"
-            }
+            headers, payload = self._build_request(message, stream=False)
             
             response = requests.post(
                 self.chat_url,
@@ -140,22 +204,10 @@ class AnthropicChat:
             )
             
             if response.status_code == 200:
-                result = response.json()
-                ai_response = result["content"][0]["text"]
+                ai_response = self._parse_response(response.json())
                 
                 # 更新对话历史
-                self.conversation_history.append({
-                    "role": "user",
-                    "content": message
-                })
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": ai_response
-                })
-                
-                # 保持历史长度在合理范围内（最近10轮对话）
-                if len(self.conversation_history) > 20:
-                    self.conversation_history = self.conversation_history[-20:]
+                self._update_history(message, ai_response)
                 
                 return ai_response
             else:
@@ -179,25 +231,7 @@ class AnthropicChat:
             str: AI回复的片段
         """
         try:
-            messages = self._prepare_messages(message)
-            
-            payload = {
-                "model": self.model_name,
-                "max_tokens": 4096,
-                "messages": messages,
-                "temperature": self.temperature,
-                "stream": True
-            }
-            
-            # Anthropic API需要系统提示词作为单独的字段
-            if self.system_prompt:
-                payload["system"] = self.system_prompt
-            
-            headers = {
-                "x-api-key": self.api_key,
-                "Content-Type": "application/json",
-                "anthropic-version": "2023-06-01"
-            }
+            headers, payload = self._build_request(message, stream=True)
             
             response = requests.post(
                 self.chat_url,
@@ -208,7 +242,7 @@ class AnthropicChat:
             )
             
             if response.status_code == 200:
-                full_response = ""
+                state = {"full_response": ""}
                 
                 for line in response.iter_lines():
                     if line:
@@ -219,35 +253,10 @@ class AnthropicChat:
                             if data.strip() == '[DONE]':
                                 break
                             
-                            try:
-                                json_data = json.loads(data)
-                                
-                                # Anthropic的流式响应格式
-                                if json_data.get("type") == "content_block_delta":
-                                    delta = json_data.get("delta", {})
-                                    content = delta.get("text", "")
-                                    
-                                    if content:
-                                        full_response += content
-                                        yield content
-                                        
-                            except json.JSONDecodeError:
-                                continue
+                            yield from self._parse_stream_data(data, state)
                 
                 # 更新对话历史
-                if full_response:
-                    self.conversation_history.append({
-                        "role": "user",
-                        "content": message
-                    })
-                    self.conversation_history.append({
-                        "role": "assistant",
-                        "content": full_response
-                    })
-                    
-                    # 保持历史长度在合理范围内
-                    if len(self.conversation_history) > 20:
-                        self.conversation_history = self.conversation_history[-20:]
+                self._finish_stream(message, state)
             else:
                 error_msg = f"API请求失败: {response.status_code} - {response.text}"
                 logger.error(error_msg)
@@ -258,6 +267,77 @@ class AnthropicChat:
             logger.error(error_msg)
             yield f"抱歉，发生错误: {error_msg}"
     
+    async def achat(self, message: str) -> str:
+        """
+        chat的异步版本，使用端点共享的保持连接的HTTP客户端
+        
+        Args:
+            message: 用户消息
+            
+        Returns:
+            str: AI回复
+        """
+        try:
+            headers, payload = self._build_request(message, stream=False)
+            
+            client = http_client_pool.get(self.endpoint)
+            response = await client.post(self.chat_url, headers=headers, json=payload)
+            
+            if response.status_code == 200:
+                ai_response = self._parse_response(response.json())
+                
+                # 更新对话历史
+                self._update_history(message, ai_response)
+                
+                return ai_response
+            else:
+                error_msg = f"API请求失败: {response.status_code} - {response.text}"
+                logger.error(error_msg)
+                return f"抱歉，请求失败: {error_msg}"
+                
+        except Exception as e:
+            error_msg = f"发送消息时出错: {str(e)}"
+            logger.error(error_msg)
+            return f"抱歉，发生错误: {error_msg}"
+    
+    async def achat_stream(self, message: str) -> AsyncGenerator[str, None]:
+        """
+        chat_stream的异步版本，使用端点共享的保持连接的HTTP客户端，异步解析SSE
+        
+        Args:
+            message: 用户消息
+            
+        Yields:
+            str: AI回复的片段
+        """
+        try:
+            headers, payload = self._build_request(message, stream=True)
+            
+            client = http_client_pool.get(self.endpoint)
+            async with client.stream("POST", self.chat_url, headers=headers, json=payload) as response:
+                if response.status_code == 200:
+                    state = {"full_response": ""}
+                    
+                    async for _, data in aiter_sse(response):
+                        if data.strip() == '[DONE]':
+                            break
+                        
+                        for chunk in self._parse_stream_data(data, state):
+                            yield chunk
+                    
+                    # 更新对话历史
+                    self._finish_stream(message, state)
+                else:
+                    body = (await response.aread()).decode('utf-8', errors='replace')
+                    error_msg = f"API请求失败: {response.status_code} - {body}"
+                    logger.error(error_msg)
+                    yield f"抱歉，请求失败: {error_msg}"
+                    
+        except Exception as e:
+            error_msg = f"流式发送消息时出错: {str(e)}"
+            logger.error(error_msg)
+            yield f"抱歉，发生错误: {error_msg}"
+    
     def clear_history(self):
         """清除对话历史"""
         self.conversation_history = []
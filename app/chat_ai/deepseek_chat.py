@@ -1,9 +1,11 @@
 import time
 import requests
 import json
-from typing import Generator, Optional
+from typing import AsyncGenerator, Generator, Optional
 import logging
 
+from .http_client import aiter_sse, http_client_pool
+
 logger = logging.getLogger(__name__)
 
 class DeepSeekChat:
@@ -108,6 +110,118 @@ class DeepSeekChat:
         
         return messages
     
+    def _build_request(self, message: str, stream: bool) -> tuple:
+        """
+        构建请求头和请求体
+        
+        Args:
+            message: 用户消息
+            stream: 是否流式返回
+            
+        Returns:
+            tuple: (请求头, 请求体)
+        """
+        payload = {
+            "model": self.model_name,
+            "messages": self._prepare_messages(message),
+            "temperature": self.temperature,
+            "stream": stream
+        }
+        
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        return headers, payload
+    
+    def _update_history(self, message: str, ai_response: str):
+        """记录一轮对话，保持历史长度在合理范围内（最近10轮对话）"""
+        self.conversation_history.append({
+            "role": "user",
+            "content": message
+        })
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": ai_response
+        })
+        
+        if len(self.conversation_history) > 20:
+            self.conversation_history = self.conversation_history[-20:]
+    
+    def _parse_response(self, result: dict) -> str:
+        """从非流式响应中提取回复内容（有思考过程时包含在回复中）"""
+        choice = result["choices"][0]
+        message_obj = choice["message"]
+        
+        ai_response = message_obj.get("content", "")
+        reasoning_content = message_obj.get("reasoning_content", "")
+        
+        # 如果有思考过程，将其包含在回复中
+        full_response = ai_response
+        if reasoning_content:
+            full_response = f"**🤔 思考过程：**\n\n```thinking\n{reasoning_content}\n```\n\n**💭 回答：**\n\n{ai_response}"
+        return full_response
+    
+    def _parse_stream_data(self, data: str, state: dict) -> list:
+        """
+        解析一条流式数据
+        
+        Args:
+            data: SSE事件的data部分
+            state: 本次流式回复的累计状态
+            
+        Returns:
+            list: 需要输出的文本片段
+        """
+        try:
+            json_data = json.loads(data)
+        except json.JSONDecodeError:
+            return []
+        
+        chunks = []
+        if 'choices' in json_data and len(json_data['choices']) > 0:
+            choice = json_data['choices'][0]
+            delta = choice.get('delta', {})
+            
+            # 处理思考过程（reasoning_content）
+            reasoning_content = delta.get('reasoning_content', '')
+            if reasoning_content:
+                state["full_reasoning"] += reasoning_content
+                if not state["thinking_started"]:
+                    state["thinking_started"] = True
+                    chunks.append("\n\n**🤔 思考过程：**\n\n")
+                    chunks.append("```thinking\n")
+                chunks.append(reasoning_content)
+            
+            # 处理普通回复内容
+            content = delta.get('content', '')
+            if content:
+                # 如果之前有思考过程，先结束思考块
+                if state["thinking_started"] and not state["thinking_ended"]:
+                    state["thinking_ended"] = True
+                    chunks.append("\n```\n\n**💭 回答：**\n\n")
+                
+                state["full_response"] += content
+                chunks.append(content)
+        return chunks
+    
+    def _new_stream_state(self) -> dict:
+        """流式回复的累计状态"""
+        return {
+            "full_response": "",
+            "full_reasoning": "",
+            "thinking_started": False,
+            "thinking_ended": False
+        }
+    
+    def _finish_stream(self, message: str, state: dict):
+        """流式回复结束后更新对话历史（有思考过程时包含在助手回复中）"""
+        if state["full_response"] or state["full_reasoning"]:
+            assistant_content = state["full_response"]
+            if state["full_reasoning"]:
+                assistant_content = f"**思考过程：**\n{state['full_reasoning']}\n\n**回答：**\n{state['full_response']}"
+            self._update_history(message, assistant_content)
+    
     def chat(self, message: str) -> str:
         """
         发送消息并获取完整回复
@@ -119,19 +233,7 @@ class DeepSeekChat:
             str: AI回复
         """
         try:
-            messages = self._prepare_messages(message)
-            
-            payload = {
-                "model": self.model_name,
-                "messages": messages,
-                "temperature": self.temperature,
-                "stream": False
-            }
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            headers, payload = self._build_request(message, stream=False)
             
             response = requests.post(
                 self.chat_url,
@@ -141,33 +243,12 @@ class DeepSeekChat:
             )
             
             if response.status_code == 200:
-                result = response.json()
-                choice = result["choices"][0]
-                message_obj = choice["message"]
-                
-                ai_response = message_obj.get("content", "")
-                reasoning_content = message_obj.get("reasoning_content", "")
-                
-                # 如果有思考过程，将其包含在回复中
-                full_response = ai_response
-                if reasoning_content:
-                    full_response = f"**🤔 思考过程：**\n\n```thinking\n{reasoning_content}\n```\n\n**💭 回答：**\n\n{ai_response}"
+                ai_response = self._parse_response(response.json())
                 
                 # 更新对话历史
-                self.conversation_history.append({
-                    "role": "user",
-                    "content": message
-                })
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": full_response
-                })
+                self._update_history(message, ai_response)
                 
-                # 保持历史长度在合理范围内（最近10轮对话）
-                if len(self.conversation_history) > 20:
-                    self.conversation_history = self.conversation_history[-20:]
-                
-                return full_response
+                return ai_response
             else:
                 error_msg = f"API请求失败: {response.status_code} - {response.text}"
                 logger.error(error_msg)
@@ -189,19 +270,7 @@ class DeepSeekChat:
             str: AI回复的片段
         """
         try:
-            messages = self._prepare_messages(message)
-            
-            payload = {
-                "model": self.model_name,
-                "messages": messages,
-                "temperature": self.temperature,
-                "stream": True
-            }
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            headers, payload = self._build_request(message, stream=True)
             
             response = requests.post(
                 self.chat_url,
@@ -212,10 +281,7 @@ class DeepSeekChat:
             )
             
             if response.status_code == 200:
-                full_response = ""
-                full_reasoning = ""
-                thinking_started = False
-                thinking_ended = False
+                state = self._new_stream_state()
                 
                 for line in response.iter_lines():
                     if line:
@@ -226,56 +292,10 @@ class DeepSeekChat:
                             if data.strip() == '[DONE]':
                                 break
                             
-                            try:
-                                json_data = json.loads(data)
-                                if 'choices' in json_data and len(json_data['choices']) > 0:
-                                    choice = json_data['choices'][0]
-                                    delta = choice.get('delta', {})
-                                    
-                                    # 处理思考过程（reasoning_content）
-                                    reasoning_content = delta.get('reasoning_content', '')
-                                    if reasoning_content:
-                                        full_reasoning += reasoning_content
-                                        if not thinking_started:
-                                            thinking_started = True
-                                            yield "\n\n**🤔 思考过程：**\n\n"
-                                            yield "```thinking\n"
-                                        yield reasoning_content
-                                    
-                                    # 处理普通回复内容
-                                    content = delta.get('content', '')
-                                    if content:
-                                        # 如果之前有思考过程，先结束思考块
-                                        if thinking_started and not thinking_ended:
-                                            thinking_ended = True
-                                            yield "\n```\n\n**💭 回答：**\n\n"
-                                        
-                                        full_response += content
-                                        yield content
-                                        
-                            except json.JSONDecodeError:
-                                continue
+                            yield from self._parse_stream_data(data, state)
                 
                 # 更新对话历史
-                if full_response or full_reasoning:
-                    self.conversation_history.append({
-                        "role": "user",
-                        "content": message
-                    })
-                    
-                    # 如果有思考过程，将其包含在助手回复中
-                    assistant_content = full_response
-                    if full_reasoning:
-                        assistant_content = f"**思考过程：**\n{full_reasoning}\n\n**回答：**\n{full_response}"
-                    
-                    self.conversation_history.append({
-                        "role": "assistant",
-                        "content": assistant_content
-                    })
-                    
-                    # 保持历史长度在合理范围内
-                    if len(self.conversation_history) > 20:
-                        self.conversation_history = self.conversation_history[-20:]
+                self._finish_stream(message, state)
             else:
                 error_msg = f"API请求失败: {response.status_code} - {response.text}"
                 logger.error(error_msg)
@@ -286,6 +306,77 @@ class DeepSeekChat:
             logger.error(error_msg)
             yield f"抱歉，发生错误: {error_msg}"
     
+    async def achat(self, message: str) -> str:
+        """
+        chat的异步版本，使用端点共享的保持连接的HTTP客户端
+        
+        Args:
+            message: 用户消息
+            
+        Returns:
+            str: AI回复
+        """
+        try:
+            headers, payload = self._build_request(message, stream=False)
+            
+            client = http_client_pool.get(self.endpoint)
+            response = await client.post(self.chat_url, headers=headers, json=payload)
+            
+            if response.status_code == 200:
+                ai_response = self._parse_response(response.json())
+                
+                # 更新对话历史
+                self._update_history(message, ai_response)
+                
+                return ai_response
+            else:
+                error_msg = f"API请求失败: {response.status_code} - {response.text}"
+                logger.error(error_msg)
+                return f"抱歉，请求失败: {error_msg}"
+                
+        except Exception as e:
+            error_msg = f"发送消息时出错: {str(e)}"
+            logger.error(error_msg)
+            return f"抱歉，发生错误: {error_msg}"
+    
+    async def achat_stream(self, message: str) -> AsyncGenerator[str, None]:
+        """
+        chat_stream的异步版本，使用端点共享的保持连接的HTTP客户端，异步解析SSE
+        
+        Args:
+            message: 用户消息
+            
+        Yields:
+            str: AI回复的片段
+        """
+        try:
+            headers, payload = self._build_request(message, stream=True)
+            
+            client = http_client_pool.get(self.endpoint)
+            async with client.stream("POST", self.chat_url, headers=headers, json=payload) as response:
+                if response.status_code == 200:
+                    state = self._new_stream_state()
+                    
+                    async for _, data in aiter_sse(response):
+                        if data.strip() == '[DONE]':
+                            break
+                        
+                        for chunk in self._parse_stream_data(data, state):
+                            yield chunk
+                    
+                    # 更新对话历史
+                    self._finish_stream(message, state)
+                else:
+                    body = (await response.aread()).decode('utf-8', errors='replace')
+                    error_msg = f"API请求失败: {response.status_code} - {body}"
+                    logger.error(error_msg)
+                    yield f"抱歉，请求失败: {error_msg}"
+                    
+        except Exception as e:
+            error_msg = f"流式发送消息时出错: {str(e)}"
+            logger.error(error_msg)
+            yield f"抱歉，发生错误: {error_msg}"
+    
     def clear_history(self):
         """清除对话历史"""
         self.conversation_history = []
@@ -0,0 +1,107 @@
+"""
+聊天模型的共享异步HTTP客户端
+
+每个API端点复用一个保持连接的httpx.AsyncClient（安装了h2时使用HTTP/2），
+避免每次请求重新建立TCP/TLS连接；流式响应按SSE协议异步解析，不阻塞事件循环。
+
+环境变量:
+    CHAT_HTTP_MAX_CONNECTIONS: 每个端点的最大连接数，默认100
+    CHAT_HTTP_MAX_KEEPALIVE: 每个端点保持的空闲连接数，默认20
+    CHAT_HTTP_KEEPALIVE_EXPIRY: 空闲连接保持时间（秒），默认60
+    CHAT_HTTP2: 是否启用HTTP/2（需要安装h2），默认true
+"""
+import logging
+import os
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 与同步客户端一致：连接和每次读取的超时时间
+REQUEST_TIMEOUT = 30.0
+
+
+class AsyncHTTPClientPool:
+    """按API端点复用的异步HTTP客户端"""
+
+    def __init__(self):
+        self.max_connections = int(os.getenv("CHAT_HTTP_MAX_CONNECTIONS", "100"))
+        self.max_keepalive = int(os.getenv("CHAT_HTTP_MAX_KEEPALIVE", "20"))
+        self.keepalive_expiry = float(os.getenv("CHAT_HTTP_KEEPALIVE_EXPIRY", "60"))
+        self.http2 = H2_AVAILABLE and os.getenv("CHAT_HTTP2", "true").lower() == "true"
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def get(self, endpoint: str) -> httpx.AsyncClient:
+        """获取端点对应的客户端（不存在或已关闭时创建）"""
+        client = self._clients.get(endpoint)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=httpx.Timeout(REQUEST_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            )
+            self._clients[endpoint] = client
+            logger.info(f"创建聊天HTTP客户端: {endpoint} (HTTP/2: {self.http2})")
+        return client
+
+    async def aclose(self):
+        """关闭所有客户端（应用关闭时调用）"""
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"关闭聊天HTTP客户端时出错: {str(e)}")
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            "endpoints": list(self._clients.keys()),
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+        }
+
+
+async def aiter_sse(response: httpx.Response) -> AsyncIterator[Tuple[Optional[str], str]]:
+    """
+    异步解析SSE响应
+
+    Yields:
+        (事件类型, 数据)，多行data按换行拼接；没有event字段时事件类型为None
+    """
+    event_type = None
+    data_lines = []
+    async for line in response.aiter_lines():
+        line = line.rstrip("\r")
+        if not line:
+            # 空行表示一个事件结束
+            if data_lines:
+                yield event_type, "\n".join(data_lines)
+            event_type, data_lines = None, []
+            continue
+        if line.startswith(":"):
+            continue  # 注释（心跳）
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            data_lines.append(value)
+        elif field == "event":
+            event_type = value
+    if data_lines:
+        yield event_type, "\n".join(data_lines)
+
+
+# 全局客户端池
+http_client_pool = AsyncHTTPClientPool()
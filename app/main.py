@@ -59,10 +59,10 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有头
 )
 
-# 添加表单大小限制中间件
+# 添加表单大小限制中间件（只检查Content-Length，不预先解析表单）
 app.add_middleware(
     FormSizeMiddleware,
-    max_part_size=1024 * 1024 * 1024  # 1GB
+    max_body_size=1024 * 1024 * 1024 + 1024 * 1024  # 1GB文件 + 表单字段
 )
 
 # 添加身份验证中间件
@@ -355,12 +355,42 @@ async def startup_event():
         logger.info("已抑制openpyxl警告")
     except Exception as e:
         logger.warning(f"初始化环境时出错: {str(e)}")
+    
+    # 恢复文档处理队列：上次关闭时未完成的任务继续处理
+    try:
+        from app.services.document_upload_service import processing_queue
+        processing_queue.resume()
+        logger.info("文档处理队列已恢复")
+        
+        # process模式下文档处理在独立工作进程中执行
+        if processing_queue.mode == "process":
+            from app.services.document_worker import worker_process
+            worker_process.start()
+    except Exception as e:
+        logger.error(f"恢复文档处理队列失败: {str(e)}")
         
     logger.info("=" * 50)
 
 # 应用关闭事件
 @app.on_event("shutdown")
 async def shutdown_event():
+    # 停止文档处理工作线程/工作进程（未完成的任务下次启动时重新排队）
+    try:
+        from app.services.document_upload_service import processing_queue
+        processing_queue.stop()
+        
+        if processing_queue.mode == "process":
+            from app.services.document_worker import worker_process
+            worker_process.stop()
+    except Exception as e:
+        logger.warning(f"停止文档处理队列时出错: {str(e)}")
+    
+    # 关闭聊天模型共享的HTTP连接
+    try:
+        from app.chat_ai.http_client import http_client_pool
+        await http_client_pool.aclose()
+    except Exception as e:
+        logger.warning(f"关闭聊天HTTP客户端时出错: {str(e)}")
     logger.info("智能体平台应用关闭")
 
 if __name__ == "__main__":
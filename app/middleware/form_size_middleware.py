@@ -1,34 +1,43 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
+import json
 
 
-class FormSizeMiddleware(BaseHTTPMiddleware):
+class FormSizeMiddleware:
     """
-    中间件用于设置表单数据的大小限制
-    解决Starlette默认max_part_size=1MB的限制
+    中间件用于限制multipart表单请求的大小
+
+    只检查Content-Length请求头，超过上限直接返回413，不再预先解析表单：
+    预解析会把整个请求体读入并解析一遍，上传大文件时内存和IO都会翻倍。
+    表单由各接口自行解析（文件上传接口流式写盘）。
+    使用纯ASGI实现，请求体原样流式传递给后续处理器。
     """
-    
-    def __init__(self, app, max_part_size: int = 1024 * 1024 * 1024):  # 默认1GB
-        super().__init__(app)
-        self.max_part_size = max_part_size
-    
-    async def dispatch(self, request: Request, call_next):
-        # 如果是包含文件的POST请求，预先调用form()方法设置大小限制
-        if (
-            request.method == "POST" 
-            and request.headers.get("content-type", "").startswith("multipart/form-data")
-        ):
-            try:
-                # 预先解析表单数据，设置自定义的max_part_size
-                await request.form(
-                    max_files=1000,
-                    max_fields=1000, 
-                    max_part_size=self.max_part_size
-                )
-            except Exception:
-                # 如果解析失败，让后续处理器处理错误
-                pass
-        
-        response = await call_next(request)
-        return response
\ No newline at end of file
+
+    def __init__(self, app, max_body_size: int = 1024 * 1024 * 1024):  # 默认1GB
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST":
+            headers = dict(scope.get("headers") or [])
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+            content_length = headers.get(b"content-length", b"").decode("latin-1")
+            if (
+                content_type.startswith("multipart/form-data")
+                and content_length.isdigit()
+                and int(content_length) > self.max_body_size
+            ):
+                body = json.dumps(
+                    {"detail": f"请求体过大，不能超过{self.max_body_size // (1024 * 1024)}MB"},
+                    ensure_ascii=False
+                ).encode("utf-8")
+                await send({
+                    "type": "http.response.start",
+                    "status": 413,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode("latin-1")),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+
+        await self.app(scope, receive, send)
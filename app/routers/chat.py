@@ -8,6 +8,7 @@ import time
 import logging
 from typing import List, Dict, Any
 from sse_starlette.sse import EventSourceResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 import os
 
 # 导入聊天相关模块
@@ -88,8 +89,12 @@ async def chat_api(request: Request, current_user: str = Depends(require_auth_ap
         if temperature is not None:
             chat_instance.set_temperature(temperature)
         
-        # 处理用户输入并获取回复
-        response = chat_instance.chat(message)
+        # 处理用户输入并获取回复：支持异步接口的实例直接等待（共享连接），
+        # 其他实例的同步调用放到线程池中，都不阻塞事件循环
+        if hasattr(chat_instance, "achat"):
+            response = await chat_instance.achat(message)
+        else:
+            response = await run_in_threadpool(chat_instance.chat, message)
         
         return {"response": response}
     except Exception as e:
@@ -231,8 +236,14 @@ async def chat_stream_api(request: Request, message: str = None, system_prompt:
                 # 发送开始标记
                 yield json.dumps({"status": "start"}) + "\n"
                 
-                # 使用流式生成方法获取回复
-                for chunk in current_chat_instance.chat_stream(message):
+                # 使用流式生成方法获取回复：支持异步接口的实例直接异步迭代（共享连接），
+                # 其他实例的同步生成器放到线程池中迭代，都不阻塞事件循环
+                if hasattr(current_chat_instance, "achat_stream"):
+                    chunks = current_chat_instance.achat_stream(message)
+                else:
+                    chunks = iterate_in_threadpool(current_chat_instance.chat_stream(message))
+                
+                async for chunk in chunks:
                     if chunk:
                         # 发送内容块，确保每个块都是独立的JSON对象
                         yield json.dumps({"status": "chunk", "content": chunk}) + "\n"
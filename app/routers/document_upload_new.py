@@ -1,4 +1,4 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, Form, HTTPException, Request
 from fastapi.responses import JSONResponse
 from app.services.document_upload_service import DocumentUploadService
 import logging
@@ -12,51 +12,46 @@ router = APIRouter()
 # 创建文档上传服务实例
 upload_service = DocumentUploadService()
 
+# 上传文件大小上限（1GB）
+MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+
+# 支持上传的文件类型
+ALLOWED_UPLOAD_EXTENSIONS = {
+    'txt', 'pdf', 'doc', 'docx', 'xls', 'xlsx', 
+    'ppt', 'pptx', 'csv', 'json', 'xml', 'html', 'htm'
+}
+
+
+def _validate_upload_filename(filename: str) -> None:
+    """验证上传文件类型（在接收文件内容之前调用）"""
+    file_ext = filename.split(".")[-1].lower() if "." in filename else ""
+    if file_ext not in ALLOWED_UPLOAD_EXTENSIONS:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"不支持的文件类型: {file_ext}。支持的类型: {', '.join(ALLOWED_UPLOAD_EXTENSIONS)}"
+        )
+
+
 @router.post("/knowledge/api/documents/upload-with-vectorization")
-async def upload_document_with_vectorization(
-    file: UploadFile = File(...), 
-    kb_name: str = Form(...)
-):
+async def upload_document_with_vectorization(request: Request):
     """
     上传文档并进行向量化处理
+    
+    multipart表单字段: file（文件）、kb_name（知识库名称）。
+    请求体流式写入临时文件并同时计算哈希，不会将整个文件读入内存。
     """
     try:
-        # 验证知识库名称
-        if not kb_name or not kb_name.strip():
-            raise HTTPException(status_code=400, detail="知识库名称不能为空")
-        
-        # 验证文件
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="文件名不能为空")
-        
-        # 读取文件内容
-        file_content = await file.read()
-        
-        # 验证文件大小（限制为1GB）
-        max_size = 1024 * 1024 * 1024  # 1GB
-        if len(file_content) > max_size:
-            raise HTTPException(status_code=400, detail="文件大小不能超过1GB")
-        
-        # 验证文件类型
-        allowed_extensions = {
-            'txt', 'pdf', 'doc', 'docx', 'xls', 'xlsx', 
-            'ppt', 'pptx', 'csv', 'json', 'xml', 'html', 'htm'
-        }
-        file_ext = file.filename.split(".")[-1].lower() if "." in file.filename else ""
-        if file_ext not in allowed_extensions:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"不支持的文件类型: {file_ext}。支持的类型: {', '.join(allowed_extensions)}"
-            )
-        
-        logger.info(f"开始上传文件: {file.filename} 到知识库: {kb_name}")
-        
-        # 调用服务进行上传和向量化
-        result = await upload_service.upload_and_vectorize(
-            file_content=file_content,
-            filename=file.filename,
-            kb_name=kb_name.strip()
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE + 1024 * 1024:
+            raise HTTPException(status_code=413, detail="文件大小不能超过1GB")
+        
+        # 流式接收文件并添加到处理队列
+        result = await upload_service.upload_stream_and_vectorize(
+            request,
+            max_file_size=MAX_UPLOAD_SIZE,
+            validate_filename=_validate_upload_filename
         )
+        kb_name = result.get("data", {}).get("kb_name", "")
         
         # 上传成功后清除分层索引状态缓存，确保状态能及时更新
         if result.get("success", False):
@@ -145,18 +140,8 @@ async def get_document_status(doc_id: str, kb_name: str):
         if not doc_id or not doc_id.strip():
             raise HTTPException(status_code=400, detail="文档ID不能为空")
         
-        # 获取文档列表并查找指定文档
-        documents_result = upload_service.get_documents(kb_name=kb_name.strip(), page=1, limit=1000)
-        
-        if not documents_result["success"]:
-            raise HTTPException(status_code=500, detail="获取文档状态失败")
-        
-        # 查找指定文档
-        target_doc = None
-        for doc in documents_result["data"]:
-            if doc["id"] == doc_id.strip():
-                target_doc = doc
-                break
+        # 按主键查询指定文档
+        target_doc = upload_service.get_document(kb_name.strip(), doc_id.strip())
         
         if not target_doc:
             raise HTTPException(status_code=404, detail="找不到指定的文档")
@@ -164,11 +149,13 @@ async def get_document_status(doc_id: str, kb_name: str):
         return JSONResponse(content={
             "success": True,
             "data": {
-                "doc_id": target_doc["id"],
+                "doc_id": doc_id.strip(),
                 "filename": target_doc["filename"],
                 "has_vector": target_doc.get("has_vector", False),
                 "vector_status": target_doc.get("vector_status", "unknown"),
-                "error_message": target_doc.get("error_message", None)
+                "error_message": target_doc.get("error_message", None),
+                "dedup_stats": target_doc.get("dedup_stats", None),
+                "delta_stats": target_doc.get("delta_stats", None)
             }
         })
         
@@ -192,17 +179,7 @@ async def re_vectorize_document(doc_id: str, kb_name: str):
             raise HTTPException(status_code=400, detail="文档ID不能为空")
         
         # 获取文档信息
-        documents_result = upload_service.get_documents(kb_name=kb_name.strip(), page=1, limit=1000)
-        
-        if not documents_result["success"]:
-            raise HTTPException(status_code=500, detail="获取文档信息失败")
-        
-        # 查找指定文档
-        target_doc = None
-        for doc in documents_result["data"]:
-            if doc["id"] == doc_id.strip():
-                target_doc = doc
-                break
+        target_doc = upload_service.get_document(kb_name.strip(), doc_id.strip())
         
         if not target_doc:
             raise HTTPException(status_code=404, detail="找不到指定的文档")
@@ -215,18 +192,12 @@ async def re_vectorize_document(doc_id: str, kb_name: str):
         if not file_path.exists():
             raise HTTPException(status_code=404, detail="原始文件不存在")
         
-        # 更新状态为等待处理
-        metadata = upload_service._load_metadata(paths["metadata_file"])
-        if doc_id.strip() in metadata["documents"]:
-            metadata["documents"][doc_id.strip()]["vector_status"] = "waiting"
-            metadata["documents"][doc_id.strip()]["has_vector"] = False
-            # 清除之前的错误信息
-            if "error_message" in metadata["documents"][doc_id.strip()]:
-                del metadata["documents"][doc_id.strip()]["error_message"]
-            upload_service._save_metadata(paths["metadata_file"], metadata)
+        # 更新状态为等待处理（同时清除之前的错误信息）
+        upload_service.reset_document_status(kb_name.strip(), doc_id.strip())
         
         # 添加到处理队列进行重新向量化
         from app.services.document_upload_service import processing_queue
+        from app.services.document_job_queue import PRIORITY_USER_ACTION
         
         task = {
             "doc_id": doc_id.strip(),
@@ -234,10 +205,12 @@ async def re_vectorize_document(doc_id: str, kb_name: str):
             "file_path": str(file_path),
             "vector_store_dir": str(paths["vector_store_dir"]),
             "metadata_file": str(paths["metadata_file"]),
-            "kb_name": kb_name.strip()
+            "kb_name": kb_name.strip(),
+            "force": True  # 文件未变化也重新向量化，旧向量会按清单原地替换
         }
         
-        processing_queue.add_task(task)
+        # 用户主动触发的重新处理优先于批量上传的任务
+        job_id = processing_queue.add_task(task, PRIORITY_USER_ACTION)
         
         return JSONResponse(content={
             "success": True,
@@ -245,7 +218,7 @@ async def re_vectorize_document(doc_id: str, kb_name: str):
             "data": {
                 "doc_id": doc_id.strip(),
                 "vector_status": "waiting",
-                "queue_position": processing_queue.queue.qsize()
+                "queue_position": processing_queue.queue_position(job_id)
             }
         })
         
@@ -272,6 +245,63 @@ async def get_processing_status():
         logger.error(f"获取处理状态失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取处理状态失败: {str(e)}")
 
+# SSE心跳间隔（秒），防止代理断开空闲连接
+EVENT_STREAM_HEARTBEAT = 15
+
+@router.get("/knowledge/api/documents/events")
+async def stream_ingestion_events(request: Request, kb_name: str):
+    """
+    以SSE推送知识库的文档入库进度
+
+    连接后先推送一条snapshot事件（各文档最新阶段和队列状态），之后推送：
+    - stage: 文档阶段变化（queued/parsing/embedding/indexing/hierarchical/retrying/completed/error），
+      包含分块数、已向量化分块数和吞吐量
+    - queue: 处理队列状态（等待数、各工作线程状态）
+    """
+    import asyncio
+    import json
+    from fastapi.responses import StreamingResponse
+    from app.services.ingestion_events import ingestion_events
+    from app.services.document_upload_service import processing_queue
+
+    if not kb_name or not kb_name.strip():
+        raise HTTPException(status_code=400, detail="知识库名称不能为空")
+    kb_name = kb_name.strip()
+
+    subscriber = ingestion_events.subscribe(kb_name)
+
+    def format_event(event: dict) -> str:
+        return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    async def event_stream():
+        try:
+            snapshot = ingestion_events.snapshot(kb_name)
+            if snapshot["queue"] is None:
+                snapshot["queue"] = await asyncio.to_thread(processing_queue.get_status)
+            yield format_event(snapshot)
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=EVENT_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_event(event)
+        finally:
+            ingestion_events.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @router.get("/knowledge/api/documents/hierarchical-status")
 async def get_hierarchical_index_status(kb_name: str):
     """
@@ -331,18 +361,14 @@ async def get_hierarchical_index_status(kb_name: str):
             except Exception as e:
                 logger.warning(f"读取重建记录失败: {str(e)}")
         
-        # 如果没有重建记录，尝试从元数据文件获取文档数量
-        if doc_count == 0:
-            metadata_file = base_dir / "data" / "knowledge_base" / kb_name / "content" / "documents_metadata.json"
-            if metadata_file.exists():
-                try:
-                    with open(metadata_file, "r", encoding="utf-8") as f:
-                        metadata = json.load(f)
-                        doc_count = len(metadata.get("documents", {}))
-                        group_count = 1 if doc_count > 0 else 0
-                        logger.info(f"从元数据文件获取文档统计: doc_count={doc_count}")
-                except Exception as e:
-                    logger.warning(f"读取元数据文件失败: {str(e)}")
+        # 如果没有重建记录，从文档元数据获取文档数量
+        if doc_count == 0 and (base_dir / "data" / "knowledge_base" / kb_name).exists():
+            try:
+                doc_count = upload_service.count_documents(kb_name)
+                group_count = 1 if doc_count > 0 else 0
+                logger.info(f"从文档元数据获取文档统计: doc_count={doc_count}")
+            except Exception as e:
+                logger.warning(f"读取文档元数据失败: {str(e)}")
         
         # 确定状态和推荐
         if doc_count == 0:
@@ -443,15 +469,12 @@ async def get_realtime_hierarchical_status(kb_name: str):
         # 获取文档数量
         doc_count = 0
         
-        # 从元数据文件获取文档数量
-        metadata_file = base_dir / "data" / "knowledge_base" / kb_name / "content" / "documents_metadata.json"
-        if metadata_file.exists():
+        # 从文档元数据获取文档数量
+        if (base_dir / "data" / "knowledge_base" / kb_name).exists():
             try:
-                with open(metadata_file, "r", encoding="utf-8") as f:
-                    metadata = json.load(f)
-                    doc_count = len(metadata.get("documents", {}))
+                doc_count = upload_service.count_documents(kb_name)
             except Exception as e:
-                logger.warning(f"读取元数据文件失败: {str(e)}")
+                logger.warning(f"读取文档元数据失败: {str(e)}")
         
         return JSONResponse(content={
             "success": True,
@@ -83,24 +83,6 @@ async def get_knowledge_bases(
                 or search_lower in kb.get("description", "").lower()
             ]
         
-        # 为每个知识库添加文档数量和embedding模型名称
-        for kb in knowledge_bases:
-            kb["document_count"] = kb_service.count_knowledge_base_documents(kb.get("name", ""))
-            
-            # 获取embedding模型名称
-            embedding_model_id = kb.get("embedding_model_id")
-            if embedding_model_id:
-                try:
-                    model_config = ModelConfigService.get_model_config_by_id(db, embedding_model_id)
-                    if model_config:
-                        kb["embedding_model_name"] = f"{model_config.model_name} ({model_config.provider_name})"
-                    else:
-                        kb["embedding_model_name"] = "模型配置已删除"
-                except Exception as e:
-                    kb["embedding_model_name"] = "获取模型信息失败"
-            else:
-                kb["embedding_model_name"] = kb.get("embedding_model", "未配置")
-        
         # 分页处理
         total = len(knowledge_bases)
         start_index = (page - 1) * page_size
@@ -108,6 +90,9 @@ async def get_knowledge_bases(
         
         paginated_kbs = knowledge_bases[start_index:end_index]
         
+        # 只为当前页的知识库添加文档数量和embedding模型名称（模型名称批量查询）
+        kb_service.attach_list_stats(paginated_kbs, db)
+        
         # 修复返回格式，符合前端期望
         return JSONResponse(content={
             "success": True,
@@ -328,9 +313,6 @@ async def upload_documents(
         uploaded_files = []
         failed_files = []
         
-        # 加载现有元数据
-        metadata = metadata_service.load_documents_metadata(kb_name)
-        
         for file in files:
             try:
                 if not file.filename:
@@ -388,8 +370,8 @@ async def upload_documents(
                     "problem_status": "正常"
                 }
                 
-                # 添加到元数据
-                metadata["documents"][doc_id] = doc_metadata
+                # 添加到元数据（单行写入）
+                metadata_service.update_document_metadata(kb_name, doc_id, doc_metadata)
                 
                 uploaded_files.append({
                     "id": doc_id,
@@ -400,9 +382,6 @@ async def upload_documents(
             except Exception as e:
                 failed_files.append({"filename": file.filename, "error": str(e)})
         
-        # 保存元数据
-        metadata_service.save_documents_metadata(kb_name, metadata)
-        
         return JSONResponse(content={
             "success": True,
             "message": f"成功上传 {len(uploaded_files)} 个文件",
@@ -539,7 +518,7 @@ async def delete_document(
             file_path.unlink()
         
         # 删除向量数据
-        vector_service.delete_document_vectors(kb_name, doc_id)
+        vector_service.delete_document_vectors(kb_name, doc_id, filename)
         
         # 删除元数据
         if metadata_service.delete_document_metadata(kb_name, doc_id):
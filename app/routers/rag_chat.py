@@ -6,7 +6,6 @@ RAG聊天路由
 import os
 import json
 import sys
-import asyncio
 from typing import List, Dict, Any, Optional, Union
 from fastapi import APIRouter, HTTPException, Request, Query, Depends
 from fastapi.responses import HTMLResponse, StreamingResponse
@@ -75,6 +74,8 @@ class ChatMessage(BaseModel):
     # RAG配置参数 - 生成器配置
     temperature: Optional[float] = 0.3
     memory_window: Optional[int] = 5
+    # 是否使用回答缓存（False时跳过缓存，重新检索和生成）
+    use_cache: Optional[bool] = True
     # 修复字段名冲突：model_config改为selected_model
     selected_model: Optional[ModelConfig] = None
 
@@ -104,6 +105,8 @@ class ChatRequest(BaseModel):
     # RAG配置参数 - 生成器配置
     temperature: Optional[float] = 0.3
     memory_window: Optional[int] = 5
+    # 是否使用回答缓存（False时跳过缓存，重新检索和生成）
+    use_cache: Optional[bool] = True
     # 检索器类型配置
     retriever_type: Optional[str] = "auto"
     # 修复字段名冲突：model_config改为selected_model
@@ -126,8 +129,8 @@ def get_model_config_from_db(db: Session, model_id: int) -> Optional[dict]:
         print(f"获取模型配置失败: {e}")
         return None
 
-def create_dynamic_rag_generator(model_config: dict = None, rag_config: dict = None):
-    """创建动态RAG生成器"""
+def create_dynamic_rag_generator(model_config: dict = None, rag_config: dict = None, session_id: Optional[str] = None):
+    """创建动态RAG生成器（指定session_id时使用该会话的对话历史）"""
     if RAGGenerator is None:
         print("RAGGenerator类不可用")
         return None
@@ -226,7 +229,8 @@ def create_dynamic_rag_generator(model_config: dict = None, rag_config: dict = N
                 score_threshold=threshold,
                 weight_keyword_freq=0.4,  # 使用默认权重
                 weight_keyword_pos=0.3,
-                weight_keyword_coverage=0.3
+                weight_keyword_coverage=0.3,
+                session_id=session_id
             )
         else:
             print("使用默认模型配置")
@@ -245,7 +249,8 @@ def create_dynamic_rag_generator(model_config: dict = None, rag_config: dict = N
                 score_threshold=threshold,
                 weight_keyword_freq=0.4,  # 使用默认权重
                 weight_keyword_pos=0.3,
-                weight_keyword_coverage=0.3
+                weight_keyword_coverage=0.3,
+                session_id=session_id
             )
         
         print("✅ 动态RAG生成器初始化成功")
@@ -297,15 +302,29 @@ def init_rag_generator():
     
     return rag_generator
 
+def format_source_documents(source_documents) -> List[Dict[str, Any]]:
+    """格式化源文档信息（按源文件去重）"""
+    source_docs = []
+    seen_sources = set()  # 用于记录已经见过的源文件
+    
+    for doc in source_documents:
+        source_name = os.path.basename(doc.metadata.get("source", "未知来源"))
+        
+        # 如果这个源文件还没有被添加过，则添加
+        if source_name not in seen_sources:
+            seen_sources.add(source_name)
+            source_docs.append({
+                "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
+                "source": source_name,
+                "page": doc.metadata.get("page", None)
+            })
+    return source_docs
+
 def load_knowledge_bases() -> List[Dict[str, Any]]:
-    """加载知识库列表"""
+    """加载知识库列表（使用知识库注册表缓存）"""
     try:
-        kb_file = os.path.join("data", "knowledge_base", "knowledge_bases.json")
-        if os.path.exists(kb_file):
-            with open(kb_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get("knowledge_bases", [])
-        return []
+        from app.services.knowledge_base_service import KnowledgeBaseService
+        return KnowledgeBaseService().load_knowledge_bases()
     except Exception as e:
         print(f"加载知识库列表失败: {e}")
         return []
@@ -320,12 +339,7 @@ async def get_knowledge_bases():
         from app.services.knowledge_base_service import KnowledgeBaseService
         kb_service = KnowledgeBaseService()
         
-        for kb in knowledge_bases:
-            kb_name = kb.get("name", "")
-            if kb_name:
-                kb["document_count"] = kb_service.count_knowledge_base_documents(kb_name)
-            else:
-                kb["document_count"] = 0
+        kb_service.attach_list_stats(knowledge_bases)
         
         return {
             "success": True,
@@ -366,7 +380,7 @@ async def rag_chat(chat_request: ChatMessage, db: Session = Depends(get_db)):
         }
         
         # 创建动态RAG生成器
-        generator = create_dynamic_rag_generator(model_config, rag_config)
+        generator = create_dynamic_rag_generator(model_config, rag_config, chat_request.session_id)
         if generator is None:
             # 如果RAG生成器不可用，返回简单的回复
             return {
@@ -385,29 +399,16 @@ async def rag_chat(chat_request: ChatMessage, db: Session = Depends(get_db)):
         print(f"使用RAG配置 - top_k: {rag_config['top_k']}, threshold: {rag_config['threshold']}, "
               f"context_window: {rag_config['context_window']}, temperature: {rag_config['temperature']}{model_info}")
         
-        # 使用RAG生成器进行查询和生成
-        result = generator.retrieve_and_generate(
+        # 使用RAG生成器进行查询和生成（检索在专用线程池中执行，不阻塞事件循环）
+        result = await generator.aretrieve_and_generate(
             query=chat_request.message,
             knowledge_base_ids=kb_ids,
-            return_source_documents=True
+            return_source_documents=True,
+            use_cache=chat_request.use_cache is not False
         )
         
         # 格式化源文档信息
-        source_docs = []
-        if "source_documents" in result:
-            seen_sources = set()  # 用于记录已经见过的源文件
-            
-            for doc in result["source_documents"]:
-                source_name = os.path.basename(doc.metadata.get("source", "未知来源"))
-                
-                # 如果这个源文件还没有被添加过，则添加
-                if source_name not in seen_sources:
-                    seen_sources.add(source_name)
-                    source_docs.append({
-                        "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                        "source": source_name,
-                        "page": doc.metadata.get("page", None)
-                    })
+        source_docs = format_source_documents(result.get("source_documents", []))
         
         return {
             "success": True,
@@ -415,6 +416,8 @@ async def rag_chat(chat_request: ChatMessage, db: Session = Depends(get_db)):
             "query": result.get("query", chat_request.message),
             "source_documents": source_docs,
             "knowledge_bases_used": kb_ids,
+            "context_stats": result.get("context_stats"),
+            "cached": result.get("cached", False),
             "config_used": {
                 "top_k": rag_config['top_k'],
                 "threshold": rag_config['threshold'],
@@ -495,7 +498,7 @@ async def rag_chat_stream(chat_request: ChatRequest, db: Session = Depends(get_d
             }
             
             # 创建动态RAG生成器
-            generator = create_dynamic_rag_generator(model_config, rag_config)
+            generator = create_dynamic_rag_generator(model_config, rag_config, chat_request.session_id)
             if generator is None:
                 error_msg = "RAG系统当前不可用，请检查配置和依赖。"
                 yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
@@ -515,13 +518,26 @@ async def rag_chat_stream(chat_request: ChatRequest, db: Session = Depends(get_d
             # 执行真正的RAG检索和生成
             print(f"执行RAG查询: {chat_request.message}, 知识库: {kb_ids}")
             
+            timings = {}
             try:
-                result = generator.retrieve_and_generate(
+                # 检索完成后立即发送来源（此时大模型请求已发出），文本片段到达后立即转发
+                async for event in generator.astream_retrieve_and_generate(
                     query=chat_request.message,
                     knowledge_base_ids=kb_ids,
-                    return_source_documents=True,
-                    retriever_type=chat_request.retriever_type or "auto"  # 传递检索器类型
-                )
+                    retriever_type=chat_request.retriever_type or "auto",  # 传递检索器类型
+                    use_cache=chat_request.use_cache is not False
+                ):
+                    if event["type"] == "sources":
+                        sources = format_source_documents(event["source_documents"])
+                        yield f"data: {json.dumps({'type': 'sources', 'sources': sources, 'retrieval_ms': event['retrieval_ms']})}\n\n"
+                    elif event["type"] == "token":
+                        yield f"data: {json.dumps({'type': 'message', 'content': event['content']})}\n\n"
+                    elif event["type"] == "answer":
+                        timings = dict(event["timings"], cached=event.get("cached", False))
+                        context_stats = event.get("context_stats")
+                        if context_stats:
+                            timings["context_tokens"] = context_stats["context_tokens"]
+                            timings["context_tokens_saved"] = context_stats["tokens_saved"]
             except Exception as api_error:
                 # 检查是否是API连接错误
                 error_str = str(api_error)
@@ -538,40 +554,8 @@ async def rag_chat_stream(chat_request: ChatRequest, db: Session = Depends(get_d
                 yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
                 return
             
-            # 获取生成的回答
-            answer = result.get("answer", "未能生成回答")
-            
-            # 逐字符流式发送回答
-            for char in answer:
-                yield f"data: {json.dumps({'type': 'message', 'content': char})}\n\n"
-                await asyncio.sleep(0.03)  # 控制发送速度，模拟真实的生成过程
-            
-            # 发送源文档信息（如果有）
-            source_documents = result.get("source_documents", [])
-            if source_documents:
-                # 使用集合来去重源文档
-                seen_sources = set()
-                unique_sources = []
-                
-                for doc in source_documents:
-                    source_name = os.path.basename(doc.metadata.get("source", "未知来源"))
-                    # 只有当源文档名称未出现过时才添加
-                    if source_name not in seen_sources:
-                        seen_sources.add(source_name)
-                        unique_sources.append(source_name)
-                
-                if unique_sources:
-                    source_info = "\n\n📚 参考来源:\n"
-                    for i, source_name in enumerate(unique_sources[:3], 1):  # 只显示前3个不重复的源文档
-                        source_info += f"{i}. {source_name}\n"
-                    
-                    # 发送源文档信息
-                    for char in source_info:
-                        yield f"data: {json.dumps({'type': 'message', 'content': char})}\n\n"
-                        await asyncio.sleep(0.01)
-            
-            # 发送完成信号
-            yield f"data: {json.dumps({'type': 'done'})}\n\n"
+            # 发送完成信号（附带各阶段耗时和上下文token数）
+            yield f"data: {json.dumps({'type': 'done', **timings})}\n\n"
             
         except Exception as e:
             print(f"流式RAG聊天处理失败: {e}")
@@ -590,9 +574,14 @@ async def rag_chat_stream(chat_request: ChatRequest, db: Session = Depends(get_d
     )
 
 @router.post("/api/clear-history")
-async def clear_chat_history():
-    """清除聊天历史"""
+async def clear_chat_history(session_id: Optional[str] = None):
+    """清除聊天历史（指定session_id时清除该会话）"""
     try:
+        if session_id:
+            from conversation_store import conversation_store
+            conversation_store.clear(session_id)
+            return {"success": True, "message": "聊天历史已清除"}
+        
         generator = get_rag_generator()
         if generator:
             generator.clear_history()
@@ -600,6 +589,34 @@ async def clear_chat_history():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"清除历史失败: {str(e)}")
 
+@router.get("/api/answer-cache/stats")
+async def get_answer_cache_stats():
+    """回答缓存统计（命中率、条目数等）"""
+    try:
+        from answer_cache import answer_cache
+        return {"success": True, "stats": answer_cache.get_stats()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取回答缓存统计失败: {str(e)}")
+
+@router.get("/api/retrieval-cache/stats")
+async def get_retrieval_cache_stats():
+    """检索结果缓存统计（命中率、条目数等）和并发合并的请求数"""
+    try:
+        from rag_retrievers import get_retrieval_cache_stats
+        return {"success": True, "stats": get_retrieval_cache_stats()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取检索结果缓存统计失败: {str(e)}")
+
+@router.post("/api/answer-cache/clear")
+async def clear_answer_cache():
+    """清空回答缓存"""
+    try:
+        from answer_cache import answer_cache
+        answer_cache.clear()
+        return {"success": True, "message": "回答缓存已清空"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"清空回答缓存失败: {str(e)}")
+
 @router.get("/api/test")
 async def test_rag_system():
     """测试RAG系统状态"""
@@ -613,9 +630,10 @@ async def test_rag_system():
             }
         
         # 简单测试查询
-        test_result = generator.retrieve_and_generate(
+        test_result = await generator.aretrieve_and_generate(
             query="测试查询",
-            return_source_documents=False
+            return_source_documents=False,
+            use_cache=False
         )
         
         return {
@@ -0,0 +1,367 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 优先级：数值越小越先处理。用户主动操作（如重新向量化）最优先，其余按文件大小分档，
+# 同一档内按入队顺序处理，避免一个超大文件阻塞后面所有小文件
+PRIORITY_USER_ACTION = 0
+_SIZE_PRIORITY_TIERS = [
+    (1 * 1024 * 1024, 10),
+    (10 * 1024 * 1024, 20),
+    (100 * 1024 * 1024, 30),
+]
+PRIORITY_LARGE_FILE = 40
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS document_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kb_name TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    filename TEXT NOT NULL DEFAULT '',
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 20,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    next_run_at REAL NOT NULL DEFAULT 0,
+    worker TEXT,
+    started_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_document_jobs_claim ON document_jobs(status, priority, next_run_at, id);
+CREATE INDEX IF NOT EXISTS idx_document_jobs_doc ON document_jobs(kb_name, doc_id, status);
+CREATE TABLE IF NOT EXISTS document_workers (
+    name TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    job_id INTEGER,
+    task TEXT,
+    attempt INTEGER,
+    started_at REAL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    heartbeat_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS document_job_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+"""
+
+
+def _pid_alive(pid: int) -> bool:
+    """本机进程是否存在（Windows上os.kill会结束进程，只依赖心跳超时判断）"""
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def compute_priority(file_size: Optional[int], user_action: bool = False) -> int:
+    """根据文件大小或用户操作计算任务优先级"""
+    if user_action:
+        return PRIORITY_USER_ACTION
+    if file_size is None:
+        return _SIZE_PRIORITY_TIERS[1][1]
+    for limit, priority in _SIZE_PRIORITY_TIERS:
+        if file_size < limit:
+            return priority
+    return PRIORITY_LARGE_FILE
+
+
+class DocumentJobStore:
+    """
+    基于SQLite的持久化文档处理任务表
+
+    任务状态: pending（等待，包括等待重试）→ running → completed / failed。
+    领取任务在BEGIN IMMEDIATE事务中完成，多个工作线程（或进程）不会领取到同一个任务。
+    工作线程定期写入心跳，进程退出后其运行中的任务由requeue_orphaned重新排队。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA busy_timeout=30000")
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def enqueue(self, task: Dict[str, Any], priority: int, max_attempts: int) -> int:
+        """
+        添加任务；同一文档已有等待中的任务时合并（更新任务内容，优先级取较高者）
+
+        Returns:
+            任务ID
+        """
+        now = time.time()
+        payload = json.dumps(task, ensure_ascii=False)
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, priority FROM document_jobs WHERE kb_name = ? AND doc_id = ? AND status = 'pending'",
+                (task.get("kb_name") or "", task["doc_id"])
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE document_jobs SET payload = ?, priority = ?, attempts = 0, max_attempts = ?, "
+                    "next_run_at = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+                    (payload, min(priority, row["priority"]), max_attempts, now, now, row["id"])
+                )
+                return row["id"]
+            cursor = conn.execute(
+                "INSERT INTO document_jobs (kb_name, doc_id, filename, payload, priority, status, "
+                "max_attempts, next_run_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'pending', ?, ?, ?, ?)",
+                (task.get("kb_name") or "", task["doc_id"], task.get("filename", ""), payload,
+                 priority, max_attempts, now, now, now)
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """领取一个到期的最高优先级任务"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM document_jobs WHERE status = 'pending' AND next_run_at <= ? "
+                "ORDER BY priority, id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute(
+                "UPDATE document_jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                "started_at = ?, updated_at = ? WHERE id = ?",
+                (worker, now, now, row["id"])
+            )
+        job = self._row_to_job(row)
+        job.update({"status": "running", "worker": worker, "attempts": row["attempts"] + 1, "started_at": now})
+        return job
+
+    def complete(self, job_id: int):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE document_jobs SET status = 'completed', last_error = NULL, updated_at = ? WHERE id = ?",
+                (now, job_id)
+            )
+
+    def fail(self, job_id: int, error: str, retry_delay: Optional[float]) -> bool:
+        """
+        记录任务失败；retry_delay不为None时重新进入等待并在延迟后重试
+
+        Returns:
+            是否会重试
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            if retry_delay is not None:
+                conn.execute(
+                    "UPDATE document_jobs SET status = 'pending', next_run_at = ?, last_error = ?, "
+                    "worker = NULL, updated_at = ? WHERE id = ?",
+                    (now + retry_delay, error, now, job_id)
+                )
+                return True
+            conn.execute(
+                "UPDATE document_jobs SET status = 'failed', last_error = ?, updated_at = ? WHERE id = ?",
+                (error, now, job_id)
+            )
+            return False
+
+    def requeue_orphaned(self, lease_seconds: float) -> int:
+        """
+        将失去工作线程的运行中任务重新放回等待队列
+
+        工作线程所在进程已退出（本机进程不存在、或心跳超过lease_seconds未更新）时，
+        它领取的任务视为中断。其他进程中仍在运行的任务不受影响。
+        """
+        now = time.time()
+        host = socket.gethostname()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT j.id, j.worker, w.host, w.pid, w.heartbeat_at FROM document_jobs j "
+                "LEFT JOIN document_workers w ON w.name = j.worker WHERE j.status = 'running'"
+            ).fetchall()
+            orphaned = [
+                row["id"] for row in rows
+                if row["host"] is None
+                or row["heartbeat_at"] < now - lease_seconds
+                or (row["host"] == host and not _pid_alive(row["pid"]))
+            ]
+            for job_id in orphaned:
+                conn.execute(
+                    "UPDATE document_jobs SET status = 'pending', worker = NULL, next_run_at = ?, "
+                    "updated_at = ? WHERE id = ? AND status = 'running'",
+                    (now, now, job_id)
+                )
+            # 清理已退出进程的工作线程记录
+            conn.execute("DELETE FROM document_workers WHERE heartbeat_at < ?", (now - lease_seconds,))
+        return len(orphaned)
+
+    # ---- 工作线程心跳（多个进程共享，用于状态展示和中断任务恢复） ----
+
+    def heartbeat(self, workers: List[Dict[str, Any]]):
+        """写入本进程各工作线程的状态"""
+        now = time.time()
+        host = socket.gethostname()
+        pid = os.getpid()
+        with self._transaction() as conn:
+            for worker in workers:
+                task = worker.get("task")
+                conn.execute(
+                    "INSERT OR REPLACE INTO document_workers (name, host, pid, job_id, task, attempt, started_at, "
+                    "processed, failed, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (worker["name"], host, pid, worker.get("job_id"),
+                     json.dumps(task, ensure_ascii=False) if task else None,
+                     worker.get("attempt"), worker.get("started_at"),
+                     worker.get("processed", 0), worker.get("failed", 0), now)
+                )
+
+    def remove_workers(self, names: List[str]):
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM document_workers WHERE name = ?", [(name,) for name in names])
+
+    def list_workers(self, lease_seconds: float) -> List[Dict[str, Any]]:
+        """心跳未超时的工作线程"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM document_workers WHERE heartbeat_at >= ? ORDER BY name",
+                (time.time() - lease_seconds,)
+            ).fetchall()
+        workers = []
+        for row in rows:
+            worker = dict(row)
+            worker["task"] = json.loads(worker["task"]) if worker["task"] else None
+            workers.append(worker)
+        return workers
+
+    # ---- 跨进程事件（独立工作进程写入，API进程转发到SSE事件总线） ----
+
+    def add_event(self, event: Dict[str, Any]):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO document_job_events (created_at, payload) VALUES (?, ?)",
+                (time.time(), json.dumps(event, ensure_ascii=False))
+            )
+
+    def events_after(self, last_id: int, limit: int = 500) -> List[Tuple[int, Dict[str, Any]]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, payload FROM document_job_events WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, limit)
+            ).fetchall()
+        return [(row["id"], json.loads(row["payload"])) for row in rows]
+
+    def last_event_id(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM document_job_events").fetchone()[0]
+
+    def purge_events(self, older_than_seconds: float) -> int:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM document_job_events WHERE created_at < ?",
+                (time.time() - older_than_seconds,)
+            )
+        return cursor.rowcount
+
+    def cancel(self, kb_name: str, doc_id: str) -> int:
+        """取消文档等待中的任务（文档被删除时）"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM document_jobs WHERE kb_name = ? AND doc_id = ? AND status = 'pending'",
+                (kb_name, doc_id)
+            )
+        return cursor.rowcount
+
+    def purge_finished(self, older_than_seconds: float) -> int:
+        """清理已结束的旧任务记录"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM document_jobs WHERE status IN ('completed', 'failed') AND updated_at < ?",
+                (time.time() - older_than_seconds,)
+            )
+        return cursor.rowcount
+
+    def next_run_at(self) -> Optional[float]:
+        """最近一个等待中任务的可执行时间"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT MIN(next_run_at) FROM document_jobs WHERE status = 'pending'").fetchone()
+        return row[0]
+
+    def position(self, job_id: int) -> int:
+        """任务在等待队列中的位置（从1开始）"""
+        with self._connect() as conn:
+            job = conn.execute("SELECT priority FROM document_jobs WHERE id = ?", (job_id,)).fetchone()
+            if not job:
+                return 0
+            return conn.execute(
+                "SELECT COUNT(*) FROM document_jobs WHERE status = 'pending' AND "
+                "(priority < ? OR (priority = ? AND id <= ?))",
+                (job["priority"], job["priority"], job_id)
+            ).fetchone()[0]
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数量"""
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM document_jobs GROUP BY status").fetchall()
+            retrying = conn.execute(
+                "SELECT COUNT(*) FROM document_jobs WHERE status = 'pending' AND attempts > 0 AND next_run_at > ?",
+                (now,)
+            ).fetchone()[0]
+        counts = {"pending": 0, "running": 0, "completed": 0, "failed": 0}
+        counts.update({row["status"]: row["n"] for row in rows})
+        counts["retrying"] = retrying
+        return counts
+
+    def list_jobs(self, status: str, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM document_jobs WHERE status = ? ORDER BY priority, id LIMIT ?",
+                (status, limit)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+
+def get_default_job_db_path() -> str:
+    return os.getenv("DOCUMENT_QUEUE_DB", os.path.join("data", "document_jobs.db"))
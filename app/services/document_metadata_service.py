@@ -1,9 +1,10 @@
 import os
-import json
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 
+from .document_metadata_store import DocumentMetadataStore, get_document_store
+
 logger = logging.getLogger(__name__)
 
 class DocumentMetadataService:
@@ -13,7 +14,10 @@ class DocumentMetadataService:
         # 获取项目根目录
         self.base_dir = Path(__file__).resolve().parent.parent.parent
         self.knowledge_base_dir = self.base_dir / "data" / "knowledge_base"
-        self.documents_metadata_file = "documents_metadata.json"
+    
+    def _get_store(self, kb_name: str) -> DocumentMetadataStore:
+        """获取知识库的文档元数据存储（SQLite）"""
+        return get_document_store(self.knowledge_base_dir / kb_name)
     
     def load_documents_metadata(self, kb_name: str) -> Dict[str, Any]:
         """
@@ -25,21 +29,12 @@ class DocumentMetadataService:
         Returns:
             包含文档元数据的字典
         """
-        metadata_file = self.knowledge_base_dir / kb_name / "content" / self.documents_metadata_file
-        
         # 确保content目录存在
         content_dir = self.knowledge_base_dir / kb_name / "content"
         os.makedirs(content_dir, exist_ok=True)
         
-        # 如果元数据文件不存在，创建一个空的元数据文件
-        if not metadata_file.exists():
-            metadata = {"documents": {}}
-            self.save_documents_metadata(kb_name, metadata)
-            return metadata
-        
         try:
-            with open(metadata_file, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return {"documents": self._get_store(kb_name).all()}
         except Exception as e:
             logger.error(f"加载文档元数据失败: {str(e)}")
             # 如果加载失败，返回空元数据
@@ -47,7 +42,7 @@ class DocumentMetadataService:
     
     def save_documents_metadata(self, kb_name: str, metadata: Dict[str, Any]) -> bool:
         """
-        保存知识库文档元数据
+        保存知识库文档元数据（整体覆盖，单个文档请使用update_document_metadata）
         
         Args:
             kb_name: 知识库名称
@@ -57,14 +52,7 @@ class DocumentMetadataService:
             是否保存成功
         """
         try:
-            metadata_file = self.knowledge_base_dir / kb_name / "content" / self.documents_metadata_file
-            
-            # 确保content目录存在
-            content_dir = self.knowledge_base_dir / kb_name / "content"
-            os.makedirs(content_dir, exist_ok=True)
-            
-            with open(metadata_file, "w", encoding="utf-8") as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=4)
+            self._get_store(kb_name).replace_all(metadata.get("documents", {}))
             return True
         except Exception as e:
             logger.error(f"保存文档元数据失败: {str(e)}")
@@ -83,14 +71,27 @@ class DocumentMetadataService:
             是否更新成功
         """
         try:
-            # 加载现有元数据
-            all_metadata = self.load_documents_metadata(kb_name)
-            
-            # 更新指定文档的元数据
-            all_metadata["documents"][doc_id] = metadata
+            self._get_store(kb_name).upsert(doc_id, metadata)
+            return True
+        except Exception as e:
+            logger.error(f"更新文档元数据失败: {str(e)}")
+            return False
+    
+    def update_document_fields(self, kb_name: str, doc_id: str, fields: Dict[str, Any], remove_fields: List[str] = None) -> bool:
+        """
+        更新单个文档的部分字段
+        
+        Args:
+            kb_name: 知识库名称
+            doc_id: 文档ID
+            fields: 需要更新的字段
+            remove_fields: 需要删除的字段
             
-            # 保存更新后的元数据
-            return self.save_documents_metadata(kb_name, all_metadata)
+        Returns:
+            文档存在且更新成功
+        """
+        try:
+            return self._get_store(kb_name).update_fields(doc_id, fields, remove_fields or ())
         except Exception as e:
             logger.error(f"更新文档元数据失败: {str(e)}")
             return False
@@ -107,17 +108,9 @@ class DocumentMetadataService:
             是否删除成功
         """
         try:
-            # 加载现有元数据
-            all_metadata = self.load_documents_metadata(kb_name)
-            
-            # 如果文档ID存在于元数据中，删除它
-            if doc_id in all_metadata["documents"]:
-                del all_metadata["documents"][doc_id]
-                
-                # 保存更新后的元数据
-                return self.save_documents_metadata(kb_name, all_metadata)
-            
-            return True  # 如果文档不存在于元数据中，视为删除成功
+            # 如果文档不存在于元数据中，视为删除成功
+            self._get_store(kb_name).delete(doc_id)
+            return True
         except Exception as e:
             logger.error(f"删除文档元数据失败: {str(e)}")
             return False
@@ -134,12 +127,32 @@ class DocumentMetadataService:
             文档元数据或None
         """
         try:
-            all_metadata = self.load_documents_metadata(kb_name)
-            return all_metadata["documents"].get(doc_id)
+            return self._get_store(kb_name).get(doc_id)
         except Exception as e:
             logger.error(f"获取文档元数据失败: {str(e)}")
             return None
     
+    def find_document_by_filename(self, kb_name: str, filename: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        按文件名查找文档
+        
+        Returns:
+            (doc_id, 文档元数据) 或 None
+        """
+        try:
+            return self._get_store(kb_name).find_by_filename(filename)
+        except Exception as e:
+            logger.error(f"查找文档失败: {str(e)}")
+            return None
+    
+    def count_documents(self, kb_name: str) -> int:
+        """统计知识库中的文档数量"""
+        try:
+            return self._get_store(kb_name).count()
+        except Exception as e:
+            logger.error(f"统计文档数量失败: {str(e)}")
+            return 0
+    
     def list_documents(self, kb_name: str, page: int = 1, limit: int = 10, search: Optional[str] = None) -> Dict[str, Any]:
         """
         获取文档列表
@@ -154,35 +167,8 @@ class DocumentMetadataService:
             文档列表和分页信息
         """
         try:
-            # 加载元数据
-            metadata = self.load_documents_metadata(kb_name)
-            documents = metadata.get("documents", {})
-            
-            # 将文档转换为列表格式
-            doc_list = []
-            for doc_id, doc_info in documents.items():
-                doc_data = doc_info.copy()
-                doc_data["id"] = doc_id
-                doc_list.append(doc_data)
-            
-            # 应用搜索过滤
-            if search:
-                search_lower = search.lower()
-                doc_list = [
-                    doc for doc in doc_list
-                    if search_lower in doc.get("filename", "").lower()
-                    or search_lower in doc.get("file_type_text", "").lower()
-                ]
-            
-            # 按上传时间排序（最新的在前）
-            doc_list.sort(key=lambda x: x.get("upload_time", ""), reverse=True)
-            
-            # 分页处理
-            total = len(doc_list)
-            start_index = (page - 1) * limit
-            end_index = start_index + limit
-            
-            paginated_docs = doc_list[start_index:end_index]
+            # 按上传时间倒序的索引分页查询
+            paginated_docs, total = self._get_store(kb_name).list_page(page, limit, search)
             
             return {
                 "success": True,
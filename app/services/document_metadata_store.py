@@ -0,0 +1,341 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每个知识库一个SQLite数据库，位于知识库目录下（不放在content目录，避免被当作文档加载）
+METADATA_DB_FILENAME = "documents_metadata.db"
+# 旧版JSON元数据文件，首次打开数据库时导入
+LEGACY_METADATA_FILENAME = "documents_metadata.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL DEFAULT '',
+    file_type_text TEXT NOT NULL DEFAULT '',
+    upload_time TEXT NOT NULL DEFAULT '',
+    vector_status TEXT NOT NULL DEFAULT '',
+    has_vector INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_upload_time ON documents(upload_time);
+CREATE INDEX IF NOT EXISTS idx_documents_vector_status ON documents(vector_status);
+CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents(filename);
+CREATE TABLE IF NOT EXISTS store_info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_stores: Dict[str, "DocumentMetadataStore"] = {}
+_stores_lock = threading.Lock()
+
+
+def get_document_store(kb_dir: Path) -> "DocumentMetadataStore":
+    """获取知识库的文档元数据存储（按知识库目录缓存实例）"""
+    key = os.path.abspath(str(kb_dir))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = DocumentMetadataStore(Path(key))
+            _stores[key] = store
+        return store
+
+
+def get_document_store_for_metadata_file(metadata_file: Path) -> "DocumentMetadataStore":
+    """根据旧版元数据文件路径（kb/content/documents_metadata.json）获取存储"""
+    return get_document_store(Path(metadata_file).parent.parent)
+
+
+class DocumentMetadataStore:
+    """
+    基于SQLite（WAL模式）的知识库文档元数据存储
+
+    完整的文档元数据以JSON保存在data列，常用于查询和排序的字段
+    （filename、upload_time、vector_status等）冗余为独立列并建立索引：
+    状态更新只写一行，分页列表是带索引的查询。
+    首次打开时自动导入content/documents_metadata.json，导入后原文件重命名为.migrated。
+    """
+
+    def __init__(self, kb_dir: Path):
+        self.kb_dir = Path(kb_dir)
+        self.db_path = self.kb_dir / METADATA_DB_FILENAME
+        self.legacy_file = self.kb_dir / "content" / LEGACY_METADATA_FILENAME
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        # 文档总数计数器：由本进程的写操作维护，数据库文件被其他进程修改时重新统计
+        self._write_lock = threading.Lock()
+        self._count: Optional[int] = None
+        self._count_stamp = None
+
+    @contextmanager
+    def _connect(self):
+        """打开数据库连接（每次操作独立连接，可跨线程使用）"""
+        self._ensure_initialized()
+        conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA busy_timeout=30000")
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """写事务（BEGIN IMMEDIATE，避免读锁升级为写锁时冲突）"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _ensure_initialized(self):
+        # 知识库目录被删除后重建时需要重新初始化
+        if self._initialized and self.db_path.exists():
+            return
+        with self._init_lock:
+            if self._initialized and self.db_path.exists():
+                return
+            self.kb_dir.mkdir(parents=True, exist_ok=True)
+            self._count = None
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(_SCHEMA)
+                self._migrate_legacy_json(conn)
+            finally:
+                conn.close()
+            self._initialized = True
+
+    def _migrate_legacy_json(self, conn: sqlite3.Connection):
+        """将旧版JSON元数据导入数据库（只执行一次）"""
+        if conn.execute("SELECT value FROM store_info WHERE key = 'migrated_from_json'").fetchone():
+            return
+
+        documents = {}
+        if self.legacy_file.exists():
+            try:
+                with self.legacy_file.open("r", encoding="utf-8") as f:
+                    content = f.read()
+                documents = json.loads(content).get("documents", {}) if content.strip() else {}
+            except Exception as e:
+                logger.error(f"读取旧版元数据文件失败，跳过导入: {self.legacy_file}: {str(e)}")
+                return
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO documents "
+                "(doc_id, filename, file_type_text, upload_time, vector_status, has_vector, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [self._row_values(doc_id, doc) for doc_id, doc in documents.items()]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO store_info (key, value) VALUES ('migrated_from_json', ?)",
+                (str(len(documents)),)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        if self.legacy_file.exists():
+            try:
+                self.legacy_file.replace(self.legacy_file.with_name(LEGACY_METADATA_FILENAME + ".migrated"))
+            except OSError as e:
+                logger.warning(f"重命名旧版元数据文件失败: {str(e)}")
+        if documents:
+            logger.info(f"已将 {len(documents)} 条文档元数据从JSON导入数据库: {self.db_path}")
+
+    @staticmethod
+    def _row_values(doc_id: str, doc: Dict[str, Any]) -> Tuple:
+        return (
+            doc_id,
+            str(doc.get("filename") or ""),
+            str(doc.get("file_type_text") or ""),
+            str(doc.get("upload_time") or ""),
+            str(doc.get("vector_status") or ""),
+            1 if doc.get("has_vector") else 0,
+            json.dumps(doc, ensure_ascii=False),
+        )
+
+    def _upsert(self, conn: sqlite3.Connection, doc_id: str, doc: Dict[str, Any]):
+        conn.execute(
+            "INSERT OR REPLACE INTO documents "
+            "(doc_id, filename, file_type_text, upload_time, vector_status, has_vector, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            self._row_values(doc_id, doc)
+        )
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """获取单个文档的元数据"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT data FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def exists(self, doc_id: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone() is not None
+
+    def _file_stamp(self) -> Tuple:
+        """数据库文件和WAL文件的(修改时间, 大小)，用于判断计数器是否仍然有效"""
+        stamp = []
+        for path in (self.db_path, self.db_path.with_name(self.db_path.name + "-wal")):
+            try:
+                stat = path.stat()
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    @contextmanager
+    def _counted_write(self):
+        """
+        执行写事务并维护文档计数器
+
+        写入前计数器有效时按本次增减的文档数更新，否则丢弃计数器，下次count()时重新统计。
+        """
+        with self._write_lock:
+            valid = self._count is not None and self._count_stamp == self._file_stamp()
+            delta = [0]
+            with self._transaction() as conn:
+                yield conn, delta
+            if valid:
+                self._count += delta[0]
+                self._count_stamp = self._file_stamp()
+            else:
+                self._count = None
+
+    def upsert(self, doc_id: str, doc: Dict[str, Any]):
+        """新增或整体替换单个文档的元数据"""
+        with self._counted_write() as (conn, delta):
+            if conn.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone() is None:
+                delta[0] += 1
+            self._upsert(conn, doc_id, doc)
+
+    def update_fields(
+        self,
+        doc_id: str,
+        fields: Dict[str, Any],
+        remove_fields: Iterable[str] = ()
+    ) -> bool:
+        """
+        更新单个文档的部分字段（单行事务）
+
+        文档数不变，通过_counted_write写入使计数器在写入后仍然有效。
+
+        Returns:
+            文档是否存在
+        """
+        with self._counted_write() as (conn, _):
+            row = conn.execute("SELECT data FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            if not row:
+                return False
+            doc = json.loads(row["data"])
+            doc.update(fields)
+            for key in remove_fields:
+                doc.pop(key, None)
+            self._upsert(conn, doc_id, doc)
+        return True
+
+    def delete(self, doc_id: str) -> bool:
+        """删除单个文档的元数据，返回文档是否存在"""
+        with self._counted_write() as (conn, delta):
+            cursor = conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            delta[0] -= cursor.rowcount
+        return cursor.rowcount > 0
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        """获取全部文档元数据（按上传时间倒序）"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT doc_id, data FROM documents ORDER BY upload_time DESC").fetchall()
+        return {row["doc_id"]: json.loads(row["data"]) for row in rows}
+
+    def replace_all(self, documents: Dict[str, Dict[str, Any]]):
+        """用给定的全部文档元数据覆盖存储（兼容旧的整体保存接口）"""
+        with self._counted_write() as (conn, delta):
+            existing = {row["doc_id"] for row in conn.execute("SELECT doc_id FROM documents")}
+            removed = existing - set(documents)
+            conn.executemany("DELETE FROM documents WHERE doc_id = ?", [(doc_id,) for doc_id in removed])
+            for doc_id, doc in documents.items():
+                self._upsert(conn, doc_id, doc)
+            delta[0] += len(documents) - len(existing)
+
+    def count(self, vector_status: Optional[str] = None) -> int:
+        """统计文档数量，可按向量化状态过滤（总数优先使用内存计数器）"""
+        if vector_status is None:
+            with self._write_lock:
+                if self._count is not None and self._initialized and self._count_stamp == self._file_stamp():
+                    return self._count
+                # 先记录文件状态再统计：统计期间有其他写入时下次会重新统计
+                self._ensure_initialized()
+                stamp = self._file_stamp()
+                with self._connect() as conn:
+                    self._count = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+                self._count_stamp = stamp
+                return self._count
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM documents WHERE vector_status = ?", (vector_status,)
+            ).fetchone()
+        return row[0]
+
+    def find_by_filename(self, filename: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """按文件名查找文档，返回(doc_id, 元数据)"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT doc_id, data FROM documents WHERE filename = ? ORDER BY upload_time DESC LIMIT 1",
+                (filename,)
+            ).fetchone()
+        return (row["doc_id"], json.loads(row["data"])) if row else None
+
+    def list_page(
+        self,
+        page: int = 1,
+        limit: int = 10,
+        search: Optional[str] = None,
+        vector_status: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        分页查询文档（按上传时间倒序）
+
+        Returns:
+            (当前页文档列表（包含id字段）, 总数)
+        """
+        conditions = []
+        params: List[Any] = []
+        if search:
+            pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            conditions.append("(filename LIKE ? ESCAPE '\\' OR file_type_text LIKE ? ESCAPE '\\')")
+            params.extend([pattern, pattern])
+        if vector_status:
+            conditions.append("vector_status = ?")
+            params.append(vector_status)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        page = max(1, page)
+        limit = max(1, limit)
+        with self._connect() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM documents {where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT doc_id, data FROM documents {where} ORDER BY upload_time DESC LIMIT ? OFFSET ?",
+                params + [limit, (page - 1) * limit]
+            ).fetchall()
+
+        documents = []
+        for row in rows:
+            doc = json.loads(row["data"])
+            doc["id"] = row["doc_id"]
+            documents.append(doc)
+        return documents, total
@@ -1,6 +1,7 @@
 import os
 import json
 import shutil
+import tempfile
 from pathlib import Path
 from datetime import datetime
 from typing import Tuple, Dict, Any, List, Optional
@@ -10,85 +11,383 @@ import sys
 import logging
 import threading
 import time
-from queue import Queue, Empty
+import socket
 
-# 跨平台文件锁支持
-if sys.platform == "win32":
-    import msvcrt
-else:
-    import fcntl
+from .document_metadata_store import (
+    DocumentMetadataStore,
+    get_document_store,
+    get_document_store_for_metadata_file,
+)
+from .document_job_queue import DocumentJobStore, compute_priority, get_default_job_db_path
+from . import ingestion_events as events
+from .ingestion_events import ingestion_events
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class DocumentProcessingQueue:
-    """文档处理队列管理器"""
+    """
+    文档处理队列管理器
+
+    任务持久化在SQLite任务表中（见document_job_queue），服务重启后未完成的任务会继续处理；
+    多个工作线程按优先级并发领取任务，失败的任务按指数退避自动重试。
+
+    工作线程可以运行在API进程内，也可以运行在独立的工作进程中（python -m app.services.document_worker），
+    两者通过同一个任务表协作：API进程只负责入队和查询状态，处理进度经任务库中的事件表转发到SSE。
+
+    环境变量:
+        DOCUMENT_WORKER_MODE: thread（默认，API进程内的工作线程）、
+                              process（由API进程启动并守护独立工作进程）、
+                              external（工作进程由外部单独运行，API进程只入队）
+        DOCUMENT_QUEUE_WORKERS: 每个进程的工作线程数，默认1
+        DOCUMENT_QUEUE_MAX_ATTEMPTS: 每个任务最多尝试次数，默认3
+        DOCUMENT_QUEUE_RETRY_DELAY: 首次重试的等待秒数，之后每次翻倍，默认30
+        DOCUMENT_QUEUE_DB: 任务表路径，默认data/document_jobs.db
+    """
     
-    def __init__(self):
-        self.queue = Queue()
+    WORKER_MODES = ("thread", "process", "external")
+    # 空闲时轮询任务表的最长间隔（秒），用于发现到期的重试任务
+    IDLE_POLL_INTERVAL = 5.0
+    # 重试等待上限（秒）
+    MAX_RETRY_DELAY = 15 * 60
+    # 已结束任务记录的保留时间（秒）
+    FINISHED_JOB_RETENTION = 7 * 24 * 3600
+    # 工作线程心跳间隔和超时（秒）：超时未更新心跳的工作线程视为已退出，其任务重新排队
+    HEARTBEAT_INTERVAL = 10.0
+    WORKER_LEASE = 60.0
+    # 跨进程事件的转发间隔和保留时间（秒）
+    EVENT_RELAY_INTERVAL = 0.5
+    EVENT_RETENTION = 24 * 3600
+    
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or get_default_job_db_path()
+        self.mode = os.getenv("DOCUMENT_WORKER_MODE", "thread").lower()
+        if self.mode not in self.WORKER_MODES:
+            logger.warning(f"未知的DOCUMENT_WORKER_MODE: {self.mode}，使用thread")
+            self.mode = "thread"
+        self.is_worker_process = False
+        self.idle_poll_interval = self.IDLE_POLL_INTERVAL
+        self.num_workers = max(1, int(os.getenv("DOCUMENT_QUEUE_WORKERS", "1")))
+        self.max_attempts = max(1, int(os.getenv("DOCUMENT_QUEUE_MAX_ATTEMPTS", "3")))
+        self.retry_delay = max(0.0, float(os.getenv("DOCUMENT_QUEUE_RETRY_DELAY", "30")))
         self.processing = False
-        self.current_task = None
-        self.processed_count = 0
-        self.failed_count = 0
-        self.worker_thread = None
+        self._store: Optional[DocumentJobStore] = None
+        self._workers: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        self._relay_thread: Optional[threading.Thread] = None
+        self._last_progress_event: Dict[str, float] = {}
+    
+    @property
+    def store(self) -> DocumentJobStore:
+        """任务表（首次使用时创建）"""
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = DocumentJobStore(self.db_path)
+        return self._store
+    
+    @property
+    def runs_workers(self) -> bool:
+        """本进程是否运行工作线程"""
+        return self.mode == "thread" or self.is_worker_process
+    
+    def become_worker_process(self):
+        """当前进程作为独立工作进程运行（由document_worker调用）"""
+        self.is_worker_process = True
+        # 任务由其他进程写入，无法通过事件唤醒，缩短轮询间隔
+        self.idle_poll_interval = 1.0
+    
+    def add_task(self, task: Dict[str, Any], priority: Optional[int] = None) -> int:
+        """
+        添加处理任务到队列
         
-    def add_task(self, task: Dict[str, Any]):
-        """添加处理任务到队列"""
-        self.queue.put(task)
-        logger.info(f"添加任务到队列: {task['filename']}")
+        Args:
+            task: 任务信息（doc_id、filename、file_path、vector_store_dir、metadata_file、kb_name、force）
+            priority: 优先级，数值越小越先处理；为None时按文件大小计算
+        
+        Returns:
+            任务ID
+        """
+        if priority is None:
+            try:
+                file_size = os.path.getsize(task["file_path"])
+            except OSError:
+                file_size = None
+            priority = compute_priority(file_size)
+        
+        job_id = self.store.enqueue(task, priority, self.max_attempts)
+        logger.info(f"添加任务到队列: {task['filename']} (任务ID: {job_id}, 优先级: {priority})")
+        
+        if self.runs_workers:
+            self.start_worker()
+            self._wakeup.set()
+        self._publish_stage(task, events.STAGE_QUEUED, job_id=job_id, queue_position=self.queue_position(job_id))
+        self._publish_queue_status()
+        return job_id
+    
+    def _publish_stage(self, task: Dict[str, Any], stage: str, progress: bool = False, **data):
+        """发布文档阶段事件（独立工作进程写入事件表，由API进程转发；发布失败不影响处理）"""
+        try:
+            if not self.is_worker_process:
+                ingestion_events.publish_stage(
+                    task.get("kb_name") or "", task["doc_id"], stage,
+                    filename=task.get("filename"), progress=progress, **data
+                )
+                return
+            
+            if progress:
+                # 进度事件在写入事件表之前限流
+                now = time.time()
+                if now - self._last_progress_event.get(task["doc_id"], 0) < ingestion_events.PROGRESS_INTERVAL:
+                    return
+                self._last_progress_event[task["doc_id"]] = now
+            else:
+                self._last_progress_event.pop(task["doc_id"], None)
+            self.store.add_event({
+                "kind": "stage",
+                "kb_name": task.get("kb_name") or "",
+                "doc_id": task["doc_id"],
+                "filename": task.get("filename"),
+                "stage": stage,
+                "progress": progress,
+                "data": data,
+            })
+        except Exception as e:
+            logger.warning(f"发布处理事件失败: {str(e)}")
+    
+    def _publish_queue_status(self):
+        """发布队列状态（没有订阅者时跳过统计查询）"""
+        try:
+            if self.is_worker_process:
+                self.store.add_event({"kind": "queue"})
+            elif ingestion_events.subscriber_count():
+                ingestion_events.publish_queue_status(self.get_status())
+        except Exception as e:
+            logger.warning(f"发布队列状态失败: {str(e)}")
+    
+    def queue_position(self, job_id: int) -> int:
+        """任务在等待队列中的位置"""
+        try:
+            return self.store.position(job_id)
+        except Exception as e:
+            logger.warning(f"获取队列位置失败: {str(e)}")
+            return 0
+    
+    def cancel_document(self, kb_name: str, doc_id: str) -> int:
+        """取消文档尚未开始的处理任务"""
+        try:
+            return self.store.cancel(kb_name, doc_id)
+        except Exception as e:
+            logger.warning(f"取消文档处理任务失败: {str(e)}")
+            return 0
+    
+    def resume(self):
+        """
+        启动时恢复队列：已退出进程中断的任务重新排队；
+        本进程运行工作线程时启动它们处理遗留任务，否则启动事件转发
+        """
+        recovered = self.store.requeue_orphaned(self.WORKER_LEASE)
+        if recovered:
+            logger.info(f"恢复了 {recovered} 个中断的文档处理任务")
+        purged = self.store.purge_finished(self.FINISHED_JOB_RETENTION)
+        if purged:
+            logger.info(f"清理了 {purged} 条已结束的任务记录")
+        self.store.purge_events(self.EVENT_RETENTION)
         
-        # 如果没有工作线程在运行，启动一个
-        if not self.processing:
+        if not self.runs_workers:
+            self._start_event_relay()
+        elif self.store.counts()["pending"]:
             self.start_worker()
     
     def start_worker(self):
-        """启动工作线程"""
-        if self.worker_thread and self.worker_thread.is_alive():
-            return
+        """启动工作线程（已在运行的不重复启动）"""
+        with self._lock:
+            self._stop_event.clear()
+            self.processing = True
+            for index in range(self.num_workers):
+                name = f"{self._worker_prefix}:worker-{index}"
+                state = self._workers.get(name)
+                if state and state["thread"].is_alive():
+                    continue
+                thread = threading.Thread(target=self._process_queue, args=(name,), daemon=True, name=f"doc-worker-{index}")
+                self._workers[name] = {
+                    "thread": thread,
+                    "task": None,
+                    "job_id": None,
+                    "attempt": 0,
+                    "started_at": None,
+                    "processed": 0,
+                    "failed": 0,
+                }
+                thread.start()
+                logger.info(f"文档处理工作线程已启动: {name}")
             
-        self.processing = True
-        self.worker_thread = threading.Thread(target=self._process_queue, daemon=True)
-        self.worker_thread.start()
-        logger.info("文档处理工作线程已启动")
+            if not (self._heartbeat_thread and self._heartbeat_thread.is_alive()):
+                self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True, name="doc-worker-heartbeat")
+                self._heartbeat_thread.start()
+        self._write_heartbeat()
+    
+    def _write_heartbeat(self):
+        """把本进程工作线程的状态写入任务库"""
+        with self._lock:
+            workers = [
+                {"name": name, **{key: value for key, value in state.items() if key != "thread"}}
+                for name, state in self._workers.items()
+                if state["thread"].is_alive()
+            ]
+        if not workers:
+            return
+        try:
+            self.store.heartbeat(workers)
+        except Exception as e:
+            logger.warning(f"写入工作线程心跳失败: {str(e)}")
     
-    def _process_queue(self):
-        """处理队列中的任务"""
-        while self.processing:
+    def _heartbeat_loop(self):
+        """定期写入心跳，并恢复其他已退出进程中断的任务"""
+        last_recovery = time.time()
+        while not self._stop_event.wait(self.HEARTBEAT_INTERVAL):
+            self._write_heartbeat()
+            if time.time() - last_recovery >= self.WORKER_LEASE:
+                last_recovery = time.time()
+                try:
+                    recovered = self.store.requeue_orphaned(self.WORKER_LEASE)
+                    if recovered:
+                        logger.info(f"恢复了 {recovered} 个中断的文档处理任务")
+                        self._wakeup.set()
+                    self.store.purge_events(self.EVENT_RETENTION)
+                except Exception as e:
+                    logger.warning(f"恢复中断任务失败: {str(e)}")
+    
+    def _start_event_relay(self):
+        """API进程不运行工作线程时，把工作进程写入事件表的事件转发到SSE事件总线"""
+        if self._relay_thread and self._relay_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._relay_thread = threading.Thread(target=self._relay_events, daemon=True, name="doc-event-relay")
+        self._relay_thread.start()
+        logger.info(f"文档处理由独立工作进程执行（{self.mode}模式），已启动事件转发")
+    
+    def _relay_events(self):
+        last_id = self.store.last_event_id()
+        while not self._stop_event.wait(self.EVENT_RELAY_INTERVAL):
             try:
-                # 获取任务，超时1秒
-                task = self.queue.get(timeout=1)
-                self.current_task = task
-                
-                logger.info(f"开始处理文档: {task['filename']}")
-                
-                # 处理文档
-                success = self._process_single_document(task)
-                
-                if success:
-                    self.processed_count += 1
-                    logger.info(f"文档处理成功: {task['filename']}")
-                else:
-                    self.failed_count += 1
-                    logger.error(f"文档处理失败: {task['filename']}")
-                
-                self.queue.task_done()
-                self.current_task = None
-                
-            except Empty:
-                # 队列为空，继续等待
+                rows = self.store.events_after(last_id)
+            except Exception as e:
+                logger.warning(f"读取处理事件失败: {str(e)}")
                 continue
+            queue_changed = False
+            for last_id, event in rows:
+                if event.get("kind") == "stage":
+                    ingestion_events.publish_stage(
+                        event["kb_name"], event["doc_id"], event["stage"],
+                        filename=event.get("filename"), progress=event.get("progress", False),
+                        **event.get("data", {})
+                    )
+                else:
+                    queue_changed = True
+            if queue_changed:
+                self._publish_queue_status()
+    
+    def _process_queue(self, worker_name: str):
+        """工作线程：循环领取并处理任务"""
+        while not self._stop_event.is_set():
+            try:
+                job = self.store.claim(worker_name)
             except Exception as e:
-                logger.error(f"处理队列任务时发生错误: {str(e)}")
-                if self.current_task:
-                    self.failed_count += 1
-                    self.queue.task_done()
-                    self.current_task = None
+                logger.error(f"领取文档处理任务失败: {str(e)}")
+                self._stop_event.wait(self.idle_poll_interval)
+                continue
+            
+            if job is None:
+                self._wait_for_work()
+                continue
+            
+            self._run_job(worker_name, job)
+        
+        logger.info(f"文档处理工作线程已停止: {worker_name}")
+    
+    def _wait_for_work(self):
+        """没有可执行的任务时等待：有新任务加入或最近的重试任务到期时唤醒"""
+        timeout = self.idle_poll_interval
+        try:
+            next_run_at = self.store.next_run_at()
+            if next_run_at is not None:
+                timeout = min(timeout, max(0.1, next_run_at - time.time()))
+        except Exception:
+            pass
+        if self._wakeup.wait(timeout):
+            self._wakeup.clear()
+    
+    def _run_job(self, worker_name: str, job: Dict[str, Any]):
+        """处理一个任务并记录结果，失败时安排重试"""
+        task = job["payload"]
+        with self._lock:
+            state = self._workers[worker_name]
+            state.update({"task": task, "job_id": job["id"], "attempt": job["attempts"], "started_at": time.time()})
+        self._write_heartbeat()
+        
+        logger.info(f"开始处理文档: {task['filename']} (第{job['attempts']}/{job['max_attempts']}次尝试, {worker_name})")
+        self._publish_stage(task, events.STAGE_PARSING, job_id=job["id"], attempt=job["attempts"], worker=worker_name)
+        self._publish_queue_status()
+        
+        error = None
+        try:
+            self._process_single_document(task)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
         
-        logger.info("文档处理工作线程已停止")
+        try:
+            if error is None:
+                self.store.complete(job["id"])
+                with self._lock:
+                    state["processed"] += 1
+                logger.info(f"文档处理成功: {task['filename']}")
+            else:
+                self._handle_failure(job, error)
+                with self._lock:
+                    state["failed"] += 1
+        except Exception as e:
+            logger.error(f"更新任务状态失败: {str(e)}")
+        finally:
+            with self._lock:
+                state.update({"task": None, "job_id": None, "attempt": 0, "started_at": None})
+            self._write_heartbeat()
+            self._publish_queue_status()
     
-    def _process_single_document(self, task: Dict[str, Any]) -> bool:
-        """处理单个文档"""
+    def _handle_failure(self, job: Dict[str, Any], error: str):
+        """任务失败：未达到最大尝试次数时按指数退避重新排队，否则标记为错误"""
+        task = job["payload"]
+        metadata_file = Path(task["metadata_file"])
+        
+        if job["attempts"] < job["max_attempts"]:
+            delay = min(self.retry_delay * (2 ** (job["attempts"] - 1)), self.MAX_RETRY_DELAY)
+            self.store.fail(job["id"], error, retry_delay=delay)
+            next_retry_at = datetime.fromtimestamp(time.time() + delay).isoformat()
+            self._update_document_status(
+                metadata_file, task["doc_id"], "waiting", False,
+                extra_fields={"error_message": error, "retry_count": job["attempts"], "next_retry_at": next_retry_at}
+            )
+            self._publish_stage(
+                task, events.STAGE_RETRYING, error=error, attempt=job["attempts"],
+                max_attempts=job["max_attempts"], next_retry_at=next_retry_at
+            )
+            logger.warning(f"文档处理失败，{delay:.0f}秒后重试: {task['filename']} ({error})")
+        else:
+            self.store.fail(job["id"], error, retry_delay=None)
+            self._update_document_status(
+                metadata_file, task["doc_id"], "error", False, error,
+                extra_fields={"retry_count": job["attempts"]}, remove_fields=["next_retry_at"]
+            )
+            self._publish_stage(task, events.STAGE_ERROR, error=error, attempt=job["attempts"])
+            logger.error(f"文档处理失败，已达到最大尝试次数: {task['filename']} ({error})")
+    
+    def _process_single_document(self, task: Dict[str, Any]) -> None:
+        """处理单个文档，失败时抛出异常（由调用方决定重试或标记为错误）"""
         try:
             file_path = Path(task['file_path'])
             vector_store_dir = Path(task['vector_store_dir'])
@@ -161,29 +460,42 @@ class DocumentProcessingQueue:
                 except Exception as e:
                     logger.error(f"获取embedding配置失败: {e}，使用本地模型")
             
+            # 向量化各阶段的进度推送到事件总线（embedding阶段的进度事件限流）
+            def on_progress(stage: str, info: Dict[str, Any]):
+                self._publish_stage(task, stage, progress=(stage == events.STAGE_EMBEDDING), **info)
+            
             # 创建RAG管道实例，使用配置的embedding模型
             if embedding_config:
                 rag_pipeline = RAGPipeline(
                     file_path=str(file_path),
                     vector_store_path=str(vector_store_dir),
                     embedding_config=embedding_config,
-                    use_local_embedding=False
+                    use_local_embedding=False,
+                    progress_callback=on_progress
                 )
             else:
                 rag_pipeline = RAGPipeline(
                     file_path=str(file_path),
                     vector_store_path=str(vector_store_dir),
-                    use_local_embedding=True
+                    use_local_embedding=True,
+                    progress_callback=on_progress
                 )
             
             # 🚀 优先使用普通向量化处理，确保基础向量存储创建成功
+            dedup_stats = None
+            delta_stats = None
             try:
                 logger.info(f"开始向量化处理文档: {task['filename']}")
-                result = rag_pipeline.load_single_document(str(file_path))
+                result = rag_pipeline.load_single_document(
+                    str(file_path), doc_id=doc_id, force=task.get("force", False)
+                )
+                dedup_stats = rag_pipeline.last_dedup_stats
+                delta_stats = rag_pipeline.last_delta_stats
                 
                 # 如果普通向量化成功，再尝试分层索引优化
                 if result:
                     logger.info(f"基础向量化成功，尝试分层索引优化: {task['filename']}")
+                    self._publish_stage(task, events.STAGE_HIERARCHICAL)
                     try:
                         hierarchical_result = self._process_with_hierarchical_index(task, embedding_config, use_local_embedding)
                         if hierarchical_result:
@@ -214,16 +526,25 @@ class DocumentProcessingQueue:
             
             if result:
                 # 更新文档状态为完成
-                self._update_document_status(metadata_file, doc_id, "completed", True)
+                extra_fields = {}
+                if dedup_stats:
+                    extra_fields["dedup_stats"] = dedup_stats
+                if delta_stats:
+                    extra_fields["delta_stats"] = delta_stats
+                self._update_document_status(
+                    metadata_file, doc_id, "completed", True,
+                    extra_fields=extra_fields or None,
+                    remove_fields=["error_message", "retry_count", "next_retry_at"]
+                )
+                self._publish_stage(
+                    task, events.STAGE_COMPLETED,
+                    dedup_stats=dedup_stats, delta_stats=delta_stats
+                )
                 logger.info(f"文档处理成功并已清理显存: {task['filename']}")
                 logger.info(f"文档向量化成功: {task['filename']}")
-                
-                return True
             else:
-                # 处理失败
-                self._update_document_status(metadata_file, doc_id, "error", False, "向量化处理失败")
                 logger.error(f"文档向量化失败: {task['filename']}")
-                return False
+                raise RuntimeError("向量化处理失败")
             
         except Exception as e:
             logger.error(f"处理文档失败: {str(e)}")
@@ -242,31 +563,21 @@ class DocumentProcessingQueue:
             except Exception as cleanup_error:
                 logger.warning(f"错误处理后清理显存失败: {str(cleanup_error)}")
             
-            # 更新状态为错误
-            self._update_document_status(metadata_file, doc_id, "error", False, str(e))
-            
-            return False
+            raise
     
-    def _update_document_status(self, metadata_file: Path, doc_id: str, status: str, has_vector: bool, error_message: str = None):
-        """更新文档状态"""
+    def _update_document_status(self, metadata_file: Path, doc_id: str, status: str, has_vector: bool, error_message: str = None, extra_fields: Dict[str, Any] = None, remove_fields: List[str] = None):
+        """更新文档状态（extra_fields为需要一并写入的其他字段，如分块去重统计；remove_fields为需要清除的字段）"""
         try:
-            if metadata_file.exists():
-                with metadata_file.open("r", encoding="utf-8") as f:
-                    metadata = json.load(f)
-            else:
-                metadata = {"documents": {}}
-            
-            if doc_id in metadata["documents"]:
-                metadata["documents"][doc_id]["vector_status"] = status
-                metadata["documents"][doc_id]["has_vector"] = has_vector
-                
-                if status == "completed":
-                    metadata["documents"][doc_id]["vector_time"] = datetime.now().isoformat()
-                elif status == "error" and error_message:
-                    metadata["documents"][doc_id]["error_message"] = error_message
-                
-                with metadata_file.open("w", encoding="utf-8") as f:
-                    json.dump(metadata, f, ensure_ascii=False, indent=2)
+            fields = {"vector_status": status, "has_vector": has_vector}
+            if status == "completed":
+                fields["vector_time"] = datetime.now().isoformat()
+            elif status == "error" and error_message:
+                fields["error_message"] = error_message
+            if extra_fields:
+                fields.update(extra_fields)
+            
+            # 单行更新，不再整体读写元数据文件
+            get_document_store_for_metadata_file(metadata_file).update_fields(doc_id, fields, remove_fields or ())
                     
         except Exception as e:
             logger.error(f"更新文档状态失败: {str(e)}")
@@ -339,20 +650,77 @@ class DocumentProcessingQueue:
             # 这是一个非关键功能，失败不应影响主流程
     
     def get_status(self) -> Dict[str, Any]:
-        """获取队列状态"""
+        """
+        获取队列状态
+        
+        queue_size为任务表中等待处理的任务数（包括等待重试的任务），
+        workers为所有进程中心跳未超时的工作线程状态。
+        """
+        try:
+            counts = self.store.counts()
+            worker_rows = self.store.list_workers(self.WORKER_LEASE)
+        except Exception as e:
+            logger.error(f"获取任务统计失败: {str(e)}")
+            counts = {"pending": 0, "running": 0, "completed": 0, "failed": 0, "retrying": 0}
+            worker_rows = []
+        
+        now = time.time()
+        workers = []
+        current_task = None
+        for row in worker_rows:
+            task = row["task"]
+            if task and current_task is None:
+                current_task = task
+            workers.append({
+                "name": row["name"],
+                "host": row["host"],
+                "pid": row["pid"],
+                "state": "busy" if task else "idle",
+                "job_id": row["job_id"],
+                "doc_id": task["doc_id"] if task else None,
+                "filename": task["filename"] if task else None,
+                "kb_name": task.get("kb_name") if task else None,
+                "attempt": row["attempt"] or None,
+                "elapsed_seconds": round(now - row["started_at"], 1) if row["started_at"] else None,
+                "processed": row["processed"],
+                "failed": row["failed"],
+                "last_heartbeat_seconds": round(now - row["heartbeat_at"], 1),
+            })
+        
         return {
-            "queue_size": self.queue.qsize(),
-            "processing": self.processing,
-            "current_task": self.current_task,
-            "processed_count": self.processed_count,
-            "failed_count": self.failed_count
+            "mode": self.mode,
+            "queue_size": counts["pending"],
+            "running": counts["running"],
+            "retrying": counts["retrying"],
+            "processing": bool(workers),
+            "current_task": current_task,
+            "processed_count": sum(w["processed"] for w in workers),
+            "failed_count": sum(w["failed"] for w in workers),
+            "total_completed": counts["completed"],
+            "total_failed": counts["failed"],
+            "workers": workers
         }
     
-    def stop(self):
-        """停止处理队列"""
+    def stop(self, timeout: float = 5):
+        """
+        停止处理队列
+        
+        正在处理的任务不会被打断；超时后仍未结束的任务保持running状态，
+        进程退出后由requeue_orphaned重新排队。
+        """
+        self._stop_event.set()
+        self._wakeup.set()
         self.processing = False
-        if self.worker_thread:
-            self.worker_thread.join(timeout=5)
+        with self._lock:
+            workers = dict(self._workers)
+        for state in workers.values():
+            state["thread"].join(timeout=timeout)
+        stopped = [name for name, state in workers.items() if not state["thread"].is_alive()]
+        if stopped:
+            try:
+                self.store.remove_workers(stopped)
+            except Exception as e:
+                logger.warning(f"清理工作线程记录失败: {str(e)}")
 
 # 全局队列实例
 processing_queue = DocumentProcessingQueue()
@@ -362,34 +730,8 @@ class DocumentUploadService:
     
     def __init__(self):
         self.data_dir = Path("data/knowledge_base")
-    
-    def _lock_file(self, file_handle, exclusive=False):
-        """跨平台文件锁"""
-        if sys.platform == "win32":
-            # Windows 使用 msvcrt
-            try:
-                if exclusive:
-                    msvcrt.locking(file_handle.fileno(), msvcrt.LK_NBLCK, 1)
-                else:
-                    msvcrt.locking(file_handle.fileno(), msvcrt.LK_NBLCK, 1)
-            except IOError:
-                raise Exception("无法获取文件锁")
-        else:
-            # Unix/Linux 使用 fcntl
-            lock_type = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
-            fcntl.flock(file_handle.fileno(), lock_type)
-    
-    def _unlock_file(self, file_handle):
-        """跨平台文件解锁"""
-        if sys.platform == "win32":
-            # Windows 使用 msvcrt
-            try:
-                msvcrt.locking(file_handle.fileno(), msvcrt.LK_UNLCK, 1)
-            except IOError:
-                pass  # 忽略解锁错误
-        else:
-            # Unix/Linux 使用 fcntl
-            fcntl.flock(file_handle.fileno(), fcntl.LOCK_UN)
+        # 上传临时目录：与知识库目录在同一文件系统，接收完成后直接重命名到content目录
+        self.upload_temp_dir = self.data_dir / ".uploads"
     
     def _get_kb_paths(self, kb_name: str) -> Dict[str, Path]:
         """获取知识库相关路径"""
@@ -406,104 +748,17 @@ class DocumentUploadService:
         paths["content_dir"].mkdir(parents=True, exist_ok=True)
         paths["vector_store_dir"].mkdir(parents=True, exist_ok=True)
     
-    def _load_metadata(self, metadata_file: Path) -> Dict[str, Any]:
-        """加载文档元数据（带文件锁）"""
-        if not metadata_file.exists():
-            return {"documents": {}}
-        
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                with metadata_file.open("r", encoding="utf-8") as f:
-                    # 获取共享锁（读锁）
-                    self._lock_file(f, False)
-                    try:
-                        content = f.read()
-                        if content.strip():
-                            return json.loads(content)
-                        else:
-                            return {"documents": {}}
-                    finally:
-                        self._unlock_file(f)
-            except (json.JSONDecodeError, FileNotFoundError) as e:
-                logger.warning(f"元数据文件读取失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
-                if attempt == max_retries - 1:
-                    logger.warning("元数据文件格式错误，创建新的元数据")
-                    return {"documents": {}}
-                time.sleep(0.1)  # 短暂等待后重试
-            except Exception as e:
-                logger.error(f"读取元数据文件时发生未知错误: {str(e)}")
-                if attempt == max_retries - 1:
-                    return {"documents": {}}
-                time.sleep(0.1)
-        
-        return {"documents": {}}
-    
-    def _save_metadata(self, metadata_file: Path, metadata: Dict[str, Any]) -> None:
-        """保存文档元数据（带文件锁和原子写入）"""
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                # 确保目录存在
-                metadata_file.parent.mkdir(parents=True, exist_ok=True)
-                
-                # 使用临时文件进行原子写入
-                temp_file = metadata_file.with_suffix('.tmp')
-                
-                with temp_file.open("w", encoding="utf-8") as f:
-                    # 获取排他锁（写锁）
-                    self._lock_file(f, True)
-                    try:
-                        json.dump(metadata, f, ensure_ascii=False, indent=2)
-                        f.flush()
-                        os.fsync(f.fileno())  # 强制写入磁盘
-                    finally:
-                        self._unlock_file(f)
-                
-                # 原子性地替换原文件
-                temp_file.replace(metadata_file)
-                logger.info(f"元数据保存成功: {metadata_file}")
-                return
-                
-            except Exception as e:
-                logger.error(f"保存元数据文件失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
-                if attempt == max_retries - 1:
-                    raise Exception(f"保存元数据文件失败: {str(e)}")
-                time.sleep(0.1)  # 短暂等待后重试
-                
-                # 清理临时文件
-                if temp_file.exists():
-                    try:
-                        temp_file.unlink()
-                    except:
-                        pass
-    
-    def _safe_update_metadata(self, metadata_file: Path, doc_id: str, doc_metadata: Dict[str, Any]) -> None:
-        """安全地更新元数据（防止并发冲突）"""
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                # 重新加载最新的元数据
-                current_metadata = self._load_metadata(metadata_file)
-                
-                # 添加新文档
-                current_metadata["documents"][doc_id] = doc_metadata
-                
-                # 保存更新后的元数据
-                self._save_metadata(metadata_file, current_metadata)
-                logger.info(f"文档元数据更新成功: {doc_id}")
-                return
-                
-            except Exception as e:
-                logger.error(f"更新元数据失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
-                if attempt == max_retries - 1:
-                    raise Exception(f"更新元数据失败: {str(e)}")
-                time.sleep(0.2)  # 等待更长时间后重试
+    def _get_store(self, kb_name: str) -> DocumentMetadataStore:
+        """获取知识库的文档元数据存储（SQLite）"""
+        return get_document_store(self.data_dir / kb_name)
     
     def _get_file_hash(self, file_path: Path) -> str:
-        """获取文件的MD5哈希值"""
+        """获取文件的MD5哈希值（分块读取）"""
+        md5 = hashlib.md5()
         with open(file_path, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                md5.update(block)
+        return md5.hexdigest()
     
     def _format_file_size(self, size_in_bytes: int) -> str:
         """格式化文件大小"""
@@ -544,16 +799,71 @@ class DocumentUploadService:
         return type_map.get(file_ext.lower(), f'{file_ext}文件')
     
     async def upload_and_vectorize(self, file_content: bytes, filename: str, kb_name: str) -> Dict[str, Any]:
-        """上传文档并添加到处理队列"""
+        """上传文档并添加到处理队列（文件内容已在内存中）"""
+        self.upload_temp_dir.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=str(self.upload_temp_dir), suffix=".upload")
+        with os.fdopen(fd, "wb") as f:
+            f.write(file_content)
+        return await self.upload_file_and_vectorize(
+            Path(temp_path), filename, kb_name,
+            file_hash=hashlib.md5(file_content).hexdigest(),
+            file_size=len(file_content)
+        )
+    
+    async def upload_stream_and_vectorize(self, request, max_file_size: int, validate_filename=None) -> Dict[str, Any]:
+        """
+        流式接收multipart上传并添加到处理队列
+        
+        请求体边接收边写入临时文件并计算MD5，完成后重命名到知识库content目录，
+        文件内容不会整体读入内存。
+        
+        Args:
+            request: 上传请求（包含file文件字段和kb_name表单字段）
+            max_file_size: 文件大小上限（字节）
+            validate_filename: 文件名校验函数，在接收文件内容之前调用
+        """
+        from fastapi import HTTPException
+        from .streaming_upload import StreamingUploadParser
+        
+        parser = StreamingUploadParser(
+            self.upload_temp_dir,
+            max_file_size=max_file_size,
+            validate_filename=validate_filename
+        )
+        upload = await parser.parse(request)
+        
+        kb_name = upload["fields"].get("kb_name", "").strip()
+        if not kb_name:
+            parser.cleanup()
+            raise HTTPException(status_code=400, detail="知识库名称不能为空")
+        
+        logger.info(f"文件接收完成: {upload['filename']} ({self._format_file_size(upload['file_size'])}) 到知识库: {kb_name}")
+        return await self.upload_file_and_vectorize(
+            upload["temp_path"], upload["filename"], kb_name,
+            file_hash=upload["file_hash"],
+            file_size=upload["file_size"]
+        )
+    
+    async def upload_file_and_vectorize(
+        self,
+        temp_path: Path,
+        filename: str,
+        kb_name: str,
+        file_hash: Optional[str] = None,
+        file_size: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """将已接收的临时文件移动到知识库并添加到处理队列"""
         try:
             # 获取路径信息
             paths = self._get_kb_paths(kb_name)
             self._ensure_directories(paths)
             
-            # 保存原始文件
+            # 保存原始文件（同一文件系统内直接重命名）
             file_path = paths["content_dir"] / filename
-            with file_path.open("wb") as f:
-                f.write(file_content)
+            try:
+                os.replace(temp_path, file_path)
+            except OSError:
+                shutil.move(str(temp_path), str(file_path))
             
             logger.info(f"文件保存成功: {file_path}")
             
@@ -561,8 +871,11 @@ class DocumentUploadService:
             timestamp = int(datetime.now().timestamp() * 1000)  # 毫秒级时间戳
             doc_id = f"doc_{timestamp}"
             
-            # 获取文件信息
-            file_size = os.path.getsize(file_path)
+            # 获取文件信息（流式接收时已计算）
+            if file_size is None:
+                file_size = os.path.getsize(file_path)
+            if file_hash is None:
+                file_hash = self._get_file_hash(file_path)
             file_ext = filename.split(".")[-1].lower() if "." in filename else "unknown"
             
             # 根据文件类型选择不同的分块大小
@@ -584,11 +897,12 @@ class DocumentUploadService:
                 "has_vector": False,
                 "vector_status": "waiting",
                 "problem_status": "正常",
-                "file_hash": self._get_file_hash(file_path)
+                "file_hash": file_hash
             }
             
-            # 使用安全的元数据更新方法
-            self._safe_update_metadata(paths["metadata_file"], doc_id, doc_metadata)
+            # 写入文档元数据（单行事务）
+            self._get_store(kb_name).upsert(doc_id, doc_metadata)
+            logger.info(f"文档元数据更新成功: {doc_id}")
             
             # 添加到处理队列
             task = {
@@ -600,7 +914,7 @@ class DocumentUploadService:
                 "kb_name": kb_name
             }
             
-            processing_queue.add_task(task)
+            job_id = processing_queue.add_task(task, compute_priority(file_size))
             
             return {
                 "success": True,
@@ -608,14 +922,17 @@ class DocumentUploadService:
                 "data": {
                     "doc_id": doc_id,
                     "filename": filename,
+                    "kb_name": kb_name,
                     "has_vector": False,
                     "vector_status": "waiting",
-                    "queue_position": processing_queue.queue.qsize()
+                    "queue_position": processing_queue.queue_position(job_id)
                 }
             }
             
         except Exception as e:
             logger.error(f"上传文档失败: {str(e)}")
+            if Path(temp_path).exists():
+                Path(temp_path).unlink()
             raise Exception(f"上传文档失败: {str(e)}")
     
     def get_processing_status(self) -> Dict[str, Any]:
@@ -625,38 +942,13 @@ class DocumentUploadService:
     def get_documents(self, kb_name: str, page: int = 1, limit: int = 10) -> Dict[str, Any]:
         """获取文档列表"""
         try:
-            paths = self._get_kb_paths(kb_name)
-            
-            if not paths["metadata_file"].exists():
-                return {
-                    "success": True,
-                    "data": [],
-                    "pagination": {
-                        "page": page,
-                        "limit": limit,
-                        "total": 0,
-                        "total_pages": 0
-                    }
-                }
-            
-            metadata = self._load_metadata(paths["metadata_file"])
-            
-            # 转换为列表并排序
-            documents = [{
-                "id": doc_id,
-                **doc_data
-            } for doc_id, doc_data in metadata["documents"].items()]
-            documents.sort(key=lambda x: x["upload_time"], reverse=True)
-            
-            # 计算分页
-            total = len(documents)
+            # 按上传时间倒序的索引分页查询
+            documents, total = self._get_store(kb_name).list_page(page, limit)
             total_pages = (total + limit - 1) // limit
-            start_idx = (page - 1) * limit
-            end_idx = start_idx + limit
             
             return {
                 "success": True,
-                "data": documents[start_idx:end_idx],
+                "data": documents,
                 "pagination": {
                     "page": page,
                     "limit": limit,
@@ -669,27 +961,57 @@ class DocumentUploadService:
             logger.error(f"获取文档列表失败: {str(e)}")
             raise Exception(f"获取文档列表失败: {str(e)}")
     
+    def get_document(self, kb_name: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        """获取单个文档的元数据"""
+        return self._get_store(kb_name).get(doc_id)
+    
+    def count_documents(self, kb_name: str) -> int:
+        """统计知识库中的文档数量"""
+        return self._get_store(kb_name).count()
+    
+    def reset_document_status(self, kb_name: str, doc_id: str) -> bool:
+        """将文档状态重置为等待处理（清除之前的错误信息）"""
+        return self._get_store(kb_name).update_fields(
+            doc_id, {"vector_status": "waiting", "has_vector": False}, remove_fields=["error_message"]
+        )
+    
+    def _delete_document_vectors(self, vector_store_dir: Path, doc_id: str, file_path: Path) -> None:
+        """按文档向量清单原地删除文档的向量"""
+        if not vector_store_dir.exists():
+            return
+        try:
+            from dfy_langchain.vector_manifest import remove_document_vectors, vector_store_lock
+            
+            with vector_store_lock(str(vector_store_dir)):
+                removed = remove_document_vectors(str(vector_store_dir), doc_key=doc_id, source=str(file_path))
+            logger.info(f"已删除文档 {doc_id} 的向量: {removed}")
+        except Exception as e:
+            logger.error(f"删除文档向量失败: {str(e)}")
+    
     def delete_document(self, doc_id: str, kb_name: str) -> Dict[str, Any]:
         """删除文档"""
         try:
             paths = self._get_kb_paths(kb_name)
+            store = self._get_store(kb_name)
             
-            if not paths["metadata_file"].exists():
-                raise Exception("找不到文档元数据")
+            doc_metadata = store.get(doc_id)
+            if not doc_metadata:
+                raise Exception("找不到指定的文档")
             
-            metadata = self._load_metadata(paths["metadata_file"])
+            # 取消尚未开始的处理任务
+            processing_queue.cancel_document(kb_name, doc_id)
             
-            if doc_id not in metadata["documents"]:
-                raise Exception("找不到指定的文档")
+            # 删除向量数据（主向量库和分层索引中该文档的向量）
+            file_path = paths["content_dir"] / doc_metadata["filename"]
+            self._delete_document_vectors(paths["vector_store_dir"], doc_id, file_path)
             
             # 删除原始文件
-            file_path = paths["content_dir"] / metadata["documents"][doc_id]["filename"]
             if file_path.exists():
                 file_path.unlink()
             
             # 从元数据中删除
-            del metadata["documents"][doc_id]
-            self._save_metadata(paths["metadata_file"], metadata)
+            store.delete(doc_id)
+            ingestion_events.forget_document(kb_name, doc_id)
             
             return {
                 "success": True,
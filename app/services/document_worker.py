@@ -0,0 +1,136 @@
+"""
+独立的文档处理工作进程
+
+文档解析和向量化在工作进程中执行，占满CPU/GPU时不会拖慢API进程的请求处理；
+工作进程崩溃（例如显存不足）也不会影响API进程，中断的任务由心跳超时机制重新排队。
+
+运行方式:
+    DOCUMENT_WORKER_MODE=process    API进程启动时自动启动并守护工作进程
+    DOCUMENT_WORKER_MODE=external   API进程只入队，工作进程需单独运行:
+                                    python -m app.services.document_worker
+"""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 项目根目录（知识库路径相对于该目录）
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_worker():
+    """工作进程入口：处理任务表中的任务，直到收到SIGTERM/SIGINT"""
+    from .document_upload_service import processing_queue
+
+    stop_event = threading.Event()
+
+    def _handle_signal(signum, frame):
+        logger.info(f"文档处理工作进程收到信号 {signum}，处理完当前任务后退出")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
+    processing_queue.become_worker_process()
+    processing_queue.resume()
+    processing_queue.start_worker()
+    logger.info(f"文档处理工作进程已启动 (pid: {os.getpid()}, 工作线程: {processing_queue.num_workers})")
+
+    while not stop_event.wait(1.0):
+        pass
+
+    processing_queue.stop(timeout=60)
+    logger.info("文档处理工作进程已退出")
+
+
+class DocumentWorkerProcess:
+    """
+    工作进程守护（DOCUMENT_WORKER_MODE=process时由API进程使用）
+
+    工作进程异常退出后按指数退避自动重启，持续运行一段时间后退避时间复位。
+    """
+
+    RESTART_DELAY = 2.0
+    MAX_RESTART_DELAY = 60.0
+    # 运行超过该时间（秒）后退出视为偶发故障，重启等待复位
+    STABLE_SECONDS = 60.0
+
+    def __init__(self):
+        self.process: Optional[subprocess.Popen] = None
+        self._stop_event = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动工作进程和守护线程"""
+        if self._monitor and self._monitor.is_alive():
+            return
+        self._stop_event.clear()
+        self._spawn()
+        self._monitor = threading.Thread(target=self._watch, daemon=True, name="doc-worker-supervisor")
+        self._monitor.start()
+
+    def _spawn(self):
+        with self._lock:
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "app.services.document_worker"],
+                cwd=PROJECT_ROOT,
+                env={**os.environ, "DOCUMENT_WORKER_MODE": "external"},
+            )
+        logger.info(f"文档处理工作进程已启动 (pid: {self.process.pid})")
+
+    def _watch(self):
+        delay = self.RESTART_DELAY
+        started_at = time.time()
+        while not self._stop_event.is_set():
+            returncode = self.process.poll()
+            if returncode is None:
+                self._stop_event.wait(1.0)
+                continue
+
+            if self._stop_event.is_set():
+                break
+            if time.time() - started_at >= self.STABLE_SECONDS:
+                delay = self.RESTART_DELAY
+            logger.error(f"文档处理工作进程异常退出 (返回码: {returncode})，{delay:.0f}秒后重启")
+            if self._stop_event.wait(delay):
+                break
+            delay = min(delay * 2, self.MAX_RESTART_DELAY)
+            try:
+                self._spawn()
+                started_at = time.time()
+            except Exception as e:
+                logger.error(f"重启文档处理工作进程失败: {str(e)}")
+
+    def stop(self, timeout: float = 30):
+        """停止工作进程：先发送SIGTERM等待当前任务结束，超时后强制结束"""
+        self._stop_event.set()
+        with self._lock:
+            process = self.process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning("文档处理工作进程未能按时退出，强制结束")
+            process.kill()
+            process.wait()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+
+# 全局工作进程守护实例
+worker_process = DocumentWorkerProcess()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_worker()
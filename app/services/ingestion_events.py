@@ -0,0 +1,195 @@
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 文档入库阶段
+STAGE_QUEUED = "queued"
+STAGE_PARSING = "parsing"
+STAGE_EMBEDDING = "embedding"
+STAGE_INDEXING = "indexing"
+STAGE_HIERARCHICAL = "hierarchical"
+STAGE_RETRYING = "retrying"
+STAGE_COMPLETED = "completed"
+STAGE_ERROR = "error"
+
+TERMINAL_STAGES = {STAGE_COMPLETED, STAGE_ERROR}
+
+
+class _Subscriber:
+    """一个SSE连接的事件队列（属于某个事件循环）"""
+
+    def __init__(self, kb_name: Optional[str], loop: asyncio.AbstractEventLoop, max_size: int):
+        self.kb_name = kb_name
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self.dropped = 0
+
+    def _put(self, event: Dict[str, Any]):
+        # 客户端消费太慢时丢弃最旧的事件，保证最新状态能送达
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(event)
+
+    def deliver(self, event: Dict[str, Any]) -> bool:
+        """从任意线程投递事件，事件循环已关闭时返回False"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+            return True
+        except RuntimeError:
+            return False
+
+
+class IngestionEventBus:
+    """
+    进程内文档入库事件总线
+
+    处理队列的工作线程在各阶段发布事件，SSE接口按知识库订阅。
+    每个文档保留最新一条事件，新连接先收到当前快照，不需要再轮询状态接口。
+    """
+
+    # 同一文档同一阶段的进度事件最短发布间隔（秒），阶段切换总是立即发布
+    PROGRESS_INTERVAL = 0.5
+
+    def __init__(self, max_queue_size: int = 500, max_tracked_documents: int = 500):
+        self.max_queue_size = max_queue_size
+        self.max_tracked_documents = max_tracked_documents
+        self._lock = threading.Lock()
+        self._subscribers: List[_Subscriber] = []
+        self._latest: Dict[str, "OrderedDict[str, Dict[str, Any]]"] = {}
+        self._last_progress: Dict[tuple, float] = {}
+        self._queue_status: Optional[Dict[str, Any]] = None
+        self._seq = itertools.count(1)
+
+    def publish_stage(
+        self,
+        kb_name: str,
+        doc_id: str,
+        stage: str,
+        filename: Optional[str] = None,
+        progress: bool = False,
+        **data: Any
+    ) -> Optional[Dict[str, Any]]:
+        """
+        发布文档阶段事件
+
+        Args:
+            kb_name: 知识库名称
+            doc_id: 文档ID
+            stage: 阶段（queued/parsing/embedding/indexing/hierarchical/retrying/completed/error）
+            filename: 文件名
+            progress: 是否为阶段内的进度事件（按PROGRESS_INTERVAL限流）
+            **data: 分块数、吞吐量等附加信息
+
+        Returns:
+            发布的事件，被限流时返回None
+        """
+        now = time.time()
+        key = (kb_name, doc_id)
+        with self._lock:
+            documents = self._latest.setdefault(kb_name, OrderedDict())
+            previous = documents.get(doc_id)
+            if filename is None and previous:
+                filename = previous.get("filename")
+
+            if progress and previous and previous.get("stage") == stage:
+                if now - self._last_progress.get(key, 0) < self.PROGRESS_INTERVAL:
+                    return None
+            self._last_progress[key] = now
+
+            event = {
+                "type": "stage",
+                "seq": next(self._seq),
+                "kb_name": kb_name,
+                "doc_id": doc_id,
+                "filename": filename,
+                "stage": stage,
+                "timestamp": datetime.now().isoformat(),
+                **data
+            }
+            documents[doc_id] = event
+            documents.move_to_end(doc_id)
+            while len(documents) > self.max_tracked_documents:
+                old_doc_id, _ = documents.popitem(last=False)
+                self._last_progress.pop((kb_name, old_doc_id), None)
+            if stage in TERMINAL_STAGES:
+                self._last_progress.pop(key, None)
+
+            subscribers = [s for s in self._subscribers if s.kb_name in (None, kb_name)]
+
+        self._deliver(subscribers, event)
+        return event
+
+    def publish_queue_status(self, status: Dict[str, Any]):
+        """发布处理队列状态（所有订阅者都会收到）"""
+        event = {
+            "type": "queue",
+            "timestamp": datetime.now().isoformat(),
+            **status
+        }
+        with self._lock:
+            event["seq"] = next(self._seq)
+            self._queue_status = event
+            subscribers = list(self._subscribers)
+        self._deliver(subscribers, event)
+
+    def forget_document(self, kb_name: str, doc_id: str):
+        """文档删除后不再出现在快照中"""
+        with self._lock:
+            self._latest.get(kb_name, {}).pop(doc_id, None)
+            self._last_progress.pop((kb_name, doc_id), None)
+
+    def snapshot(self, kb_name: Optional[str] = None) -> Dict[str, Any]:
+        """当前各文档的最新事件和队列状态"""
+        with self._lock:
+            if kb_name is None:
+                documents = [e for docs in self._latest.values() for e in docs.values()]
+            else:
+                documents = list(self._latest.get(kb_name, {}).values())
+            return {
+                "type": "snapshot",
+                "kb_name": kb_name,
+                "documents": documents,
+                "queue": self._queue_status,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    def subscribe(self, kb_name: Optional[str] = None) -> _Subscriber:
+        """在当前事件循环中订阅事件（kb_name为None时订阅全部知识库）"""
+        subscriber = _Subscriber(kb_name, asyncio.get_running_loop(), self.max_queue_size)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+        if subscriber.dropped:
+            logger.info(f"事件订阅结束，客户端消费过慢共丢弃 {subscriber.dropped} 条事件")
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def _deliver(self, subscribers: List[_Subscriber], event: Dict[str, Any]):
+        closed = [s for s in subscribers if not s.deliver(event)]
+        if closed:
+            with self._lock:
+                for subscriber in closed:
+                    if subscriber in self._subscribers:
+                        self._subscribers.remove(subscriber)
+
+
+# 全局事件总线
+ingestion_events = IngestionEventBus()
@@ -3,10 +3,24 @@ import json
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 import logging
+import threading
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# 知识库注册表缓存（进程内共享）：knowledge_bases.json的(修改时间, 大小)未变化时不重新解析
+_registry_lock = threading.Lock()
+_registry_cache: Dict[str, Any] = {"path": None, "stamp": None, "knowledge_bases": []}
+
+
+def _file_stamp(path: Path):
+    try:
+        stat = path.stat()
+        return (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
+
+
 class KnowledgeBaseService:
     """知识库管理服务"""
     
@@ -33,20 +47,29 @@ class KnowledgeBaseService:
     
     def load_knowledge_bases(self) -> List[Dict[str, Any]]:
         """
-        加载所有知识库信息
+        加载所有知识库信息（文件未变化时使用内存缓存）
         
         Returns:
-            知识库列表
+            知识库列表（副本，调用方可以直接修改）
         """
-        if self.knowledge_bases_file.exists():
-            try:
-                with open(self.knowledge_bases_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    return data.get("knowledge_bases", [])
-            except Exception as e:
-                logger.error(f"加载知识库管理文件失败: {str(e)}")
+        path = str(self.knowledge_bases_file)
+        with _registry_lock:
+            stamp = _file_stamp(self.knowledge_bases_file)
+            if stamp is None:
                 return []
-        return []
+            if _registry_cache["path"] != path or _registry_cache["stamp"] != stamp:
+                try:
+                    with open(self.knowledge_bases_file, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except Exception as e:
+                    logger.error(f"加载知识库管理文件失败: {str(e)}")
+                    return []
+                _registry_cache.update({
+                    "path": path,
+                    "stamp": stamp,
+                    "knowledge_bases": data.get("knowledge_bases", [])
+                })
+            return [dict(kb) for kb in _registry_cache["knowledge_bases"]]
     
     def save_knowledge_bases(self, knowledge_bases: List[Dict[str, Any]]) -> bool:
         """
@@ -59,8 +82,16 @@ class KnowledgeBaseService:
             是否保存成功
         """
         try:
-            with open(self.knowledge_bases_file, "w", encoding="utf-8") as f:
-                json.dump({"knowledge_bases": knowledge_bases}, f, ensure_ascii=False, indent=4)
+            with _registry_lock:
+                temp_file = self.knowledge_bases_file.with_suffix(".tmp")
+                with open(temp_file, "w", encoding="utf-8") as f:
+                    json.dump({"knowledge_bases": knowledge_bases}, f, ensure_ascii=False, indent=4)
+                temp_file.replace(self.knowledge_bases_file)
+                _registry_cache.update({
+                    "path": str(self.knowledge_bases_file),
+                    "stamp": _file_stamp(self.knowledge_bases_file),
+                    "knowledge_bases": [dict(kb) for kb in knowledge_bases]
+                })
             return True
         except Exception as e:
             logger.error(f"保存知识库管理文件失败: {str(e)}")
@@ -77,14 +108,54 @@ class KnowledgeBaseService:
             文档数量
         """
         try:
-            from .document_metadata_service import DocumentMetadataService
-            metadata_service = DocumentMetadataService()
-            metadata = metadata_service.load_documents_metadata(kb_name)
-            return len(metadata.get("documents", {}))
+            if not kb_name or not (self.knowledge_base_dir / kb_name).exists():
+                return 0
+            # 文档数来自元数据存储的内存计数器，不再解析元数据文件
+            from .document_metadata_store import get_document_store
+            return get_document_store(self.knowledge_base_dir / kb_name).count()
         except Exception as e:
             logger.error(f"统计知识库文档数量失败: {str(e)}")
             return 0
     
+    def attach_list_stats(self, knowledge_bases: List[Dict[str, Any]], db=None) -> List[Dict[str, Any]]:
+        """
+        为知识库列表添加文档数量和embedding模型名称
+        
+        模型名称通过一次批量查询获取，避免每个知识库查询一次数据库。
+        
+        Args:
+            knowledge_bases: 知识库列表（会被原地修改）
+            db: 数据库会话，为空时不解析模型名称
+        """
+        model_configs = {}
+        model_ids = {kb.get("embedding_model_id") for kb in knowledge_bases if kb.get("embedding_model_id")}
+        model_lookup_failed = False
+        if db is not None and model_ids:
+            try:
+                from .model_config_service import ModelConfigService
+                model_configs = ModelConfigService.get_model_configs_by_ids(db, list(model_ids))
+            except Exception as e:
+                logger.error(f"批量获取模型配置失败: {str(e)}")
+                model_lookup_failed = True
+        
+        for kb in knowledge_bases:
+            kb["document_count"] = self.count_knowledge_base_documents(kb.get("name", ""))
+            if db is None:
+                continue
+            
+            embedding_model_id = kb.get("embedding_model_id")
+            if embedding_model_id:
+                model_config = model_configs.get(embedding_model_id)
+                if model_lookup_failed:
+                    kb["embedding_model_name"] = "获取模型信息失败"
+                elif model_config:
+                    kb["embedding_model_name"] = f"{model_config.model_name} ({model_config.provider_name})"
+                else:
+                    kb["embedding_model_name"] = "模型配置已删除"
+            else:
+                kb["embedding_model_name"] = kb.get("embedding_model", "未配置")
+        return knowledge_bases
+    
     def create_knowledge_base(self, name: str, description: str = "", embedding_model: str = "gte_Qwen2-15B-instruct", embedding_model_id: Optional[int] = None) -> Dict[str, Any]:
         """
         创建新的知识库
@@ -2,7 +2,7 @@
 模型配置服务
 处理模型配置的数据库操作
 """
-from typing import List, Optional
+from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
 from app.models.model_config import ModelConfig
@@ -107,6 +107,23 @@ class ModelConfigService:
             logger.error(f"获取模型配置失败: {e}")
             return None
     
+    @staticmethod
+    def get_model_configs_by_ids(db: Session, config_ids: List[int]) -> Dict[int, ModelConfig]:
+        """根据ID列表批量获取模型配置（一次查询）"""
+        if not config_ids:
+            return {}
+        try:
+            configs = db.query(ModelConfig).filter(
+                and_(
+                    ModelConfig.id.in_(config_ids),
+                    ModelConfig.is_active == True
+                )
+            ).all()
+            return {config.id: config for config in configs}
+        except Exception as e:
+            logger.error(f"批量获取模型配置失败: {e}")
+            raise
+    
     @staticmethod
     def get_model_configs_by_provider(db: Session, provider: str) -> List[ModelConfig]:
         """根据供应商获取模型配置"""
@@ -0,0 +1,219 @@
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# 写盘缓冲：累积到该大小再交给线程池写入，减少线程切换
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+class StreamingUploadParser:
+    """
+    流式解析multipart上传请求
+
+    请求体按块读取，文件部分边接收边写入临时文件并同时计算MD5和大小，
+    整个文件不会在内存中出现；普通表单字段（如kb_name）收集为字符串。
+    """
+
+    def __init__(
+        self,
+        temp_dir: Path,
+        max_file_size: int,
+        max_field_size: int = 64 * 1024,
+        validate_filename: Optional[Callable[[str], None]] = None,
+    ):
+        """
+        Args:
+            temp_dir: 临时文件目录（应与最终保存目录在同一文件系统，便于直接重命名）
+            max_file_size: 文件大小上限（字节），超过时返回413
+            max_field_size: 普通表单字段大小上限
+            validate_filename: 收到文件名后立即调用的校验函数，校验失败抛出HTTPException，
+                               此时还未接收文件内容
+        """
+        self.temp_dir = Path(temp_dir)
+        self.max_file_size = max_file_size
+        self.max_field_size = max_field_size
+        self.validate_filename = validate_filename
+
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.temp_path: Optional[Path] = None
+        self.file_size = 0
+        self._hasher = hashlib.md5()
+        self._file = None
+
+        # 当前部分的状态
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._field_name: Optional[str] = None
+        self._field_data = bytearray()
+        self._is_file = False
+        self._buffer = bytearray()
+        self._events = []
+
+    # ---- MultipartParser回调：只记录事件，由parse()在每块数据之后统一处理 ----
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        # 同一块数据中可能包含多个部分，头部随事件一起保存
+        self._events.append(("headers", self._headers))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        self._events.append(("data", data[start:end]))
+
+    def _on_part_end(self):
+        self._events.append(("end", None))
+
+    async def parse(self, request: Request) -> Dict[str, Any]:
+        """
+        解析请求
+
+        Returns:
+            {"fields": 表单字段, "filename": 文件名, "temp_path": 临时文件路径,
+             "file_hash": MD5, "file_size": 字节数}
+        """
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise HTTPException(status_code=400, detail="请求必须是multipart/form-data格式")
+
+        callbacks = {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        }
+        parser = MultipartParser(boundary, callbacks)
+
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                await self._process_events()
+            parser.finalize()
+            await self._process_events()
+            await self._flush()
+
+            if self.temp_path is None:
+                raise HTTPException(status_code=400, detail="请求中没有文件")
+        except BaseException:
+            self.cleanup()
+            raise
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+        return {
+            "fields": self.fields,
+            "filename": self.filename,
+            "temp_path": self.temp_path,
+            "file_hash": self._hasher.hexdigest(),
+            "file_size": self.file_size,
+        }
+
+    async def _process_events(self):
+        events, self._events = self._events, []
+        for event, data in events:
+            if event == "headers":
+                await self._start_part(data)
+            elif event == "data":
+                await self._write_part_data(data)
+            elif event == "end":
+                await self._end_part()
+
+    async def _start_part(self, headers: Dict[bytes, bytes]):
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        self._field_name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        self._field_data = bytearray()
+        self._is_file = b"filename" in options
+        if not self._is_file:
+            return
+
+        if self.temp_path is not None:
+            raise HTTPException(status_code=400, detail="一次只能上传一个文件")
+
+        # 只保留文件名部分，防止路径穿越
+        filename = options[b"filename"].decode("utf-8", errors="replace")
+        self.filename = Path(filename.replace("\\", "/")).name
+        if not self.filename:
+            raise HTTPException(status_code=400, detail="文件名不能为空")
+        if self.validate_filename:
+            self.validate_filename(self.filename)
+
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=str(self.temp_dir), suffix=".upload")
+        self.temp_path = Path(temp_path)
+        self._file = os.fdopen(fd, "wb")
+
+    async def _write_part_data(self, data: bytes):
+        if not self._is_file:
+            self._field_data.extend(data)
+            if len(self._field_data) > self.max_field_size:
+                raise HTTPException(status_code=413, detail=f"表单字段 {self._field_name} 过大")
+            return
+
+        self.file_size += len(data)
+        if self.file_size > self.max_file_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"文件大小不能超过{self.max_file_size // (1024 * 1024)}MB"
+            )
+        self._hasher.update(data)
+        self._buffer.extend(data)
+        if len(self._buffer) >= WRITE_BUFFER_SIZE:
+            await self._flush()
+
+    async def _end_part(self):
+        if self._is_file:
+            await self._flush()
+        elif self._field_name:
+            self.fields[self._field_name] = self._field_data.decode("utf-8", errors="replace")
+        self._field_name = None
+        self._is_file = False
+
+    async def _flush(self):
+        if self._buffer and self._file is not None:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            await run_in_threadpool(self._file.write, data)
+
+    def cleanup(self):
+        """删除临时文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.temp_path is not None and self.temp_path.exists():
+            try:
+                self.temp_path.unlink()
+            except OSError as e:
+                logger.warning(f"删除上传临时文件失败: {e}")
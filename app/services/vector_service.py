@@ -3,7 +3,6 @@ import datetime
 from pathlib import Path
 from typing import Dict, Any, Optional
 import logging
-import shutil
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +16,7 @@ class VectorService:
     
     def check_vector_store_exists(self, kb_name: str, doc_id: str) -> bool:
         """
-        检查文档的向量库是否存在
+        检查文档的向量是否存在（以文档向量清单为准）
         
         Args:
             kb_name: 知识库名称
@@ -27,10 +26,14 @@ class VectorService:
             向量库是否存在
         """
         try:
+            from dfy_langchain.vector_manifest import VectorManifest
+            
             vector_store_path = self.knowledge_base_dir / kb_name / "vector_store"
-            index_path = vector_store_path / doc_id
+            if not (vector_store_path / "index.faiss").exists():
+                return False
             
-            return vector_store_path.exists() and index_path.exists()
+            entry = VectorManifest(str(vector_store_path)).get_document(doc_id)
+            return bool(entry and entry.get("vector_ids"))
         except Exception as e:
             logger.error(f"检查向量库状态失败: {str(e)}")
             return False
@@ -52,21 +55,17 @@ class VectorService:
             
             metadata_service = DocumentMetadataService()
             
-            # 加载现有元数据
-            metadata = metadata_service.load_documents_metadata(kb_name)
-            
-            if doc_id not in metadata["documents"]:
+            if not metadata_service.get_document_metadata(kb_name, doc_id):
                 return {
                     "success": False,
                     "message": f"文档 '{doc_id}' 不存在"
                 }
             
-            # 更新向量状态
-            metadata["documents"][doc_id]["has_vector"] = has_vector
-            metadata["documents"][doc_id]["vector_status"] = "completed" if has_vector else "waiting"
-            
-            # 保存更新后的元数据
-            if metadata_service.save_documents_metadata(kb_name, metadata):
+            # 更新向量状态（单行更新）
+            if metadata_service.update_document_fields(kb_name, doc_id, {
+                "has_vector": has_vector,
+                "vector_status": "completed" if has_vector else "waiting"
+            }):
                 return {
                     "success": True,
                     "message": "文档向量状态已更新"
@@ -112,25 +111,17 @@ class VectorService:
             metadata_service = DocumentMetadataService()
             kb_service = KnowledgeBaseService()
             
-            # 加载文档元数据
-            all_metadata = metadata_service.load_documents_metadata(kb_name)
-            documents = all_metadata.get("documents", {})
-            
             # 查找文档：先按doc_id查找，如果找不到则按filename查找
             doc_id = None
-            doc_info = None
+            doc_info = metadata_service.get_document_metadata(kb_name, doc_identifier)
             
-            # 首先尝试作为doc_id查找
-            if doc_identifier in documents:
+            if doc_info:
                 doc_id = doc_identifier
-                doc_info = documents[doc_identifier]
             else:
                 # 如果不是doc_id，则按filename查找
-                for did, dinfo in documents.items():
-                    if dinfo.get("filename") == doc_identifier:
-                        doc_id = did
-                        doc_info = dinfo
-                        break
+                found = metadata_service.find_document_by_filename(kb_name, doc_identifier)
+                if found:
+                    doc_id, doc_info = found
             
             # 检查文档是否存在
             if not doc_id or not doc_info:
@@ -191,7 +182,7 @@ class VectorService:
                             doc_info["has_vector"] = False
                             doc_info["vector_status"] = "error"
                             doc_info["error_message"] = "找不到embedding模型配置"
-                            metadata_service.save_documents_metadata(kb_name, all_metadata)
+                            metadata_service.update_document_metadata(kb_name, doc_id, doc_info)
                             return {
                                 "success": False,
                                 "message": "找不到embedding模型配置"
@@ -234,7 +225,7 @@ class VectorService:
                     )
                 
                 # 实际执行向量化处理
-                success = rag_pipeline.load_single_document(str(file_path))
+                success = rag_pipeline.load_single_document(str(file_path), doc_id=doc_id)
                 
                 if not success:
                     raise Exception("RAG Pipeline向量化处理失败")
@@ -254,9 +245,13 @@ class VectorService:
                 doc_info["vector_status"] = "completed"
                 doc_info["vector_time"] = datetime.datetime.now().isoformat()
                 doc_info["embedding_model_id"] = embedding_model_id
+                if rag_pipeline.last_dedup_stats:
+                    doc_info["dedup_stats"] = rag_pipeline.last_dedup_stats
+                if rag_pipeline.last_delta_stats:
+                    doc_info["delta_stats"] = rag_pipeline.last_delta_stats
                 
                 # 保存元数据
-                if metadata_service.save_documents_metadata(kb_name, all_metadata):
+                if metadata_service.update_document_metadata(kb_name, doc_id, doc_info):
                     return {
                         "success": True,
                         "message": f"文档 '{filename}' 向量化成功",
@@ -264,7 +259,9 @@ class VectorService:
                             "doc_id": doc_id,
                             "has_vector": True,
                             "vector_status": "completed",
-                            "embedding_model_id": embedding_model_id
+                            "embedding_model_id": embedding_model_id,
+                            "dedup_stats": doc_info.get("dedup_stats"),
+                            "delta_stats": doc_info.get("delta_stats")
                         }
                     }
                 else:
@@ -282,7 +279,7 @@ class VectorService:
                 doc_info["vector_time"] = datetime.datetime.now().isoformat()
                 doc_info["error_message"] = str(vector_error)
                 
-                metadata_service.save_documents_metadata(kb_name, all_metadata)
+                metadata_service.update_document_metadata(kb_name, doc_id, doc_info)
                 
                 return {
                     "success": False,
@@ -299,27 +296,37 @@ class VectorService:
                 "message": f"处理文档失败: {str(e)}"
             }
     
-    def delete_document_vectors(self, kb_name: str, doc_id: str) -> bool:
+    def delete_document_vectors(self, kb_name: str, doc_id: str, filename: Optional[str] = None) -> bool:
         """
         删除文档的向量数据
         
+        根据文档向量清单在主向量库和分层索引中原地删除该文档的向量，
+        没有清单记录的旧数据按文件来源匹配删除。
+        
         Args:
             kb_name: 知识库名称
             doc_id: 文档ID
+            filename: 文档文件名（为空时从元数据读取）
             
         Returns:
             是否删除成功
         """
         try:
+            from dfy_langchain.vector_manifest import remove_document_vectors, vector_store_lock
+            
             vector_store_path = self.knowledge_base_dir / kb_name / "vector_store"
-            doc_vector_path = vector_store_path / doc_id
+            if not vector_store_path.exists():
+                return True
             
-            if doc_vector_path.exists():
-                if doc_vector_path.is_dir():
-                    shutil.rmtree(doc_vector_path)
-                else:
-                    doc_vector_path.unlink()
-                logger.info(f"已删除文档 {doc_id} 的向量数据")
+            if not filename:
+                from .document_metadata_service import DocumentMetadataService
+                doc_metadata = DocumentMetadataService().get_document_metadata(kb_name, doc_id)
+                filename = doc_metadata.get("filename") if doc_metadata else None
+            source = str(self.knowledge_base_dir / kb_name / "content" / filename) if filename else None
+            
+            with vector_store_lock(str(vector_store_path)):
+                removed = remove_document_vectors(str(vector_store_path), doc_key=doc_id, source=source)
+            logger.info(f"已删除文档 {doc_id} 的向量数据: {removed}")
             
             return True
             
@@ -11,6 +11,15 @@ let isProcessing = false;
 let availableModels = [];
 let selectedModel = null;
 let networkSearchEnabled = localStorage.getItem('networkSearchEnabled') === 'true' || false;
+// 知识库对话的会话ID，服务端按会话保存对话历史，刷新对话时更换
+let ragSessionId = createRAGSessionId();
+
+function createRAGSessionId() {
+    if (window.crypto && window.crypto.randomUUID) {
+        return window.crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+}
     
 // 初始化函数
 function initialize() {
@@ -79,6 +88,10 @@ function setupRefreshChat() {
             chatMessages.innerHTML = '';
             isProcessing = false;
             
+            // 开始新的知识库对话，服务端旧会话的历史一并清除
+            fetch(`/rag/api/clear-history?session_id=${encodeURIComponent(ragSessionId)}`, { method: 'POST' }).catch(() => {});
+            ragSessionId = createRAGSessionId();
+            
             const userInput = document.getElementById('userInput');
             if (userInput) {
                 userInput.focus();
@@ -647,7 +660,7 @@ function processRAGMessageWithStreaming(userMessage) {
         knowledge_base_ids: ragConfig.knowledge_base_ids || [],
         knowledge_bases: ragConfig.knowledge_base_ids || [],
         history: [],
-        session_id: null,
+        session_id: ragSessionId,
         top_k: ragConfig.top_k || 15,  // 增加到15，确保杨女士等实体的所有相关块都能被检索
         threshold: ragConfig.threshold || 0.7,
         rerank: ragConfig.rerank || false,
@@ -894,6 +907,10 @@ async function processRAGStreamResponseWithProgress(response, markdownDiv, progr
     let firstChunkReceived = false;
     let knowledgeRetrieved = false;
     let generatingStarted = false;
+    // 一次读取可能在事件中间截断，未完整的最后一行留到下次拼接
+    let pendingLine = '';
+    // 检索完成时收到的来源，回答结束后附在末尾
+    let ragSources = [];
     
     function processRAGStream({ done, value }) {
         if (done) {
@@ -909,8 +926,9 @@ async function processRAGStreamResponseWithProgress(response, markdownDiv, progr
         }
         
         try {
-            const chunk = decoder.decode(value, { stream: true });
-            const lines = chunk.split('\n').filter(line => line.trim());
+            const chunk = pendingLine + decoder.decode(value, { stream: true });
+            const lines = chunk.split('\n');
+            pendingLine = lines.pop();
             
             for (const line of lines) {
                 if (!line.trim() || !line.startsWith('data: ')) continue;
@@ -923,7 +941,7 @@ async function processRAGStreamResponseWithProgress(response, markdownDiv, progr
                         if (!knowledgeRetrieved) {
                             // 延迟1秒后更新状态为"正在检索中"
                             setTimeout(() => {
-                                if (progressElement && progressElement.parentNode) {
+                                if (progressElement && progressElement.parentNode && !ragSources.length && !generatingStarted) {
                                     updateNetworkSearchProgress(progressElement, 'found', '正在检索中');
                                 }
                             }, 1000);
@@ -933,6 +951,12 @@ async function processRAGStreamResponseWithProgress(response, markdownDiv, progr
                         if (!firstChunkReceived) {
                             firstChunkReceived = true;
                         }
+                    } else if (data.type === 'sources') {
+                        ragSources = data.sources || [];
+                        knowledgeRetrieved = true;
+                        if (!generatingStarted) {
+                            updateNetworkSearchProgress(progressElement, 'found', `检索到 ${ragSources.length} 个来源，等待生成`);
+                        }
                     } else if (data.type === 'message' && data.content) {
                         if (!generatingStarted) {
                             // 收到第一个内容块时，更新进度为"正在生成回答"
@@ -952,6 +976,11 @@ async function processRAGStreamResponseWithProgress(response, markdownDiv, progr
                         accumulatedText += data.content;
                         debouncedRenderer(accumulatedText);
                     } else if (data.type === 'done') {
+                        if (accumulatedText && ragSources.length) {
+                            accumulatedText += '\n\n📚 参考来源:\n' + ragSources.slice(0, 3)
+                                .map((source, i) => `${i + 1}. ${source.source}\n`).join('');
+                        }
+                        console.log('RAG耗时:', { retrieval_ms: data.retrieval_ms, ttft_ms: data.ttft_ms, total_ms: data.total_ms });
                         if (!firstChunkReceived) {
                             markdownDiv.innerHTML = '<p>没有接收到RAG回复</p>';
                         } else if (accumulatedText) {
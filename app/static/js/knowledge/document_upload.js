@@ -388,6 +388,31 @@ class DocumentUploadManager {
 
     // 队列状态监控
     startQueueStatusMonitoring() {
+        // 优先使用SSE推送队列状态，不支持时每2秒轮询
+        if (this.currentKbName && typeof EventSource !== 'undefined') {
+            this.queueEventSource = new EventSource(`/knowledge/api/documents/events?kb_name=${encodeURIComponent(this.currentKbName)}`);
+            this.queueEventSource.addEventListener('snapshot', (e) => {
+                const snapshot = JSON.parse(e.data);
+                if (snapshot.queue) {
+                    this.displayQueueStatus(snapshot.queue);
+                }
+            });
+            this.queueEventSource.addEventListener('queue', (e) => {
+                this.displayQueueStatus(JSON.parse(e.data));
+            });
+            this.queueEventSource.onerror = () => {
+                if (this.queueEventSource && this.queueEventSource.readyState === EventSource.CLOSED) {
+                    this.stopQueueStatusMonitoring();
+                    this.startQueueStatusPolling();
+                }
+            };
+            return;
+        }
+        
+        this.startQueueStatusPolling();
+    }
+
+    startQueueStatusPolling() {
         // 立即获取一次状态
         this.updateQueueStatus();
         
@@ -398,6 +423,10 @@ class DocumentUploadManager {
     }
 
     stopQueueStatusMonitoring() {
+        if (this.queueEventSource) {
+            this.queueEventSource.close();
+            this.queueEventSource = null;
+        }
         if (this.queueStatusInterval) {
             clearInterval(this.queueStatusInterval);
             this.queueStatusInterval = null;
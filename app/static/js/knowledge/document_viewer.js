@@ -19,14 +19,11 @@ document.addEventListener('DOMContentLoaded', function() {
     // 加载文档列表
     loadDocumentsList();
     
-    // 延迟启动状态监控，等待初始加载完成
-    setTimeout(startStatusMonitoring, 1000);
+    // 延迟启动状态监控（优先使用SSE推送），等待初始加载完成
+    setTimeout(startIngestionMonitoring, 1000);
     
     // 延迟检查分层索引状态
     setTimeout(checkHierarchicalIndexStatus, 2000);
-    
-    // 启动实时分层索引状态监控
-    setTimeout(startRealtimeHierarchicalStatusMonitoring, 3000);
 });
 
 // 从URL和模板变量获取知识库信息
@@ -323,11 +320,13 @@ function renderDocumentsList() {
         if (vectorStatus) {
             const status = vectorStatus.toLowerCase();
             if (status === 'processing') {
-                statusHtml = `<div class="doc-status processing"><i class="fas fa-spinner fa-spin"></i> 处理中</div>`;
+                const progressText = doc.ingest_progress ? ` · ${escapeHtml(doc.ingest_progress)}` : '';
+                statusHtml = `<div class="doc-status processing"><i class="fas fa-spinner fa-spin"></i> 处理中${progressText}</div>`;
             } else if (status === 'completed') {
                 statusHtml = `<div class="doc-status completed"><i class="fas fa-check-circle"></i> 已完成</div>`;
             } else if (status === 'waiting' || status === 'pending') {
-                statusHtml = `<div class="doc-status pending"><i class="fas fa-clock"></i> 等待中</div>`;
+                const progressText = doc.ingest_progress ? ` · ${escapeHtml(doc.ingest_progress)}` : '';
+                statusHtml = `<div class="doc-status pending"><i class="fas fa-clock"></i> 等待中${progressText}</div>`;
             } else if (status === 'error') {
                 statusHtml = `<div class="doc-status error"><i class="fas fa-exclamation-circle"></i> 错误</div>`;
             } else {
@@ -784,8 +783,104 @@ function hasPendingDocuments() {
     });
 }
 
+// 入库进度推送（SSE），不支持或连接关闭时回退到轮询
+let ingestionEventSource = null;
+
+const INGESTION_STAGE_TEXT = {
+    queued: '排队中',
+    parsing: '解析中',
+    embedding: '向量化',
+    indexing: '写入索引',
+    hierarchical: '分层索引',
+    retrying: '等待重试'
+};
+
+function startIngestionMonitoring() {
+    if (!currentKbName || typeof EventSource === 'undefined') {
+        startPollingMonitoring();
+        return;
+    }
+    
+    ingestionEventSource = new EventSource(`/knowledge/api/documents/events?kb_name=${encodeURIComponent(currentKbName)}`);
+    
+    ingestionEventSource.addEventListener('snapshot', (e) => {
+        const snapshot = JSON.parse(e.data);
+        (snapshot.documents || []).forEach(event => applyIngestionEvent(event, false));
+        renderDocumentsList();
+    });
+    
+    ingestionEventSource.addEventListener('stage', (e) => {
+        applyIngestionEvent(JSON.parse(e.data), true);
+    });
+    
+    ingestionEventSource.onerror = () => {
+        // 连接被关闭（而不是自动重连中）时回退到轮询
+        if (ingestionEventSource && ingestionEventSource.readyState === EventSource.CLOSED) {
+            console.warn('入库进度推送连接已关闭，改为轮询');
+            stopIngestionMonitoring();
+            startPollingMonitoring();
+        }
+    };
+}
+
+function stopIngestionMonitoring() {
+    if (ingestionEventSource) {
+        ingestionEventSource.close();
+        ingestionEventSource = null;
+    }
+}
+
+function startPollingMonitoring() {
+    startStatusMonitoring();
+    startRealtimeHierarchicalStatusMonitoring();
+}
+
+function applyIngestionEvent(event, rerender) {
+    const doc = documentsList.find(d => d.id === event.doc_id);
+    
+    if (event.stage === 'completed' || event.stage === 'error') {
+        if (rerender) {
+            // 以服务端元数据为准刷新列表和分层索引状态
+            loadDocumentsList();
+            if (event.stage === 'completed') {
+                checkHierarchicalIndexStatus();
+            }
+        }
+        return;
+    }
+    
+    if (!doc) {
+        // 其他页面新上传的文档
+        if (rerender && event.stage === 'queued' && currentPage === 1) {
+            loadDocumentsList();
+        }
+        return;
+    }
+    
+    doc.vector_status = (event.stage === 'queued' || event.stage === 'retrying') ? 'waiting' : 'processing';
+    doc.ingest_progress = formatIngestionProgress(event);
+    
+    if (rerender) {
+        renderDocumentsList();
+    }
+}
+
+function formatIngestionProgress(event) {
+    let text = INGESTION_STAGE_TEXT[event.stage] || event.stage;
+    if (event.stage === 'embedding' && event.chunks) {
+        text += ` ${event.embedded_chunks || 0}/${Math.max(event.chunks - (event.reused_chunks || 0), 0)}`;
+        if (event.chunks_per_second) {
+            text += ` (${event.chunks_per_second}块/秒)`;
+        }
+    } else if (event.stage === 'parsing' && event.chunks) {
+        text += ` ${event.chunks}块`;
+    }
+    return text;
+}
+
 // 页面卸载时停止监控
 window.addEventListener('beforeunload', function() {
+    stopIngestionMonitoring();
     stopStatusMonitoring();
 });
 
@@ -0,0 +1,184 @@
+"""
+RAG语义回答缓存
+
+相同或语义相近的问题（问题向量的余弦相似度不低于阈值）在同一组知识库、同一模型和检索配置下
+直接返回之前生成的回答，省去检索和大模型调用。
+缓存条目记录生成时各知识库索引文件的版本（修改时间和大小），知识库重新向量化后自动失效。
+
+只缓存没有对话历史的问题：有历史时回答依赖上下文，不能复用。
+
+环境变量:
+    RAG_ANSWER_CACHE: 是否启用，默认true
+    RAG_ANSWER_CACHE_THRESHOLD: 相似度阈值，默认0.95
+    RAG_ANSWER_CACHE_SIZE: 最多缓存的回答数，默认500
+    RAG_ANSWER_CACHE_TTL: 回答的最长缓存时间（秒），默认86400
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """问题文本归一化（去掉首尾和连续空白、统一小写），用于精确匹配"""
+    return _WHITESPACE_PATTERN.sub(" ", query.strip().lower())
+
+
+class SemanticAnswerCache:
+    """语义回答缓存（线程安全）"""
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        similarity_threshold: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None
+    ):
+        self.enabled = enabled if enabled is not None else os.getenv("RAG_ANSWER_CACHE", "true").lower() == "true"
+        self.similarity_threshold = similarity_threshold or float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD", "0.95"))
+        self.max_entries = max_entries or int(os.getenv("RAG_ANSWER_CACHE_SIZE", "500"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("RAG_ANSWER_CACHE_TTL", "86400"))
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._scopes: Dict[tuple, List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.stores = 0
+
+    def lookup(self, query: str, embedding: Optional[List[float]], scope: tuple, versions: tuple) -> Optional[Dict[str, Any]]:
+        """
+        查找缓存的回答
+
+        Args:
+            query: 用户问题
+            embedding: 问题向量，为None时只做文本精确匹配
+            scope: 知识库、模型和检索配置，只在相同scope的条目中查找
+            versions: 知识库索引当前的版本
+
+        Returns:
+            命中的条目（包含answer、source_documents、similarity），未命中时返回None
+        """
+        normalized = normalize_query(query)
+        vector = self._normalize_vector(embedding)
+        now = time.time()
+        with self._lock:
+            best, best_similarity = None, -1.0
+            for entry_id in list(self._scopes.get(scope, [])):
+                entry = self._entries[entry_id]
+                if entry["versions"] != versions or now - entry["created_at"] > self.ttl_seconds:
+                    # 知识库已更新或条目过期
+                    self._remove(entry_id)
+                    self.invalidated += 1
+                    continue
+                if entry["normalized_query"] == normalized:
+                    similarity = 1.0
+                elif vector is not None and entry["vector"] is not None:
+                    similarity = float(np.dot(vector, entry["vector"]))
+                else:
+                    continue
+                if similarity > best_similarity:
+                    best, best_similarity = entry, similarity
+
+            if best is None or best_similarity < self.similarity_threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            best["hits"] += 1
+            self._entries.move_to_end(best["id"])
+            return {
+                "answer": best["answer"],
+                "source_documents": best["source_documents"],
+                "similarity": round(best_similarity, 4),
+                "cached_query": best["query"],
+            }
+
+    def store(self, query: str, embedding: Optional[List[float]], scope: tuple, versions: tuple,
+              answer: str, source_documents: List[Any]):
+        """缓存生成的回答（超出容量时淘汰最久未命中的条目）"""
+        vector = self._normalize_vector(embedding)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "id": entry_id,
+                "scope": scope,
+                "query": query,
+                "normalized_query": normalize_query(query),
+                "vector": vector,
+                "versions": versions,
+                "answer": answer,
+                "source_documents": list(source_documents),
+                "created_at": time.time(),
+                "hits": 0,
+            }
+            self._scopes.setdefault(scope, []).append(entry_id)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidated": self.invalidated,
+                "stores": self.stores,
+                "similarity_threshold": self.similarity_threshold,
+            }
+
+    def _remove(self, entry_id: int):
+        """删除条目（调用方持有锁）"""
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        ids = self._scopes.get(entry["scope"])
+        if ids is not None:
+            ids.remove(entry_id)
+            if not ids:
+                del self._scopes[entry["scope"]]
+
+    @staticmethod
+    def _normalize_vector(embedding: Optional[List[float]]) -> Optional[np.ndarray]:
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else None
+
+
+def get_index_version(kb_dir: str) -> Tuple:
+    """知识库索引文件的版本（各索引文件的修改时间和大小），重新向量化或重建分层索引后会变化"""
+    version = []
+    for relative in (
+        os.path.join("vector_store", "index.faiss"),
+        os.path.join("vector_store", "index.pkl"),
+        os.path.join("hierarchical_vector_store", "summary_vector_store", "index.faiss"),
+        os.path.join("hierarchical_vector_store", "chunk_vector_store", "index.faiss"),
+    ):
+        try:
+            stat = os.stat(os.path.join(kb_dir, relative))
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+
+# 全局回答缓存
+answer_cache = SemanticAnswerCache()
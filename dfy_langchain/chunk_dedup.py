@@ -0,0 +1,325 @@
+## 分块级别的去重：向量化之前过滤重复分块
+
+import hashlib
+import json
+import os
+import re
+import unicodedata
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+# 去重记录文件名（保存在向量库目录下）
+CHUNK_HASHES_FILENAME = "chunk_hashes.json"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_chunk_text(text: str) -> str:
+    """规范化分块文本：全角转半角、统一大小写、合并空白"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
+
+
+def chunk_text_hash(text: str) -> str:
+    """计算规范化后分块文本的哈希"""
+    return hashlib.md5(normalize_chunk_text(text).encode("utf-8")).hexdigest()
+
+
+class MinHasher:
+    """
+    基于字符n-gram的MinHash签名，用于近似重复检测
+
+    使用numpy批量计算multiply-shift哈希族，签名按band切分做LSH分桶，
+    只有落入同一个桶的候选才会计算相似度。
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, shingle_size: int = 4, seed: int = 1):
+        import numpy as np
+
+        self.np = np
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # 奇数乘子保证multiply-shift哈希的分布
+        self._a = (rng.randint(1, 2 ** 31, size=num_perm, dtype=np.uint64) << np.uint64(32)) | \
+            rng.randint(0, 2 ** 31, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.randint(0, 2 ** 31, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> List[int]:
+        np = self.np
+        text = normalize_chunk_text(text).replace(" ", "")
+        if len(text) <= self.shingle_size:
+            shingles = {text}
+        else:
+            shingles = {text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1)}
+        base = np.fromiter(
+            (int.from_bytes(hashlib.md5(s.encode("utf-8")).digest()[:4], "little") for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        with np.errstate(over="ignore"):
+            hashed = (self._a[:, None] * base[None, :] + self._b[:, None]) >> np.uint64(32)
+        return hashed.min(axis=1).astype(np.int64).tolist()
+
+    def band_keys(self, signature: List[int]) -> List[str]:
+        return [
+            f"{band}:" + ",".join(str(v) for v in signature[band * self.rows:(band + 1) * self.rows])
+            for band in range(self.bands)
+        ]
+
+    @staticmethod
+    def similarity(sig1: List[int], sig2: List[int]) -> float:
+        if not sig1 or len(sig1) != len(sig2):
+            return 0.0
+        return sum(1 for a, b in zip(sig1, sig2) if a == b) / len(sig1)
+
+
+class ChunkDeduplicator:
+    """
+    分块去重器
+
+    对规范化后的分块文本计算哈希，完全相同的分块只向量化、入库一次，
+    重复分块复用已有的向量ID，并记录所有来源（写入被复用文档的duplicate_sources元数据）。
+    可选开启MinHash近似重复检测（CHUNK_DEDUP_NEAR=true）。
+
+    去重记录保存在向量库目录下的chunk_hashes.json:
+    {
+        "chunks": {hash: {"id": 向量ID, "source": 首个来源, "sources": [其他来源], "refs": 引用次数}},
+        "minhash": {hash: 签名}  # 仅近似去重模式
+    }
+    """
+
+    def __init__(
+        self,
+        vector_store_path: str,
+        enabled: Optional[bool] = None,
+        near_duplicate: Optional[bool] = None,
+        near_threshold: Optional[float] = None,
+    ):
+        self.vector_store_path = vector_store_path
+        self.record_path = os.path.join(vector_store_path, CHUNK_HASHES_FILENAME)
+        self.enabled = (
+            enabled if enabled is not None
+            else os.getenv("CHUNK_DEDUP_ENABLED", "true").lower() == "true"
+        )
+        self.near_duplicate = (
+            near_duplicate if near_duplicate is not None
+            else os.getenv("CHUNK_DEDUP_NEAR", "false").lower() == "true"
+        )
+        self.near_threshold = (
+            near_threshold if near_threshold is not None
+            else float(os.getenv("CHUNK_DEDUP_NEAR_THRESHOLD", "0.9"))
+        )
+
+        self._minhasher = None
+        if self.enabled and self.near_duplicate:
+            try:
+                self._minhasher = MinHasher()
+            except ImportError:
+                print("未安装numpy，近似重复检测已禁用")
+                self.near_duplicate = False
+
+        self.records: Dict[str, Dict] = {}
+        self.signatures: Dict[str, List[int]] = {}
+        self._buckets: Dict[str, List[str]] = {}
+        self._dirty = False
+        # 上次读取/保存时去重记录文件的(修改时间, 大小)，用于判断是否被其他进程或删除操作修改
+        self._record_stamp = None
+        # 当前文档每个分块对应的(哈希, 向量ID)，用于维护文档向量清单
+        self.document_refs: List[Tuple[str, str]] = []
+        self._load()
+        self.reset_stats()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.record_path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def reload(self):
+        """
+        去重记录文件在上次读取/保存后被修改过（其他任务向量化或删除文档）时重新读取
+
+        需要在向量库锁内、修改去重记录之前调用；未被修改时保留内存中的记录（包括未保存的部分）
+        """
+        if self.enabled and self._file_stamp() != self._record_stamp:
+            self._load()
+
+    def _load(self):
+        self.records = {}
+        self.signatures = {}
+        self._buckets = {}
+        self._dirty = False
+        self._record_stamp = self._file_stamp()
+        if not self.enabled or self._record_stamp is None:
+            return
+        try:
+            with open(self.record_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.records = data.get("chunks", {})
+            self.signatures = data.get("minhash", {})
+            if self._minhasher:
+                for chunk_hash, signature in self.signatures.items():
+                    self._index_signature(chunk_hash, signature)
+        except Exception as e:
+            print(f"加载分块去重记录失败，将重新记录: {e}")
+            self.records = {}
+            self.signatures = {}
+
+    def save(self):
+        """保存去重记录（临时文件+替换）"""
+        if not self.enabled or not self._dirty:
+            return
+        os.makedirs(self.vector_store_path, exist_ok=True)
+        data = {"chunks": self.records}
+        if self.signatures:
+            data["minhash"] = self.signatures
+        tmp_path = self.record_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.record_path)
+        self._dirty = False
+        self._record_stamp = self._file_stamp()
+
+    def start_document(self):
+        """开始处理新文档，清空该文档的分块引用记录"""
+        self.document_refs = []
+
+    def reset_stats(self):
+        self.stats = {
+            "total_chunks": 0,
+            "unique_chunks": 0,
+            "exact_duplicates": 0,
+            "near_duplicates": 0,
+            "dedup_ratio": 0.0,
+        }
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        total = stats["total_chunks"]
+        stats["dedup_ratio"] = round(
+            (stats["exact_duplicates"] + stats["near_duplicates"]) / total, 4
+        ) if total else 0.0
+        return stats
+
+    def _index_signature(self, chunk_hash: str, signature: List[int]):
+        for key in self._minhasher.band_keys(signature):
+            self._buckets.setdefault(key, []).append(chunk_hash)
+
+    def _find_near_duplicate(self, signature: List[int]) -> Optional[str]:
+        checked = set()
+        for key in self._minhasher.band_keys(signature):
+            for candidate in self._buckets.get(key, []):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if MinHasher.similarity(signature, self.signatures.get(candidate, [])) >= self.near_threshold:
+                    return candidate
+        return None
+
+    @staticmethod
+    def _vector_exists(vectorstore, vector_id: str) -> bool:
+        if vectorstore is None:
+            return False
+        try:
+            return isinstance(vectorstore.docstore.search(vector_id), Document)
+        except Exception:
+            return False
+
+    def _add_source(self, vectorstore, record: Dict, chunk: Document):
+        """记录重复分块的来源，并写入被复用文档的元数据"""
+        source = chunk.metadata.get("source")
+        record["refs"] = record.get("refs", 1) + 1
+        if source and source != record.get("source") and source not in record.setdefault("sources", []):
+            record["sources"].append(source)
+            try:
+                existing = vectorstore.docstore.search(record["id"]) if vectorstore is not None else None
+                if isinstance(existing, Document):
+                    duplicate_sources = existing.metadata.setdefault("duplicate_sources", [])
+                    if source not in duplicate_sources:
+                        duplicate_sources.append(source)
+            except Exception:
+                pass
+
+    def deduplicate(self, chunks: List[Document], vectorstore=None) -> Tuple[List[Document], List[str]]:
+        """
+        过滤重复分块
+
+        Args:
+            chunks: 待入库的分块
+            vectorstore: 当前向量库（用于确认记录中的向量ID仍然有效）
+
+        Returns:
+            (需要向量化的分块, 对应的向量ID)
+        """
+        if not self.enabled:
+            ids = [str(uuid.uuid4()) for _ in chunks]
+            self.stats["total_chunks"] += len(chunks)
+            self.stats["unique_chunks"] += len(chunks)
+            self.document_refs.extend(
+                (chunk_text_hash(chunk.page_content), vector_id) for chunk, vector_id in zip(chunks, ids)
+            )
+            return chunks, ids
+
+        unique_chunks = []
+        unique_ids = []
+        # 本批次新增的分块ID，尚未写入向量库
+        pending_ids = set()
+        for chunk in chunks:
+            self.stats["total_chunks"] += 1
+            chunk_hash = chunk_text_hash(chunk.page_content)
+            chunk.metadata["chunk_hash"] = chunk_hash
+
+            record = self.records.get(chunk_hash)
+            if record and (record["id"] in pending_ids or self._vector_exists(vectorstore, record["id"])):
+                self.stats["exact_duplicates"] += 1
+                self._add_source(vectorstore, record, chunk)
+                self.document_refs.append((chunk_hash, record["id"]))
+                self._dirty = True
+                continue
+
+            signature = None
+            if self._minhasher:
+                signature = self._minhasher.signature(chunk.page_content)
+                near_hash = self._find_near_duplicate(signature)
+                near_record = self.records.get(near_hash) if near_hash else None
+                if near_record and (
+                    near_record["id"] in pending_ids or self._vector_exists(vectorstore, near_record["id"])
+                ):
+                    self.stats["near_duplicates"] += 1
+                    self._add_source(vectorstore, near_record, chunk)
+                    self.document_refs.append((chunk_hash, near_record["id"]))
+                    # 近似重复的文本也指向同一个向量，之后完全相同的文本直接命中
+                    self.records[chunk_hash] = {
+                        "id": near_record["id"],
+                        "source": chunk.metadata.get("source"),
+                        "sources": [],
+                        "refs": 1,
+                        "near_duplicate_of": near_hash,
+                    }
+                    self._dirty = True
+                    continue
+
+            vector_id = str(uuid.uuid4())
+            self.records[chunk_hash] = {
+                "id": vector_id,
+                "source": chunk.metadata.get("source"),
+                "sources": [],
+                "refs": 1,
+            }
+            if signature is not None:
+                self.signatures[chunk_hash] = signature
+                self._index_signature(chunk_hash, signature)
+            pending_ids.add(vector_id)
+            self.document_refs.append((chunk_hash, vector_id))
+            unique_chunks.append(chunk)
+            unique_ids.append(vector_id)
+            self.stats["unique_chunks"] += 1
+            self._dirty = True
+
+        return unique_chunks, unique_ids
@@ -0,0 +1,234 @@
+"""
+RAG上下文打包
+
+把检索到的文档片段按相关性分数装入固定的token预算：
+- 按目标模型计数token（有tiktoken时使用模型对应的编码，否则按字符估算）
+- 同一来源中被其他片段包含的片段直接去掉，和已选片段首尾重叠的部分去掉
+- 同一来源的片段合并在一个标题下，来源信息只出现一次
+- 放不下的低分片段以关键词命中位置为中心截取，剩余预算太少时丢弃
+
+环境变量:
+    RAG_CONTEXT_TOKEN_BUDGET: 检索文档部分的token预算，默认6000，设为0时不打包（完整拼接所有片段）
+"""
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 片段剩余可用预算少于该token数时不再截取，直接丢弃
+MIN_CHUNK_TOKENS = 64
+# 判断首尾重叠时比较的最大/最小字符数（分块重叠为150字符）
+MAX_OVERLAP_CHARS = 400
+MIN_OVERLAP_CHARS = 30
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+def get_default_token_budget() -> int:
+    return int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "6000"))
+
+
+@lru_cache(maxsize=32)
+def _get_encoding(model_name: str):
+    """模型对应的tiktoken编码，不可用时返回None"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        pass
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # 编码文件需要联网下载，离线环境下退回按字符估算
+        print(f"加载tiktoken编码失败，按字符估算token数: {e}")
+        return None
+
+
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """计算文本的token数"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model_name or "")
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # 估算：中文字符约1个token，其他字符约4个一个token
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _document_score(scores: Any) -> float:
+    if isinstance(scores, dict):
+        return float(scores.get("combined_score", 0))
+    return float(scores)
+
+
+def _strip_overlap(text: str, packed: List[str]) -> Optional[str]:
+    """去掉与同一来源已选片段重复的部分，整段重复时返回None"""
+    for existing in packed:
+        if text in existing:
+            return None
+        limit = min(len(text), len(existing), MAX_OVERLAP_CHARS)
+        for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+            # 已选片段的结尾是当前片段的开头：去掉开头
+            if existing.endswith(text[:size]):
+                text = text[size:]
+                break
+            # 当前片段的结尾是已选片段的开头：去掉结尾
+            if existing.startswith(text[-size:]):
+                text = text[:-size]
+                break
+    return text.strip() or None
+
+
+def _trim_around_keywords(text: str, keywords: List[str], max_chars: int) -> str:
+    """截取max_chars个字符：以第一个关键词命中位置为中心，没有命中时保留开头"""
+    if len(text) <= max_chars:
+        return text
+    lowered = text.lower()
+    hit = -1
+    for keyword in keywords:
+        if keyword:
+            hit = lowered.find(keyword.lower())
+            if hit >= 0:
+                break
+    start = 0 if hit < 0 else max(0, min(hit - max_chars // 2, len(text) - max_chars))
+    end = start + max_chars
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if end < len(text) else ""
+    return f"{prefix}{text[start:end]}{suffix}"
+
+
+def _source_header(doc) -> Tuple[str, str]:
+    """来源标识和来源信息（文件级，只出现一次）"""
+    source = doc.metadata.get("source", "未知来源")
+    filename = os.path.basename(source) if source else "未知文档"
+    info = [f"文件名: {filename}"]
+    if "created_at" in doc.metadata:
+        info.append(f"创建时间: {doc.metadata['created_at']}")
+    if "author" in doc.metadata:
+        info.append(f"作者: {doc.metadata['author']}")
+    return filename, "\n".join(info)
+
+
+def _chunk_label(doc, score: Optional[float]) -> str:
+    """片段位置和分数（片段级）"""
+    parts = []
+    if "page" in doc.metadata:
+        parts.append(f"页码: {doc.metadata['page']}")
+    if "row" in doc.metadata:
+        parts.append(f"行号: {doc.metadata['row']}")
+    if score is not None:
+        parts.append(f"相关性: {score:.2f}")
+    return f"[{', '.join(parts)}]\n" if parts else ""
+
+
+class ContextPacker:
+    """按token预算打包检索到的文档片段"""
+
+    def __init__(self, token_budget: Optional[int] = None, model_name: Optional[str] = None):
+        self.token_budget = get_default_token_budget() if token_budget is None else token_budget
+        self.model_name = model_name
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model_name)
+
+    def pack(self, docs: List[Any], query: str = "") -> Tuple[str, Dict[str, Any]]:
+        """
+        打包文档片段
+
+        Args:
+            docs: 文档列表或(文档,分数)元组列表
+            query: 用户问题，片段没有记录命中的关键词时用于定位截取位置
+
+        Returns:
+            (上下文文本, 统计信息)，统计信息包括片段数、去重/截取/丢弃数量、使用的token数，
+            以及按各片段原始token数估算的完整拼接token数（full_tokens）和节省的token数（tokens_saved）
+        """
+        items = []
+        for index, item in enumerate(docs):
+            if isinstance(item, tuple):
+                doc, scores = item
+                score = _document_score(scores)
+            else:
+                doc, score = item, None
+            items.append((index, doc, score))
+        # 按分数从高到低装入，没有分数时保持检索顺序
+        items.sort(key=lambda x: (-(x[2] if x[2] is not None else 0), x[0]))
+
+        stats = {
+            "chunks": len(items),
+            "chunks_used": 0,
+            "duplicates_removed": 0,
+            "trimmed": 0,
+            "dropped": 0,
+            "budget": self.token_budget,
+            "context_tokens": 0,
+        }
+        groups: Dict[str, Dict[str, Any]] = {}
+        used = 0
+        # 完整拼接时的token数：已计数的片段直接累加，去重/去重叠删掉的字符按已计数片段的字符/token比例估算
+        full_tokens = 0
+        counted_chars = 0
+        counted_tokens = 0
+        uncounted_chars = 0
+
+        for _, doc, score in items:
+            filename, source_info = _source_header(doc)
+            group = groups.get(filename)
+            header = "" if group else f"文档 ({filename}):\n来源信息:\n{source_info}\n内容:\n"
+
+            raw = doc.page_content.strip()
+            text = _strip_overlap(raw, group["texts"] if group else [])
+            if text is None:
+                stats["duplicates_removed"] += 1
+                uncounted_chars += len(raw)
+                continue
+            uncounted_chars += len(raw) - len(text)
+
+            label = _chunk_label(doc, score)
+            overhead = self.count(header + label) + 2
+            remaining = self.token_budget - used - overhead
+            tokens = self.count(text)
+            full_tokens += overhead + tokens
+            counted_chars += len(text)
+            counted_tokens += tokens
+
+            if tokens > remaining:
+                if remaining < MIN_CHUNK_TOKENS:
+                    stats["dropped"] += 1
+                    continue
+                keywords = doc.metadata.get("matched_keywords") or [query]
+                # 按当前片段的字符/token比例估算截取长度，超出时逐步缩短
+                max_chars = int(len(text) * remaining / tokens)
+                while True:
+                    trimmed = _trim_around_keywords(text, keywords, max_chars)
+                    tokens = self.count(trimmed)
+                    if tokens <= remaining or max_chars <= 1:
+                        break
+                    max_chars = int(max_chars * remaining / tokens * 0.95)
+                text = trimmed
+                stats["trimmed"] += 1
+
+            if group is None:
+                group = groups[filename] = {"header": header, "texts": [], "parts": []}
+            group["texts"].append(text)
+            group["parts"].append(label + text)
+            used += overhead + tokens
+            stats["chunks_used"] += 1
+
+        context = "\n\n".join(
+            group["header"] + "\n\n".join(group["parts"])
+            for group in groups.values()
+        )
+        stats["context_tokens"] = self.count(context)
+        if counted_chars:
+            full_tokens += round(uncounted_chars * counted_tokens / counted_chars)
+        stats["full_tokens"] = full_tokens
+        stats["tokens_saved"] = max(0, full_tokens - stats["context_tokens"])
+        return context, stats
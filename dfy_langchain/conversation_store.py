@@ -0,0 +1,229 @@
+"""
+RAG对话历史存储
+
+按会话ID保存对话历史，供多个用户同时使用：
+- 每个会话用固定长度的deque保存最近的消息，超出窗口的旧消息自动丢弃
+- 所有会话的总字符数和会话数有上限，超出时按最近使用顺序淘汰最久未使用的会话
+- 长时间未使用的会话被淘汰
+- 配置了SQLite文件时，被淘汰的会话写入SQLite，再次访问时恢复
+
+环境变量:
+    RAG_HISTORY_MAX_SESSIONS: 内存中最多保留的会话数，默认1000
+    RAG_HISTORY_MAX_CHARS: 内存中所有会话消息的总字符数上限，默认5000000
+    RAG_HISTORY_IDLE_SECONDS: 会话空闲多久后从内存淘汰，默认3600秒
+    RAG_HISTORY_DB: 淘汰会话写入的SQLite文件路径，不设置时淘汰即丢弃
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+# 消息角色
+ROLE_USER = "user"
+ROLE_ASSISTANT = "assistant"
+
+# 默认保留的对话轮数（每轮包含用户和AI两条消息）
+DEFAULT_WINDOW_SIZE = 5
+
+# 会话已在内存中，没有读取SQLite
+_NOT_LOADED = object()
+
+
+class _Session:
+    """一个会话的最近消息"""
+
+    __slots__ = ("messages", "chars", "last_used")
+
+    def __init__(self, max_messages: int, messages: Optional[List[Tuple[str, str]]] = None):
+        self.messages: deque = deque(maxlen=max_messages)
+        self.chars = 0
+        self.last_used = time.monotonic()
+        for role, content in messages or []:
+            self.append(role, content)
+
+    def append(self, role: str, content: str) -> int:
+        """追加消息，返回会话字符数的变化"""
+        before = self.chars
+        if len(self.messages) == self.messages.maxlen:
+            self.chars -= len(self.messages[0][1])
+        self.messages.append((role, content))
+        self.chars += len(content)
+        return self.chars - before
+
+    def resize(self, max_messages: int) -> int:
+        """调整窗口大小，返回会话字符数的变化"""
+        if self.messages.maxlen == max_messages:
+            return 0
+        before = self.chars
+        self.messages = deque(self.messages, maxlen=max_messages)
+        self.chars = sum(len(content) for _, content in self.messages)
+        return self.chars - before
+
+
+class ConversationStore:
+    """按会话保存对话历史（线程安全）"""
+
+    def __init__(
+        self,
+        max_sessions: Optional[int] = None,
+        max_total_chars: Optional[int] = None,
+        idle_seconds: Optional[float] = None,
+        db_path: Optional[str] = None
+    ):
+        self.max_sessions = max_sessions or int(os.getenv("RAG_HISTORY_MAX_SESSIONS", "1000"))
+        self.max_total_chars = max_total_chars or int(os.getenv("RAG_HISTORY_MAX_CHARS", "5000000"))
+        self.idle_seconds = idle_seconds if idle_seconds is not None else float(os.getenv("RAG_HISTORY_IDLE_SECONDS", "3600"))
+        self.db_path = db_path if db_path is not None else os.getenv("RAG_HISTORY_DB")
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._total_chars = 0
+        self._lock = threading.Lock()
+        self.evicted = 0
+        if self.db_path:
+            self._init_db()
+
+    # ---- 对外接口 ----
+
+    def get_messages(self, session_id: str, window_size: int = DEFAULT_WINDOW_SIZE) -> List[Tuple[str, str]]:
+        """获取会话最近的消息，返回(角色, 内容)列表"""
+        while True:
+            loaded = self._load_if_missing(session_id)
+            with self._lock:
+                # 检查之后会话被淘汰了，重新从SQLite读取
+                if loaded is _NOT_LOADED and session_id not in self._sessions:
+                    continue
+                session = self._get_session(session_id, window_size, loaded, create=False)
+                return list(session.messages) if session else []
+
+    def append(self, session_id: str, role: str, content: str, window_size: int = DEFAULT_WINDOW_SIZE):
+        """追加一条消息（超出窗口的旧消息自动丢弃）"""
+        while True:
+            loaded = self._load_if_missing(session_id)
+            with self._lock:
+                if loaded is _NOT_LOADED and session_id not in self._sessions:
+                    continue
+                session = self._get_session(session_id, window_size, loaded, create=True)
+                self._total_chars += session.append(role, content)
+                spilled = self._evict()
+                break
+        self._spill(spilled)
+
+    def clear(self, session_id: str):
+        """清除会话历史"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session:
+                self._total_chars -= session.chars
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM conversation_history WHERE session_id = ?", (session_id,))
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "total_chars": self._total_chars,
+                "evicted": self.evicted,
+            }
+
+    # ---- 内存管理（调用方持有锁） ----
+
+    def _get_session(self, session_id: str, window_size: int, loaded, create: bool) -> Optional[_Session]:
+        """
+        获取内存中的会话，不在内存中时用锁外从SQLite读取的消息loaded创建
+
+        读取期间其他线程可能已经恢复了同一会话，此时使用内存中的会话
+        """
+        max_messages = max(1, window_size * 2)  # *2 因为每轮对话有用户和AI两条消息
+        session = self._sessions.get(session_id)
+        if session is None:
+            messages = None if loaded is _NOT_LOADED else loaded
+            if messages is None and not create:
+                return None
+            session = _Session(max_messages, messages)
+            self._sessions[session_id] = session
+            self._total_chars += session.chars
+        else:
+            self._total_chars += session.resize(max_messages)
+            self._sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    def _evict(self) -> List[Tuple[str, List[Tuple[str, str]]]]:
+        """淘汰空闲超时和超出上限的会话，返回需要写入SQLite的会话"""
+        now = time.monotonic()
+        evicted = []
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            over_limit = len(self._sessions) > self.max_sessions or self._total_chars > self.max_total_chars
+            idle = now - session.last_used >= self.idle_seconds
+            # 至少保留最近使用的会话
+            if not (over_limit or idle) or len(self._sessions) == 1:
+                break
+            self._sessions.popitem(last=False)
+            self._total_chars -= session.chars
+            self.evicted += 1
+            evicted.append((session_id, list(session.messages)))
+        return evicted if self.db_path else []
+
+    # ---- SQLite持久化 ----
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS conversation_history (
+                    session_id TEXT PRIMARY KEY,
+                    messages TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+
+    def _spill(self, sessions: List[Tuple[str, List[Tuple[str, str]]]]):
+        """把淘汰的会话写入SQLite"""
+        if not sessions:
+            return
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO conversation_history (session_id, messages, updated_at) VALUES (?, ?, ?)",
+                    [(session_id, json.dumps(messages, ensure_ascii=False), time.time()) for session_id, messages in sessions]
+                )
+        except Exception as e:
+            print(f"保存对话历史失败: {e}")
+
+    def _load_if_missing(self, session_id: str):
+        """会话不在内存中时从SQLite读取（不持有锁，读取时不阻塞其他会话），在内存中时返回_NOT_LOADED"""
+        with self._lock:
+            if session_id in self._sessions:
+                return _NOT_LOADED
+        return self._load(session_id)
+
+    def _load(self, session_id: str) -> Optional[List[Tuple[str, str]]]:
+        """从SQLite恢复会话"""
+        if not self.db_path:
+            return None
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT messages FROM conversation_history WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if row is None:
+                    return None
+            return [tuple(message) for message in json.loads(row[0])]
+        except Exception as e:
+            print(f"读取对话历史失败: {e}")
+            return None
+
+
+# 全局对话历史存储
+conversation_store = ConversationStore()
@@ -1,25 +1,48 @@
 ## 指定制定列的csv文件 加载器
 
+import codecs
 import csv
-from io import TextIOWrapper
-from typing import Dict, List, Optional
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional
 
 from langchain_core.documents import Document
 from langchain_community.document_loaders import CSVLoader
-from langchain_community.document_loaders.helpers import detect_file_encodings
 
 
 class FilteredCSVLoader(CSVLoader):
+    """
+    读取指定列的CSV加载器
+
+    以生成器方式逐行生成文档，可通过iter_batches按batch_size分批消费，
+    多GB的导出文件也无需一次性读入内存。编码检测只读取文件开头的一段样本。
+    """
+
+    # 编码检测读取的样本大小
+    ENCODING_SAMPLE_SIZE = 1024 * 1024
+    # chardet检测结果中gb18030的子集
+    GB18030_SUBSETS = ("gb2312", "gbk")
+
     def __init__(
         self,
         file_path: str,
-        columns_to_read: List[str],
+        columns_to_read: Optional[List[str]] = None,
         source_column: Optional[str] = None,
         metadata_columns: List[str] = [],
         csv_args: Optional[Dict] = None,
         encoding: Optional[str] = None,
         autodetect_encoding: bool = False,
+        batch_size: int = 1000,
     ):
+        """
+        Args:
+            file_path: CSV文件路径
+            columns_to_read: 需要读取的列名列表，如果为None则读取所有列
+            source_column: 指定作为文档来源的列名，如果为None则使用文件路径
+            metadata_columns: 需要添加到文档元数据的列名列表
+            csv_args: 传递给csv.DictReader的额外参数
+            encoding: 文件编码
+            autodetect_encoding: 指定编码解码失败时是否根据文件开头的样本自动检测编码
+            batch_size: iter_batches每批包含的行数
+        """
         super().__init__(
             file_path=file_path,
             source_column=source_column,
@@ -29,18 +52,22 @@ class FilteredCSVLoader(CSVLoader):
             autodetect_encoding=autodetect_encoding,
         )
         self.columns_to_read = columns_to_read
+        self.batch_size = max(1, batch_size)
 
-    def __read_file(self, csvfile: TextIOWrapper) -> List[Document]:
-        docs = []
+    def _iter_rows(self, csvfile: Iterable[str]) -> Iterator[Document]:
+        """逐行读取CSV并生成文档"""
         csv_reader = csv.DictReader(csvfile, **self.csv_args)  # type: ignore
+        columns = self.columns_to_read
         for i, row in enumerate(csv_reader):
+            if columns is None:
+                columns = list(csv_reader.fieldnames or [])
             content = []
-            for col in self.columns_to_read:
+            for col in columns:
                 if col in row:
                     content.append(f"{col}:{str(row[col])}")
                 else:
                     raise ValueError(
-                        f"Column '{self.columns_to_read[0]}' not found in CSV file."
+                        f"Column '{col}' not found in CSV file."
                     )
             content = "\n".join(content)
             # Extract the source if available
@@ -55,36 +82,100 @@ class FilteredCSVLoader(CSVLoader):
                 if col in row:
                     metadata[col] = row[col]
 
-            doc = Document(page_content=content, metadata=metadata)
-            docs.append(doc)
+            yield Document(page_content=content, metadata=metadata)
 
-        return docs
+    def _detect_encoding(self) -> Optional[str]:
+        """
+        根据文件开头的样本确定编码
 
-    def load_file(self) -> List[Document]:
-        """Load data into document objects."""
-        docs = []
+        依次尝试指定编码、utf-8、chardet检测结果（GB2312/GBK按gb18030处理）和gb18030，
+        使用增量解码器，样本末尾被截断的多字节字符不会误判为解码失败。
+        """
+        if not self.autodetect_encoding:
+            return self.encoding
+
+        with open(self.file_path, "rb") as f:
+            sample = f.read(self.ENCODING_SAMPLE_SIZE)
+
+        candidates = [self.encoding, "utf-8-sig"]
+        try:
+            import chardet
+
+            detected = chardet.detect(sample).get("encoding")
+            # 样本中只出现GB2312/GBK字符时chardet会给出这两种编码，文件后面的生僻字可能超出其范围，
+            # 统一使用兼容它们的gb18030
+            if detected and detected.lower() in self.GB18030_SUBSETS:
+                detected = "gb18030"
+            candidates.append(detected)
+        except ImportError:
+            pass
+        candidates.append("gb18030")
+
+        for encoding in candidates:
+            if not encoding:
+                continue
+            try:
+                codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+                return encoding
+            except (UnicodeDecodeError, LookupError):
+                continue
+
+        raise RuntimeError(f"无法检测文件编码: {self.file_path}")
+
+    def _iter_lines(self, f: BinaryIO, encoding: str) -> Iterator[str]:
+        """
+        逐行解码文件内容
+
+        编码只根据开头的样本确定，样本全是ASCII时会选中utf-8，而后面的行可能是GBK。
+        某一行按检测出的编码解码失败时，从该行起改用gb18030解码文件剩余部分。
+        按换行符切分字节不会截断utf-8和gb18030的多字节字符。
+        """
+        decoder = codecs.getincrementaldecoder(encoding)()
+        for i, line in enumerate(f):
+            try:
+                yield decoder.decode(line)
+            except UnicodeDecodeError:
+                if encoding == "gb18030":
+                    raise
+                print(f"{self.file_path} 第{i + 1}行按 {encoding} 解码失败，剩余部分改用 gb18030")
+                encoding = "gb18030"
+                decoder = codecs.getincrementaldecoder(encoding)()
+                yield decoder.decode(line)
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    def lazy_load(self) -> Iterator[Document]:
+        """逐行生成文档对象"""
+        encoding = self._detect_encoding()
         try:
-            with open(self.file_path, newline="", encoding=self.encoding) as csvfile:
-                docs = self.__read_file(csvfile)
-        except UnicodeDecodeError as e:
             if self.autodetect_encoding:
-                # 刁福元 2025-06-10 10:00:00
-                detected_encodings = detect_file_encodings(self.file_path)
-                for encoding in detected_encodings:
-                    try:
-                        with open(
-                            self.file_path, newline="", encoding=encoding.encoding
-                        ) as csvfile:
-                            docs = self.__read_file(csvfile)
-                            break
-                    except UnicodeDecodeError:
-                        continue
+                with open(self.file_path, "rb") as f:
+                    yield from self._iter_rows(self._iter_lines(f, encoding))
             else:
-                raise RuntimeError(f"Error loading {self.file_path}") from e
+                with open(self.file_path, newline="", encoding=encoding) as csvfile:
+                    yield from self._iter_rows(csvfile)
+        except UnicodeDecodeError as e:
+            raise RuntimeError(
+                f"Error loading {self.file_path}: 编码 {encoding or '默认'} 解码失败"
+            ) from e
         except Exception as e:
             raise RuntimeError(f"Error loading {self.file_path}") from e
 
-        return docs
+    def iter_batches(self) -> Iterator[List[Document]]:
+        """按batch_size分批生成文档对象"""
+        batch = []
+        for doc in self.lazy_load():
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def load_file(self) -> List[Document]:
+        """Load data into document objects."""
+        return list(self.lazy_load())
 
 if __name__ == "__main__":
     loader = FilteredCSVLoader(file_path="test.csv", columns_to_read=["name", "age"])
@@ -1,8 +1,12 @@
 ## 指定制定列的Excel文件加载器
 
 import os
-from typing import Dict, List, Optional, Any, Union
+import pickle
+import tempfile
+from typing import Dict, Iterator, List, Optional, Any, Union
+import numpy as np
 import pandas as pd
+from pandas.io.parsers import TextParser
 
 from langchain_core.documents import Document
 from langchain_community.document_loaders.base import BaseLoader
@@ -12,6 +16,10 @@ class FilteredExcelLoader(BaseLoader):
     """
     用于加载Excel文件并过滤指定列的加载器
     支持.xlsx和.xls格式的Excel文件
+
+    - 默认使用pandas一次性读取，按列向量化拼接每行的"列名:值"文本
+    - streaming=True时使用openpyxl只读模式逐行读取，按batch_size分批生成文档，
+      适用于几十万行的超大工作簿（仅支持.xlsx，.xls会回退到pandas读取）
     """
     
     def __init__(
@@ -22,6 +30,8 @@ class FilteredExcelLoader(BaseLoader):
         metadata_columns: List[str] = [],
         sheet_name: Optional[Union[str, int, List[Union[str, int]]]] = 0,
         excel_kwargs: Optional[Dict] = None,
+        streaming: bool = False,
+        batch_size: int = 5000,
     ):
         """
         初始化Excel文件加载器
@@ -32,7 +42,9 @@ class FilteredExcelLoader(BaseLoader):
             source_column: 指定作为文档来源的列名，如果为None则使用文件路径
             metadata_columns: 需要添加到文档元数据的列名列表
             sheet_name: 要读取的工作表名称或索引，默认为第一个工作表
-            excel_kwargs: 传递给pandas.read_excel的额外参数
+            excel_kwargs: 传递给pandas.read_excel的额外参数（流式模式下不生效）
+            streaming: 是否使用openpyxl只读模式流式读取
+            batch_size: 流式读取时每批包含的行数
         """
         self.file_path = file_path
         self.columns_to_read = columns_to_read
@@ -40,9 +52,17 @@ class FilteredExcelLoader(BaseLoader):
         self.metadata_columns = metadata_columns
         self.sheet_name = sheet_name
         self.excel_kwargs = excel_kwargs or {}
+        self.streaming = streaming
+        self.batch_size = max(1, batch_size)
     
     def load(self) -> List[Document]:
         """加载Excel文件并转换为文档对象"""
+        if self.streaming:
+            return list(self.lazy_load())
+        return self._load_with_pandas()
+
+    def _load_with_pandas(self) -> List[Document]:
+        """使用pandas一次性读取Excel文件"""
         if not os.path.exists(self.file_path):
             raise FileNotFoundError(f"文件不存在: {self.file_path}")
         
@@ -67,11 +87,232 @@ class FilteredExcelLoader(BaseLoader):
             
         except Exception as e:
             raise RuntimeError(f"加载Excel文件 {self.file_path} 时出错: {str(e)}")
+
+    def lazy_load(self) -> Iterator[Document]:
+        """逐个生成文档对象（流式模式下内存占用只与batch_size有关）"""
+        for batch in self.iter_batches():
+            yield from batch
+
+    def iter_batches(self) -> Iterator[List[Document]]:
+        """
+        按批次生成文档对象
+
+        .xlsx文件使用openpyxl只读模式逐行读取，每batch_size行生成一批文档；
+        其他格式回退为pandas一次性读取后按batch_size切分。
+        """
+        if not os.path.exists(self.file_path):
+            raise FileNotFoundError(f"文件不存在: {self.file_path}")
+
+        _, ext = os.path.splitext(self.file_path.lower())
+        if ext not in (".xlsx", ".xlsm"):
+            docs = self._load_with_pandas()
+            for start in range(0, len(docs), self.batch_size):
+                yield docs[start:start + self.batch_size]
+            return
+
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportError("流式读取Excel需要安装openpyxl: pip install openpyxl")
+
+        try:
+            workbook = load_workbook(self.file_path, read_only=True, data_only=True)
+        except Exception as e:
+            raise RuntimeError(f"加载Excel文件 {self.file_path} 时出错: {str(e)}")
+
+        try:
+            sheets = self._resolve_sheets(workbook)
+            # 与pandas读取多个工作表时的行为保持一致：只有多表时才记录sheet_name
+            multi_sheet = self.sheet_name is None or isinstance(self.sheet_name, list)
+            for sheet_name, worksheet in sheets:
+                yield from self._iter_sheet_batches(
+                    worksheet, sheet_name if multi_sheet else None
+                )
+        except Exception as e:
+            raise RuntimeError(f"加载Excel文件 {self.file_path} 时出错: {str(e)}")
+        finally:
+            workbook.close()
+
+    def _resolve_sheets(self, workbook) -> List[tuple]:
+        """根据sheet_name参数解析需要读取的工作表"""
+        if self.sheet_name is None:
+            targets = list(workbook.sheetnames)
+        elif isinstance(self.sheet_name, list):
+            targets = self.sheet_name
+        else:
+            targets = [self.sheet_name]
+
+        sheets = []
+        for target in targets:
+            if isinstance(target, int):
+                name = workbook.sheetnames[target]
+            else:
+                name = target
+            sheets.append((name, workbook[name]))
+        return sheets
+
+    def _iter_sheet_batches(self, worksheet, sheet_name: Optional[str]) -> Iterator[List[Document]]:
+        """
+        逐行读取单个工作表，每batch_size行转换为一批文档
+
+        每批行按pandas读取Excel的规则解析，解析结果暂存到临时文件；读完整个工作表后
+        按整列确定各列的类型，再逐批转换为该类型生成文档。
+        同一单元格的格式与一次性读取（load）一致，不随分批方式变化。
+        """
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+
+        # 与pandas一致：空表头命名为Unnamed: i
+        columns = [
+            str(col) if col is not None else f"Unnamed: {i}"
+            for i, col in enumerate(header)
+        ]
+        width = len(columns)
+        seen_dtypes = [set() for _ in range(width)]
+        missing = [False] * width
+
+        with tempfile.TemporaryFile() as spool:
+            batches = 0
+            for batch in self._iter_row_batches(rows, width):
+                parsed = self._parse_rows(batch, width)
+                for i in range(width):
+                    present = parsed[i].notna()
+                    if present.any():
+                        seen_dtypes[i].add(parsed[i].dtype)
+                    if not present.all():
+                        missing[i] = True
+                pickle.dump((batch, parsed), spool, protocol=pickle.HIGHEST_PROTOCOL)
+                batches += 1
+
+            dtypes = [self._column_dtype(dtypes, has_missing) for dtypes, has_missing in zip(seen_dtypes, missing)]
+            spool.seek(0)
+            row_index = 0
+            for _ in range(batches):
+                batch, parsed = pickle.load(spool)
+                yield self._rows_to_documents(batch, parsed, columns, dtypes, row_index, sheet_name)
+                row_index += len(batch)
+
+    @staticmethod
+    def _convert_cell(value: Any) -> Any:
+        """与pandas读取openpyxl单元格一致：整数值的小数按整数读取"""
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    def _iter_row_batches(self, rows: Iterator[tuple], width: int) -> Iterator[List[tuple]]:
+        """
+        表头之后的数据行，补齐或截断到表头宽度，每batch_size行一批
+
+        与pandas一致：中间的空行保留（全部为None），末尾的空行丢弃
+        """
+        buffer = []
+        pending_blank = 0
+        for row in rows:
+            if row is None or all(value is None for value in row):
+                pending_blank += 1
+                continue
+            buffer.extend([(None,) * width] * pending_blank)
+            pending_blank = 0
+            row = tuple(self._convert_cell(value) for value in row[:width])
+            buffer.append(row + (None,) * (width - len(row)))
+            if len(buffer) >= self.batch_size:
+                yield buffer[:self.batch_size]
+                buffer = buffer[self.batch_size:]
+        if buffer:
+            yield buffer
+
+    @staticmethod
+    def _parse_rows(rows: List[tuple], width: int) -> pd.DataFrame:
+        """按pandas读取Excel的规则解析一批行（空值识别和各列的类型推断），列名为列序号"""
+        data = [["" if value is None else value for value in row] for row in rows]
+        return TextParser(data, header=None, names=list(range(width)), skip_blank_lines=False).read()
+
+    @staticmethod
+    def _column_dtype(dtypes: set, has_missing: bool):
+        """
+        由各批解析出的类型确定整列的类型（与pandas对整列推断的结果一致）
+
+        - 只有数字和布尔: 有小数或空值时为float64，否则有整数时为int64，否则为bool
+        - 所有批的类型相同（日期、文本）: 该类型
+        - 其他: object（保留单元格原值）
+        """
+        if not dtypes:
+            return np.dtype("float64")
+        if all(
+            pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_float_dtype(dtype)
+            for dtype in dtypes
+        ):
+            if has_missing or any(pd.api.types.is_float_dtype(dtype) for dtype in dtypes):
+                return np.dtype("float64")
+            if any(pd.api.types.is_integer_dtype(dtype) for dtype in dtypes):
+                return np.dtype("int64")
+            return np.dtype("bool")
+        if len(dtypes) == 1:
+            return next(iter(dtypes))
+        return np.dtype("object")
+
+    def _rows_to_documents(
+        self,
+        rows: List[tuple],
+        parsed: pd.DataFrame,
+        columns: List[str],
+        dtypes: List[Any],
+        start_index: int,
+        sheet_name: Optional[str],
+    ) -> List[Document]:
+        """将一批行按整列的类型转换为文档（复用向量化的DataFrame处理逻辑）"""
+        index = pd.RangeIndex(start_index, start_index + len(rows))
+        data = {}
+        for i, dtype in enumerate(dtypes):
+            column = parsed[i]
+            if dtype == object:
+                if column.dtype == object or pd.api.types.is_string_dtype(column.dtype):
+                    values = column.astype(object)
+                else:
+                    # 批内被解析为数字或日期的值，在整列为混合类型时应保留单元格原值
+                    values = pd.Series([row[i] for row in rows], dtype=object)
+            elif column.notna().any():
+                values = column.astype(dtype)
+            else:
+                values = pd.Series([None] * len(rows), dtype=dtype)
+            data[i] = values.set_axis(index)
+        df = pd.DataFrame(data, index=index)
+        df.columns = columns
+        return self._process_dataframe(df, sheet_name)
+
+    @staticmethod
+    def _to_row_dtype(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        按行读取时的值类型：各列都是数值（不含布尔）时统一为公共类型
+
+        与逐行iterrows的结果保持一致，例如整数列和小数列同时存在时整数显示为"3.0"，
+        避免文本变化导致已有文档重新向量化。
+        """
+        dtypes = list(df.dtypes)
+        if not dtypes or not all(
+            isinstance(dtype, np.dtype) and dtype.kind in "iuf" for dtype in dtypes
+        ):
+            return df
+        common = np.result_type(*dtypes)
+        if all(dtype == common for dtype in dtypes):
+            return df
+        return df.astype(common)
+
+    @staticmethod
+    def _render_column(series: pd.Series) -> pd.Series:
+        """将一列转换为字符串，空值转换为空字符串"""
+        mask = series.notna()
+        if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            rendered = series.astype(str)
+        else:
+            # 日期等类型的astype(str)格式与str()不一致，逐元素转换保持原有格式
+            rendered = series.map(str)
+        return rendered.where(mask, "")
     
     def _process_dataframe(self, df: pd.DataFrame, sheet_name: Optional[str] = None) -> List[Document]:
-        """处理DataFrame并转换为Document对象列表"""
-        docs = []
-        
+        """处理DataFrame并转换为Document对象列表（按列向量化拼接文本）"""
         # 如果未指定columns_to_read，则使用DataFrame的所有列
         columns_to_process = self.columns_to_read if self.columns_to_read is not None else df.columns.tolist()
         
@@ -79,42 +320,49 @@ class FilteredExcelLoader(BaseLoader):
         missing_cols = [col for col in columns_to_process if col not in df.columns]
         if missing_cols:
             raise ValueError(f"Excel文件中缺少以下列: {', '.join(missing_cols)}")
+
+        if df.empty:
+            return []
+        df = self._to_row_dtype(df)
         
-        # 处理每一行,刁福元 2025-06-10 10:00:00
-        for i, row in df.iterrows():
-            content = []
-            
-            # 提取指定列的内容
-            for col in columns_to_process:
-                value = row[col]
-                # 处理NaN值
-                if pd.notna(value):
-                    content.append(f"{col}:{str(value)}")
-                else:
-                    content.append(f"{col}:")
-            
-            content = "\n".join(content)
-            
-            # 提取源信息
-            source = (
-                row.get(self.source_column) 
-                if self.source_column is not None and self.source_column in row
-                else self.file_path
-            )
-            
+        # 按列拼接"列名:值"，再用换行连接各列，避免逐行iterrows
+        if columns_to_process:
+            parts = [f"{col}:" + self._render_column(df[col]) for col in columns_to_process]
+            contents = parts[0].str.cat(parts[1:], sep="\n") if len(parts) > 1 else parts[0]
+            contents = contents.tolist()
+        else:
+            contents = [""] * len(df)
+        
+        # 提取源信息
+        if self.source_column is not None and self.source_column in df.columns:
+            sources = df[self.source_column].tolist()
+        else:
+            sources = [self.file_path] * len(df)
+
+        # 需要添加到元数据的列
+        metadata_values = {}
+        for col in self.metadata_columns:
+            if col in df.columns:
+                rendered = self._render_column(df[col]).tolist()
+                mask = df[col].notna().tolist()
+                metadata_values[col] = [
+                    value if present else None for value, present in zip(rendered, mask)
+                ]
+
+        docs = []
+        for position, (index, content, source) in enumerate(zip(df.index, contents, sources)):
             # 创建元数据
-            metadata = {"source": source, "row": i}
+            metadata = {"source": source, "row": index}
             if sheet_name:
                 metadata["sheet_name"] = sheet_name
                 
             # 添加指定的元数据列
-            for col in self.metadata_columns:
-                if col in row and pd.notna(row[col]):
-                    metadata[col] = str(row[col])
+            for col, values in metadata_values.items():
+                if values[position] is not None:
+                    metadata[col] = values[position]
             
             # 创建文档对象
-            doc = Document(page_content=content, metadata=metadata)
-            docs.append(doc)
+            docs.append(Document(page_content=content, metadata=metadata))
         
         return docs
 
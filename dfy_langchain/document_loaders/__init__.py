@@ -5,6 +5,7 @@ from .FilteredCSVloader import FilteredCSVLoader
 from .FilteredExcelLoader import FilteredExcelLoader
 from .unstrcutured_loader import UnstructuredLoader
 from .ocr import get_ocr
+from .ocr_cache import OCRResultCache, get_ocr_cache
 
 __all__ = [
     "RapidOCRDocLoader",
@@ -13,5 +14,7 @@ __all__ = [
     "FilteredCSVLoader",
     "FilteredExcelLoader",
     "UnstructuredLoader",
-    "get_ocr"
+    "get_ocr",
+    "OCRResultCache",
+    "get_ocr_cache"
 ]
\ No newline at end of file
@@ -6,6 +6,8 @@ from PIL import Image
 import numpy as np
 from io import BytesIO
 
+from .ocr_cache import get_ocr_cache, ocr_result_to_text
+
 
 class RapidOCRDocLoader(UnstructuredFileLoader):
     """
@@ -41,7 +43,8 @@ class RapidOCRDocLoader(UnstructuredFileLoader):
         from docx.text.paragraph import Paragraph
         from rapidocr_onnxruntime import RapidOCR
 
-        ocr = RapidOCR()
+        ocr = None  # 全部命中缓存时无需初始化OCR引擎
+        ocr_cache = get_ocr_cache()
         doc = Document(filepath)
         resp = ""
 
@@ -77,11 +80,19 @@ class RapidOCRDocLoader(UnstructuredFileLoader):
                             img_id
                         ]  # 根据图片id获取对应的图片
                         if isinstance(part, ImagePart):
-                            image = Image.open(BytesIO(part._blob))
-                            result, _ = ocr(np.array(image))
-                            if result:
-                                ocr_result = [line[1] for line in result]
-                                resp += "\n".join(ocr_result)
+                            blob = part._blob
+
+                            def recognize():
+                                nonlocal ocr
+                                if ocr is None:
+                                    ocr = RapidOCR()
+                                image = Image.open(BytesIO(blob))
+                                result, _ = ocr(np.array(image))
+                                return ocr_result_to_text(result)
+
+                            resp += ocr_cache.get_or_compute(
+                                ocr_cache.make_key(blob), recognize
+                            )
             elif isinstance(block, Table):
                 for row in block.rows:
                     for cell in row.cells:
@@ -3,18 +3,22 @@ from typing import List
 from langchain_community.document_loaders.unstructured import UnstructuredFileLoader
 
 from .ocr import get_ocr
+from .ocr_cache import get_ocr_cache, ocr_result_to_text
 
 
 class RapidOCRLoader(UnstructuredFileLoader):
     def _get_elements(self) -> List:
         def img2text(filepath):
-            resp = ""
-            ocr = get_ocr()
-            result, _ = ocr(filepath)
-            if result:
-                ocr_result = [line[1] for line in result]
-                resp += "\n".join(ocr_result)
-            return resp
+            ocr_cache = get_ocr_cache()
+            with open(filepath, "rb") as f:
+                cache_key = ocr_cache.make_key(f.read())
+
+            def recognize():
+                ocr = get_ocr()
+                result, _ = ocr(filepath)
+                return ocr_result_to_text(result)
+
+            return ocr_cache.get_or_compute(cache_key, recognize)
 
         text = img2text(self.file_path)
         from unstructured.partition.text import partition_text
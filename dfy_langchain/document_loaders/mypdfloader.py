@@ -11,6 +11,7 @@ from PIL import Image
 # from dfy_langchain.document_loaders.ocr import get_ocr
 
 from .ocr import get_ocr
+from .ocr_cache import get_ocr_cache, ocr_result_to_text
 
 # Define settings class locally if needed
 class PDFSettings:
@@ -50,7 +51,8 @@ class RapidOCRPDFLoader(UnstructuredFileLoader):
             import fitz  # pyMuPDF里面的fitz包，不要与pip install fitz混淆
             import numpy as np
 
-            ocr = get_ocr()
+            ocr = None  # 全部命中缓存时无需初始化OCR引擎
+            ocr_cache = get_ocr_cache()
             doc = fitz.open(filepath)
             resp = ""
 
@@ -76,25 +78,34 @@ class RapidOCRPDFLoader(UnstructuredFileLoader):
                             page.rect.height
                         ) < Settings.PDF_OCR_THRESHOLD[1]:
                             continue
+                        # 以解码后的像素（及尺寸、通道数、页面旋转角度）作为缓存键：原始数据流相同时，
+                        # 图片字典中的尺寸、颜色空间、Decode等参数不同也会解码出不同的图片
                         pix = fitz.Pixmap(doc, xref)
-                        samples = pix.samples
-                        if int(page.rotation) != 0:  # 如果Page有旋转角度，则旋转图片
-                            img_array = np.frombuffer(
-                                pix.samples, dtype=np.uint8
-                            ).reshape(pix.height, pix.width, -1)
-                            tmp_img = Image.fromarray(img_array)
-                            ori_img = cv2.cvtColor(np.array(tmp_img), cv2.COLOR_RGB2BGR)
-                            rot_img = rotate_img(img=ori_img, angle=360 - page.rotation)
-                            img_array = cv2.cvtColor(rot_img, cv2.COLOR_RGB2BGR)
-                        else:
-                            img_array = np.frombuffer(
-                                pix.samples, dtype=np.uint8
-                            ).reshape(pix.height, pix.width, -1)
-
-                        result, _ = ocr(img_array)
-                        if result:
-                            ocr_result = [line[1] for line in result]
-                            resp += "\n".join(ocr_result)
+                        cache_key = ocr_cache.make_key(
+                            pix.samples, pix.width, pix.height, pix.n, int(page.rotation)
+                        )
+
+                        def recognize():
+                            nonlocal ocr
+                            if ocr is None:
+                                ocr = get_ocr()
+                            if int(page.rotation) != 0:  # 如果Page有旋转角度，则旋转图片
+                                img_array = np.frombuffer(
+                                    pix.samples, dtype=np.uint8
+                                ).reshape(pix.height, pix.width, -1)
+                                tmp_img = Image.fromarray(img_array)
+                                ori_img = cv2.cvtColor(np.array(tmp_img), cv2.COLOR_RGB2BGR)
+                                rot_img = rotate_img(img=ori_img, angle=360 - page.rotation)
+                                img_array = cv2.cvtColor(rot_img, cv2.COLOR_RGB2BGR)
+                            else:
+                                img_array = np.frombuffer(
+                                    pix.samples, dtype=np.uint8
+                                ).reshape(pix.height, pix.width, -1)
+
+                            result, _ = ocr(img_array)
+                            return ocr_result_to_text(result)
+
+                        resp += ocr_cache.get_or_compute(cache_key, recognize)
 
                 # 更新进度
                 b_unit.update(1)
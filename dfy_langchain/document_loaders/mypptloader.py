@@ -3,6 +3,8 @@ from typing import List
 import tqdm
 from langchain_community.document_loaders.unstructured import UnstructuredFileLoader
 
+from .ocr_cache import get_ocr_cache, ocr_result_to_text
+
 
 class RapidOCRPPTLoader(UnstructuredFileLoader):
     def _get_elements(self) -> List:
@@ -14,12 +16,13 @@ class RapidOCRPPTLoader(UnstructuredFileLoader):
             from pptx import Presentation
             from rapidocr_onnxruntime import RapidOCR
 
-            ocr = RapidOCR()
+            ocr = None  # 全部命中缓存时无需初始化OCR引擎
+            ocr_cache = get_ocr_cache()
             prs = Presentation(filepath)
             resp = ""
 
             def extract_text(shape):
-                nonlocal resp
+                nonlocal resp, ocr
                 if shape.has_text_frame:
                     resp += shape.text.strip() + "\n"
                 if shape.has_table:
@@ -28,11 +31,17 @@ class RapidOCRPPTLoader(UnstructuredFileLoader):
                             for paragraph in cell.text_frame.paragraphs:
                                 resp += paragraph.text.strip() + "\n"
                 if shape.shape_type == 13:  # 13 表示图片
-                    image = Image.open(BytesIO(shape.image.blob))
-                    result, _ = ocr(np.array(image))
-                    if result:
-                        ocr_result = [line[1] for line in result]
-                        resp += "\n".join(ocr_result)
+                    blob = shape.image.blob
+
+                    def recognize():
+                        nonlocal ocr
+                        if ocr is None:
+                            ocr = RapidOCR()
+                        image = Image.open(BytesIO(blob))
+                        result, _ = ocr(np.array(image))
+                        return ocr_result_to_text(result)
+
+                    resp += ocr_cache.get_or_compute(ocr_cache.make_key(blob), recognize)
                 elif shape.shape_type == 6:  # 6 表示组合
                     for child_shape in shape.shapes:
                         extract_text(child_shape)
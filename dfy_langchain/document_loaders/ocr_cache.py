@@ -0,0 +1,151 @@
+## OCR识别结果缓存
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+# 默认缓存目录：项目根目录/data/ocr_cache
+DEFAULT_OCR_CACHE_DIR = Path(__file__).resolve().parent.parent.parent / "data" / "ocr_cache"
+
+
+class OCRResultCache:
+    """
+    按图片内容哈希缓存OCR识别结果
+
+    同一张图片（重复上传/重新向量化的文档、每页重复出现的logo和印章）只需识别一次，
+    之后只需计算一次哈希并查找缓存。
+
+    缓存分两级:
+    - 内存LRU：同一进程内重复出现的图片直接命中
+    - 磁盘：按哈希前两位分目录保存为JSON文件，进程重启后依然有效
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Union[str, Path]] = None,
+        max_memory_items: int = 2048,
+        enabled: Optional[bool] = None,
+    ):
+        """
+        Args:
+            cache_dir: 磁盘缓存目录，默认读取OCR_CACHE_DIR环境变量，否则为data/ocr_cache
+            max_memory_items: 内存缓存的最大条目数
+            enabled: 是否启用缓存，默认读取OCR_CACHE_ENABLED环境变量（默认启用）
+        """
+        self.cache_dir = Path(cache_dir or os.getenv("OCR_CACHE_DIR") or DEFAULT_OCR_CACHE_DIR)
+        self.max_memory_items = max_memory_items
+        if enabled is None:
+            enabled = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+        self.enabled = enabled
+
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(data: bytes, *extra) -> str:
+        """根据图片字节（以及旋转角度等影响识别结果的参数）计算缓存键"""
+        digest = hashlib.md5(data)
+        for item in extra:
+            digest.update(f"|{item}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _remember(self, key: str, text: str) -> None:
+        with self._lock:
+            self._memory[key] = text
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """查找缓存，未命中返回None"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        path = self._path_for(key)
+        if path.exists():
+            try:
+                with path.open("r", encoding="utf-8") as f:
+                    text = json.load(f)["text"]
+                self._remember(key, text)
+                with self._lock:
+                    self.hits += 1
+                return text
+            except Exception as e:
+                print(f"读取OCR缓存失败 {path}: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, text: str) -> None:
+        """写入缓存（磁盘写入采用临时文件+替换，保证原子性）"""
+        if not self.enabled:
+            return
+
+        self._remember(key, text)
+        path = self._path_for(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump({"text": text}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"写入OCR缓存失败 {path}: {e}")
+
+    def get_or_compute(self, key: str, compute: Callable[[], str]) -> str:
+        """命中则直接返回缓存结果，否则调用compute识别并写入缓存"""
+        text = self.get(key)
+        if text is not None:
+            return text
+        text = compute()
+        self.set(key, text)
+        return text
+
+    def get_stats(self) -> dict:
+        """获取缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "cache_dir": str(self.cache_dir),
+            "memory_items": len(self._memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def ocr_result_to_text(result) -> str:
+    """将RapidOCR的识别结果转换为文本"""
+    if not result:
+        return ""
+    return "\n".join(line[1] for line in result)
+
+
+_ocr_cache: Optional[OCRResultCache] = None
+_ocr_cache_lock = threading.Lock()
+
+
+def get_ocr_cache() -> OCRResultCache:
+    """获取全局OCR缓存实例"""
+    global _ocr_cache
+    if _ocr_cache is None:
+        with _ocr_cache_lock:
+            if _ocr_cache is None:
+                _ocr_cache = OCRResultCache()
+    return _ocr_cache
@@ -110,7 +110,7 @@ class UnstructuredLoader:
                 docs = loader.load()
                 self.docs_by_type['ppt'].extend(docs)
             elif file_type == 'csv':
-                loader = FilteredCSVLoader(file_path)
+                loader = FilteredCSVLoader(file_path, autodetect_encoding=True)
                 docs = loader.load()
                 self.docs_by_type['csv'].extend(docs)
             elif file_type == 'excel':
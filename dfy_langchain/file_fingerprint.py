@@ -0,0 +1,59 @@
+"""
+文件变更检测
+
+file_info.json中每个文件除了内容哈希外还记录大小和修改时间。重新扫描时先比较大小和修改时间，
+两者都未变化就直接视为未变更，不读取文件内容；只有变化时才分块计算哈希。
+这样重新扫描一个很大的知识库目录只需要对每个文件做一次stat。
+"""
+import hashlib
+import os
+from typing import Dict, Tuple
+
+# 计算哈希时每次读取的字节数
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# 变更检测结果
+FILE_UNCHANGED = "unchanged"   # 大小和修改时间都未变，未读取文件
+FILE_TOUCHED = "touched"       # 修改时间变了但内容未变，记录中的大小和修改时间已更新
+FILE_CHANGED = "changed"       # 新文件或内容已变化
+
+
+def compute_file_hash(file_path: str, block_size: int = HASH_BLOCK_SIZE) -> str:
+    """分块计算文件的MD5哈希值，不把整个文件读入内存"""
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def get_file_signature(file_path: str) -> Dict[str, int]:
+    """文件的大小和修改时间（纳秒）"""
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def check_file_change(file_path: str, file_info: Dict) -> Tuple[str, Dict[str, int], str]:
+    """
+    判断文件自上次向量化后是否变化
+
+    Args:
+        file_path: 文件路径（file_info中的键）
+        file_info: file_info.json的内容；文件只是被touch过时会原地更新对应记录
+
+    Returns:
+        (文件哈希, 文件大小和修改时间, 检测结果)
+        文件大小和修改时间在计算哈希之前获取，写入file_info时应使用这一份，
+        避免处理过程中文件又被修改却被记录为已处理
+    """
+    signature = get_file_signature(file_path)
+    record = file_info.get(file_path)
+
+    if record and record.get("hash") and all(record.get(key) == value for key, value in signature.items()):
+        return record["hash"], signature, FILE_UNCHANGED
+
+    file_hash = compute_file_hash(file_path)
+    if record and record.get("hash") == file_hash:
+        record.update(signature)
+        return file_hash, signature, FILE_TOUCHED
+    return file_hash, signature, FILE_CHANGED
@@ -0,0 +1,457 @@
+"""
+批量导入文档到知识库
+
+并行解析目录树中的文件（进程池），在主进程中向量化并写入知识库的向量库；
+每处理完一批文件保存一次检查点（向量库、文档向量清单、去重记录、file_info和文档元数据），
+中途崩溃或中断后重新运行同一命令会跳过已保存的文件，从中断处继续。
+
+用法:
+    python -m dfy_langchain.ingest 知识库名称 /path/to/docs
+    python -m dfy_langchain.ingest 知识库名称 /path/to/docs --parse-workers 8 --embed-workers 4 --checkpoint-every 20
+
+需在项目根目录运行（与Web服务使用相同的data/knowledge_base相对路径）。
+导入期间不要通过Web界面修改同一个知识库的文档。
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from .file_fingerprint import FILE_CHANGED, check_file_change
+from .vector_manifest import VectorManifest, load_vectorstore, save_vectorstore, vector_store_lock
+
+# 与上传接口一致的文件类型
+SUPPORTED_EXTENSIONS = {".pdf", ".doc", ".docx", ".jpg", ".jpeg", ".png", ".pptx", ".csv", ".xlsx", ".txt"}
+
+
+def parse_file(file_path: str) -> Tuple[str, Optional[str], list, float, Optional[str]]:
+    """
+    加载并分块单个文件（在解析进程中运行）
+
+    Returns:
+        (file_path, file_type, chunks, 耗时秒数, 错误信息)
+    """
+    from .document_loaders.unstrcutured_loader import UnstructuredLoader
+    from .rag_pipeline import create_text_splitter
+
+    started = time.time()
+    try:
+        docs, file_type = UnstructuredLoader(file_path).load_file()
+        if not docs:
+            return file_path, file_type, [], time.time() - started, "未能从文件中加载内容"
+        chunks = create_text_splitter(file_type).split_documents(docs)
+        return file_path, file_type, chunks, time.time() - started, None
+    except Exception as e:
+        return file_path, None, [], time.time() - started, str(e)
+
+
+class ParallelEmbeddings(Embeddings):
+    """把embed_documents拆成多个子批并发调用底层模型（适合远程embedding API）"""
+
+    def __init__(self, embeddings: Embeddings, workers: int, batch_size: int = 64):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if len(texts) <= self.batch_size:
+            return self.embeddings.embed_documents(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = self.executor.map(self.embeddings.embed_documents, batches)
+        return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+def discover_files(root: Path) -> List[Path]:
+    """递归查找支持的文件（跳过隐藏目录和文档元数据文件）"""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for filename in sorted(filenames):
+            if filename.startswith("documents_metadata") or filename.startswith("."):
+                continue
+            if Path(filename).suffix.lower() in SUPPORTED_EXTENSIONS:
+                files.append(Path(dirpath) / filename)
+    return files
+
+
+def resolve_embedding_config(kb_name: str) -> Optional[dict]:
+    """读取知识库配置的embedding模型，未配置或读取失败时返回None（使用本地模型）"""
+    try:
+        from app.services.knowledge_base_service import KnowledgeBaseService
+        from app.services.model_config_service import ModelConfigService
+        from app.database import get_db
+
+        kb_config = next((kb for kb in KnowledgeBaseService().load_knowledge_bases() if kb.get("name") == kb_name), None)
+        embedding_model_id = kb_config.get("embedding_model_id") if kb_config else None
+        if not embedding_model_id:
+            print(f"知识库 '{kb_name}' 未配置embedding模型，使用本地模型")
+            return None
+
+        db = next(get_db())
+        try:
+            model_config = ModelConfigService.get_model_config_by_id(db, embedding_model_id)
+        finally:
+            db.close()
+        if not model_config:
+            print(f"未找到embedding模型配置 (ID: {embedding_model_id})，使用本地模型")
+            return None
+        print(f"使用知识库配置的embedding模型: {model_config.model_name} (provider: {model_config.provider})")
+        return {
+            "id": model_config.id,
+            "provider": model_config.provider,
+            "model_name": model_config.model_name,
+            "api_key": model_config.api_key,
+            "endpoint": model_config.endpoint,
+            "model_type": model_config.model_type,
+        }
+    except Exception as e:
+        print(f"获取embedding配置失败: {e}，使用本地模型")
+        return None
+
+
+class BulkIngestor:
+    """批量导入一个目录树到知识库"""
+
+    def __init__(
+        self,
+        kb_name: str,
+        source_dir: str,
+        parse_workers: int = 4,
+        embed_workers: int = 1,
+        checkpoint_every: int = 10,
+        checkpoint_interval: float = 60.0,
+        force: bool = False,
+    ):
+        from app.services.document_metadata_store import get_document_store
+        from app.services.document_upload_service import DocumentUploadService
+
+        self.kb_name = kb_name
+        self.source_dir = Path(source_dir)
+        self.parse_workers = max(1, parse_workers)
+        self.embed_workers = max(1, embed_workers)
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.checkpoint_interval = checkpoint_interval
+        self.force = force
+
+        self.upload_service = DocumentUploadService()
+        self.paths = self.upload_service._get_kb_paths(kb_name)
+        self.upload_service._ensure_directories(self.paths)
+        self.store = get_document_store(self.paths["kb_dir"])
+        self.vector_store_path = str(self.paths["vector_store_dir"])
+
+        self.stats = {
+            "files": 0,
+            "skipped": 0,
+            "failed": 0,
+            "chunks": 0,
+            "embeddings": 0,
+            "reused_chunks": 0,
+            "parse_seconds": 0.0,
+            "checkpoints": 0,
+            # 解析进程池异常退出（如解析进程被OOM杀死）时的错误信息
+            "interrupted": None,
+        }
+        self._next_doc_number = int(time.time() * 1000)
+
+    def _new_doc_id(self) -> str:
+        # 与上传接口相同的doc_{毫秒时间戳}格式，批量生成时递增避免冲突
+        self._next_doc_number = max(self._next_doc_number + 1, int(time.time() * 1000))
+        return f"doc_{self._next_doc_number}"
+
+    def _target_path(self, source: Path) -> Tuple[Path, str]:
+        """
+        文件在知识库content目录中的路径和文档名（保留相对目录）
+
+        源目录就在content目录下时原地导入，否则复制到content目录
+        """
+        content_dir = self.paths["content_dir"].resolve()
+        resolved = source.resolve()
+        if content_dir in resolved.parents:
+            relative = resolved.relative_to(content_dir)
+        else:
+            relative = resolved.relative_to(self.source_dir.resolve())
+        return self.paths["content_dir"] / relative, relative.as_posix()
+
+    def _prepare(self, source: Path, file_info: Dict, manifest: VectorManifest) -> Optional[Dict]:
+        """复制文件并登记文档元数据；文件已导入且未变化时返回None"""
+        target, filename = self._target_path(source)
+        if source.resolve() != target.resolve():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if not target.exists() or target.stat().st_size != source.stat().st_size or target.stat().st_mtime != source.stat().st_mtime:
+                shutil.copy2(source, target)
+
+        file_path = str(target)
+        file_hash, file_signature, change = check_file_change(file_path, file_info)
+        existing = self.store.find_by_filename(filename)
+        doc_id = existing[0] if existing else self._new_doc_id()
+
+        if (
+            not self.force
+            and change != FILE_CHANGED
+            and manifest.get_document(doc_id)
+        ):
+            if existing and existing[1].get("vector_status") != "completed":
+                self.store.update_fields(doc_id, {"vector_status": "completed", "has_vector": True})
+            return None
+
+        file_size = target.stat().st_size
+        file_ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else "unknown"
+        metadata = dict(existing[1]) if existing else {
+            "filename": filename,
+            "upload_time": datetime.now().isoformat(),
+            "problem_status": "正常",
+        }
+        metadata.update({
+            "file_size": file_size,
+            "size_str": self.upload_service._format_file_size(file_size),
+            "file_type": file_ext,
+            "file_type_text": self.upload_service._get_file_type_text(file_ext),
+            "has_vector": False,
+            "vector_status": "waiting",
+            "file_hash": file_hash,
+        })
+        metadata.pop("error_message", None)
+        self.store.upsert(doc_id, metadata)
+        return {
+            "doc_id": doc_id,
+            "file_path": file_path,
+            "filename": filename,
+            "file_hash": file_hash,
+            "file_signature": file_signature,
+        }
+
+    def _save_checkpoint(self, pipeline, vectorstore, manifest: VectorManifest, file_info: Dict, pending: List[Dict]):
+        """保存向量库和所有记录，之后把本批文档标记为已完成"""
+        if not pending:
+            return
+        if vectorstore is not None:
+            index = vectorstore.index
+            if "Gpu" in type(index).__name__:
+                import faiss
+                vectorstore.index = faiss.index_gpu_to_cpu(index)
+                try:
+                    save_vectorstore(vectorstore, self.vector_store_path)
+                finally:
+                    vectorstore.index = index
+            else:
+                save_vectorstore(vectorstore, self.vector_store_path)
+        pipeline.deduplicator.save()
+        manifest.save()
+        pipeline._save_file_info(file_info)
+
+        for item in pending:
+            fields = {
+                "vector_status": "completed",
+                "has_vector": True,
+                "vector_time": datetime.now().isoformat(),
+            }
+            if item.get("delta_stats"):
+                fields["delta_stats"] = item["delta_stats"]
+            self.store.update_fields(item["doc_id"], fields, ["error_message"])
+        self.stats["checkpoints"] += 1
+        print(f"检查点已保存: {len(pending)} 个文件 (累计 {self.stats['files']} 个)")
+        pending.clear()
+
+    def _mark_failed(self, item: Dict, error: str):
+        self.stats["failed"] += 1
+        self.store.update_fields(item["doc_id"], {"vector_status": "error", "has_vector": False, "error_message": error})
+        print(f"处理失败: {item['filename']} ({error})")
+
+    def _abort(self, item: Dict, error: Exception):
+        """
+        写入向量库时出错：内存中的向量库可能只写入了该文档的一部分，不能再保存，
+        直接结束本次导入；上一个检查点之后的文件在下次运行时重新处理
+        """
+        self._mark_failed(item, str(error))
+        raise RuntimeError(f"写入向量库失败，导入已中止，重新运行将从上一个检查点继续: {error}") from error
+
+    def run(self) -> Dict:
+        from .rag_pipeline import RAGPipeline, create_text_splitter
+
+        started = time.time()
+        sources = discover_files(self.source_dir)
+        print(f"发现 {len(sources)} 个待导入文件: {self.source_dir}")
+
+        embedding_config = resolve_embedding_config(self.kb_name)
+        pipeline = RAGPipeline(
+            file_path=str(self.paths["content_dir"]),
+            vector_store_path=self.vector_store_path,
+            embedding_config=embedding_config,
+            use_local_embedding=embedding_config is None,
+        )
+        if self.embed_workers > 1:
+            pipeline.embeddings = ParallelEmbeddings(pipeline.embeddings, self.embed_workers)
+
+        with vector_store_lock(self.vector_store_path):
+            vectorstore = load_vectorstore(self.vector_store_path, pipeline.embeddings)
+            manifest = VectorManifest(self.vector_store_path)
+            file_info = pipeline._load_file_info()
+            pending: List[Dict] = []
+            last_checkpoint = time.time()
+
+            def index_document(item: Dict, file_type: str, chunk_batches):
+                nonlocal vectorstore
+                vectorstore, progress = pipeline.add_document_chunks(
+                    vectorstore, manifest, file_info, item["doc_id"], item["file_path"], chunk_batches
+                )
+                file_info[item["file_path"]] = {
+                    "hash": item["file_hash"],
+                    **item["file_signature"],
+                    "last_updated": datetime.now().isoformat(),
+                    "file_type": file_type,
+                }
+                item["delta_stats"] = pipeline.last_delta_stats
+                self.stats["files"] += 1
+                self.stats["chunks"] += progress["chunks"]
+                self.stats["embeddings"] += progress["embedded"]
+                self.stats["reused_chunks"] += progress["reused"]
+                pending.append(item)
+                print(f"[{self.stats['files'] + self.stats['failed']}/{total}] {item['filename']}: "
+                      f"{progress['chunks']} 个块, 新向量化 {progress['embedded']} 个")
+
+            def maybe_checkpoint(final: bool = False):
+                nonlocal last_checkpoint
+                if final or len(pending) >= self.checkpoint_every or time.time() - last_checkpoint >= self.checkpoint_interval:
+                    self._save_checkpoint(pipeline, vectorstore, manifest, file_info, pending)
+                    last_checkpoint = time.time()
+
+            items = []
+            for source in sources:
+                try:
+                    item = self._prepare(source, file_info, manifest)
+                except Exception as e:
+                    print(f"准备文件失败: {source} ({e})")
+                    self.stats["failed"] += 1
+                    continue
+                if item is None:
+                    self.stats["skipped"] += 1
+                else:
+                    items.append(item)
+            total = len(items)
+            if self.stats["skipped"]:
+                print(f"跳过 {self.stats['skipped']} 个已导入且未变化的文件")
+
+            # 超大表格文件在主进程中流式分批处理，其余文件交给解析进程池
+            parse_items = []
+            for item in items:
+                streaming = pipeline._get_streaming_loader(item["file_path"])
+                if not streaming:
+                    parse_items.append(item)
+                    continue
+                loader, file_type = streaming
+                splitter = create_text_splitter(file_type)
+                try:
+                    index_document(item, file_type, (splitter.split_documents(batch) for batch in loader.iter_batches()))
+                except Exception as e:
+                    self._abort(item, e)
+                maybe_checkpoint()
+
+            by_path = {item["file_path"]: item for item in parse_items}
+            queue = list(parse_items)
+            # 主进程已初始化embedding模型（可能占用CUDA），解析进程使用spawn启动
+            mp_context = multiprocessing.get_context("spawn")
+            try:
+                with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=mp_context) as executor:
+                    running = set()
+                    while queue or running:
+                        # 限制同时在途的解析结果数量，避免分块在内存中堆积
+                        while queue and len(running) < self.parse_workers * 2:
+                            running.add(executor.submit(parse_file, queue.pop(0)["file_path"]))
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            file_path, file_type, chunks, parse_seconds, error = future.result()
+                            item = by_path.pop(file_path)
+                            self.stats["parse_seconds"] += parse_seconds
+                            if error:
+                                self._mark_failed(item, error)
+                                continue
+                            try:
+                                index_document(item, file_type, [chunks])
+                            except Exception as e:
+                                self._abort(item, e)
+                            maybe_checkpoint()
+            except BrokenProcessPool as e:
+                # 解析进程异常退出后进程池不可再用。已写入的文档不受影响，先保存检查点，
+                # 未处理完的文件标记为失败，重新运行时从检查点继续
+                self.stats["interrupted"] = str(e) or type(e).__name__
+                print(f"解析进程异常退出，停止导入: {self.stats['interrupted']}")
+                maybe_checkpoint(final=True)
+                for item in by_path.values():
+                    self._mark_failed(item, f"解析进程异常退出: {self.stats['interrupted']}")
+
+            maybe_checkpoint(final=True)
+
+        self.stats["elapsed_seconds"] = time.time() - started
+        return self.stats
+
+
+def print_summary(stats: Dict):
+    elapsed = max(stats["elapsed_seconds"], 1e-9)
+    print("=" * 60)
+    print(f"导入完成，用时 {elapsed:.1f} 秒")
+    print(f"  文件: 成功 {stats['files']}, 跳过 {stats['skipped']}, 失败 {stats['failed']}")
+    print(f"  分块: {stats['chunks']} (复用已有向量 {stats['reused_chunks']})")
+    print(f"  新向量: {stats['embeddings']}")
+    print(f"  吞吐: {stats['files'] / elapsed:.2f} 文件/秒, "
+          f"{stats['chunks'] / elapsed:.1f} 块/秒, {stats['embeddings'] / elapsed:.1f} 向量/秒")
+    print(f"  解析累计耗时: {stats['parse_seconds']:.1f} 秒, 检查点: {stats['checkpoints']} 次")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入目录中的文档到知识库（可中断续传）")
+    parser.add_argument("kb_name", help="知识库名称")
+    parser.add_argument("source_dir", help="要导入的目录（递归查找支持的文件）")
+    parser.add_argument("--parse-workers", type=int, default=min(4, os.cpu_count() or 1), help="解析进程数")
+    parser.add_argument("--embed-workers", type=int, default=1,
+                        help="并发向量化线程数（远程embedding API可调大，本地模型保持1）")
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="每处理多少个文件保存一次检查点")
+    parser.add_argument("--checkpoint-interval", type=float, default=60.0, help="两次检查点的最长间隔（秒）")
+    parser.add_argument("--force", action="store_true", help="忽略检查点，重新向量化所有文件")
+    parser.add_argument("--hierarchical", action="store_true", help="导入完成后重建分层索引")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source_dir):
+        raise SystemExit(f"目录不存在: {args.source_dir}")
+
+    ingestor = BulkIngestor(
+        args.kb_name,
+        args.source_dir,
+        parse_workers=args.parse_workers,
+        embed_workers=args.embed_workers,
+        checkpoint_every=args.checkpoint_every,
+        checkpoint_interval=args.checkpoint_interval,
+        force=args.force,
+    )
+    stats = ingestor.run()
+    print_summary(stats)
+
+    if stats["interrupted"]:
+        raise SystemExit(
+            f"解析进程异常退出（{stats['interrupted']}），已处理的文件已保存到检查点。"
+            f"重新运行同一命令即可继续导入剩余文件；若反复出现，可减小 --parse-workers 或排查导致崩溃的文件"
+        )
+
+    if args.hierarchical and stats["files"]:
+        from .retrievers.services.auto_hierarchical_rebuild import trigger_auto_rebuild
+        result = trigger_auto_rebuild(args.kb_name)
+        print(f"分层索引: {result.get('message', result)}")
+
+    if stats["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import os
 import sys
-from typing import List, Dict, Any, Optional, Union
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import List, Dict, Any, Optional, Union, AsyncIterator
 from dotenv import load_dotenv
 
 # 确保可以导入当前目录的模块
@@ -18,21 +22,36 @@ from langchain_community.chat_models import ChatZhipuAI
 
 # 使用相对导入
 try:
-    from rag_retrievers import search_documents
+    from rag_retrievers import search_documents, asearch_documents, embed_query, get_knowledge_base_versions, run_in_retrieval_executor
 except ImportError as e:
     print(f"导入rag_retrievers失败: {e}")
     # 尝试相对导入
     try:
-        from .rag_retrievers import search_documents
+        from .rag_retrievers import search_documents, asearch_documents, embed_query, get_knowledge_base_versions, run_in_retrieval_executor
     except ImportError as e2:
         print(f"相对导入rag_retrievers也失败: {e2}")
         # 如果都失败了，定义一个简单的替代函数
-        def search_documents(query, knowledge_base_ids=None, top_k=5, return_scores=False, enable_context_enrichment=True, enable_ranking=True):
+        def search_documents(query, knowledge_base_ids=None, top_k=5, return_scores=False, enable_context_enrichment=True, enable_ranking=True, **kwargs):
             print(f"检索器不可用，查询: {query}, 知识库: {knowledge_base_ids}")
             return []
+        
+        async def asearch_documents(query, knowledge_base_ids=None, **kwargs):
+            return search_documents(query, knowledge_base_ids, **kwargs)
+        
+        def embed_query(query):
+            return None
+        
+        def get_knowledge_base_versions(knowledge_base_ids):
+            return ()
 
-from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_core.messages import HumanMessage
+try:
+    from conversation_store import ROLE_USER, ROLE_ASSISTANT, conversation_store
+    from context_packer import ContextPacker
+    from answer_cache import answer_cache
+except ImportError:
+    from .conversation_store import ROLE_USER, ROLE_ASSISTANT, conversation_store
+    from .context_packer import ContextPacker
+    from .answer_cache import answer_cache
 # 加载环境变量
 load_dotenv()
 
@@ -63,6 +82,139 @@ def get_document_source_info(doc):
     
     return "\n".join(source_info)
 
+def create_llm(provider: str, model_name: str, temperature: float, api_key: Optional[str] = None, api_url: Optional[str] = None):
+    """根据模型提供商创建大模型客户端"""
+    # OpenAI兼容的提供商（包括DeepSeek、OpenAI兼容API等）
+    openai_compatible_providers = ["openai", "deepseek", "openai-compatible"]
+
+    if provider in openai_compatible_providers:
+        # 设置环境变量
+        if api_key:
+            os.environ["OPENAI_API_KEY"] = api_key
+        if api_url:
+            os.environ["OPENAI_API_BASE"] = api_url
+
+        print(f"使用OpenAI兼容模型: {model_name} (提供商: {provider})")
+        print(f"API基础URL: {api_url or '默认'}")
+
+        # 创建ChatOpenAI实例
+        return ChatOpenAI(
+            model_name=model_name,
+            temperature=temperature,
+            openai_api_key=api_key,
+            openai_api_base=api_url,
+        )
+
+    elif provider == "zhipu":
+        # 设置环境变量
+        if api_key:
+            os.environ["ZHIPUAI_API_KEY"] = api_key
+
+        # 创建ChatZhipuAI实例
+        return ChatZhipuAI(
+            model_name=model_name,
+            temperature=temperature,
+            api_key=api_key
+        )
+
+    elif provider == "ollama":
+        # 创建Ollama实例
+        return ollama(
+            model=model_name,
+            temperature=temperature,
+            base_url=api_url
+        )
+
+    else:
+        # 对于未知提供商，尝试使用OpenAI兼容模式,刁福元 2025-06-10 10:00:00
+        print(f"⚠️  未知提供商 '{provider}'，尝试使用OpenAI兼容模式")
+
+        # 设置环境变量
+        if api_key:
+            os.environ["OPENAI_API_KEY"] = api_key
+        if api_url:
+            os.environ["OPENAI_API_BASE"] = api_url
+
+        # 创建ChatOpenAI实例
+        llm = ChatOpenAI(
+            model_name=model_name,
+            temperature=temperature,
+            openai_api_key=api_key,
+            openai_api_base=api_url,
+        )
+        print(f"✅ 成功使用OpenAI兼容模式初始化: {model_name}")
+        return llm
+
+
+class LLMClientPool:
+    """
+    大模型客户端池
+    
+    按(提供商, 模型, 端点, 温度, API密钥)复用大模型客户端，客户端内部的HTTP连接池随之复用，
+    不必每个请求重新建立连接；超过空闲时间未使用的客户端被移除。
+    客户端不保存对话状态，可以在请求之间共享。
+    
+    环境变量:
+        RAG_LLM_POOL_SIZE: 最多保留的客户端数，默认32
+        RAG_LLM_POOL_IDLE_SECONDS: 客户端空闲多久后移除，默认600秒
+    """
+    
+    def __init__(self, max_size: int = None, idle_seconds: float = None):
+        self.max_size = max_size or int(os.getenv("RAG_LLM_POOL_SIZE", "32"))
+        self.idle_seconds = idle_seconds if idle_seconds is not None else float(os.getenv("RAG_LLM_POOL_IDLE_SECONDS", "600"))
+        self._clients: "OrderedDict[tuple, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+    
+    def get(self, provider: str, model_name: str, temperature: float, api_key: Optional[str] = None, api_url: Optional[str] = None):
+        """获取大模型客户端，池中没有时创建"""
+        key = (provider, model_name, api_url, float(temperature), api_key)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry[1] = now
+                self._clients.move_to_end(key)
+                self.reused += 1
+                return entry[0]
+        
+        # 创建客户端不持锁，同一配置并发创建时保留先放入池中的那个
+        llm = create_llm(provider, model_name, temperature, api_key, api_url)
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry[1] = now
+                self.reused += 1
+                return entry[0]
+            self._clients[key] = [llm, now]
+            self.created += 1
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        return llm
+    
+    def _evict_idle(self, now: float):
+        """移除空闲超时的客户端（调用方持有锁）"""
+        while self._clients:
+            key, (_, last_used) = next(iter(self._clients.items()))
+            if now - last_used < self.idle_seconds:
+                break
+            self._clients.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self._clients), "created": self.created, "reused": self.reused}
+
+
+# 全局大模型客户端池
+llm_client_pool = LLMClientPool()
+
+
 class RAGGenerator:
     """
     检索增强生成（RAG）系统
@@ -70,6 +222,23 @@ class RAGGenerator:
     使用检索系统获取相关文档，然后使用大模型生成回答
     """
     
+    # 提示模板（所有实例共用）
+    prompt_template = PromptTemplate.from_template(
+            """
+            你是一个专业的智能助手。请基于以下检索到的文档内容，回答用户的问题。
+            如果检索到的文档不包含足够的信息来回答问题，请诚实地说明你不知道，不要编造信息。
+            
+            检索到的文档:
+            {context}
+
+            对话历史:
+            {chat_history}
+            
+            用户问题: {question}
+            请提供详细、准确、有条理的回答，并尽可能引用文档中的具体信息。但是不要直接引用原文内容，而是需要你进行总结再输出。
+            """
+    )
+    
     def __init__(
         self,
         model_name: str = None,
@@ -88,7 +257,9 @@ class RAGGenerator:
         score_threshold: float = 0.3,
         weight_keyword_freq: float = 0.4,
         weight_keyword_pos: float = 0.3,
-        weight_keyword_coverage: float = 0.3
+        weight_keyword_coverage: float = 0.3,
+        session_id: Optional[str] = None,
+        context_token_budget: Optional[int] = None
     ):
         """
         初始化RAG生成器
@@ -110,6 +281,9 @@ class RAGGenerator:
             weight_keyword_freq: 关键词频率权重
             weight_keyword_pos: 关键词位置权重
             weight_keyword_coverage: 关键词覆盖度权重
+            session_id: 会话ID，指定时对话历史保存在全局对话历史存储中，同一会话的请求共享；
+                        不指定时只在本实例内保留
+            context_token_budget: 检索文档部分的token预算，默认取RAG_CONTEXT_TOKEN_BUDGET（6000），0表示不限制
         """
         self.model_name = model_name or os.getenv("RAG_MODEL_NAME", "deepseek-chat")
         self.model_provider = model_provider or os.getenv("RAG_MODEL_PROVIDER", "openai")
@@ -117,8 +291,13 @@ class RAGGenerator:
         self.top_k = top_k
         self.enable_context_enrichment = enable_context_enrichment
         self.enable_ranking = enable_ranking
-        self.chat_history = ChatMessageHistory()
+        self.session_id = session_id
+        self.context_packer = ContextPacker(context_token_budget, self.model_name)
+        # 最近一次请求的上下文打包统计
+        self.last_context_stats = None
         self.memory_window_size = memory_window_size
+        # 未指定会话时的本地历史（只保留最近memory_window_size轮）
+        self._local_history = deque(maxlen=max(1, memory_window_size * 2))
         self.knowledge_base_path = knowledge_base_path or os.path.join("data", "knowledge_base")
         
         # 新增RAG配置参数
@@ -162,68 +341,9 @@ class RAGGenerator:
             self.api_url = api_url
             print(f"使用未知提供商 '{self.model_provider}' 的模型: {self.model_name}")
         
-        # 初始化大模型
+        # 获取大模型客户端（按配置复用）
         try:
-            # OpenAI兼容的提供商（包括DeepSeek、OpenAI兼容API等）
-            openai_compatible_providers = ["openai", "deepseek", "openai-compatible"]
-            
-            if self.model_provider in openai_compatible_providers:
-                # 设置环境变量
-                if self.api_key:
-                    os.environ["OPENAI_API_KEY"] = self.api_key
-                if self.api_url:
-                    os.environ["OPENAI_API_BASE"] = self.api_url
-                    
-                print(f"使用OpenAI兼容模型: {self.model_name} (提供商: {self.model_provider})")
-                print(f"API基础URL: {self.api_url or '默认'}")
-                    
-                # 创建ChatOpenAI实例
-                self.llm = ChatOpenAI(
-                    model_name=self.model_name,
-                    temperature=self.temperature,
-                    openai_api_key=self.api_key,
-                    openai_api_base=self.api_url,
-                )
-                
-            elif self.model_provider == "zhipu":
-                # 设置环境变量
-                if self.api_key:
-                    os.environ["ZHIPUAI_API_KEY"] = self.api_key
-                    
-                # 创建ChatZhipuAI实例
-                self.llm = ChatZhipuAI(
-                    model_name=self.model_name,
-                    temperature=self.temperature,
-                    api_key=self.api_key
-                )
-                
-            elif self.model_provider == "ollama":
-                # 创建Ollama实例
-                self.llm = ollama(
-                    model=self.model_name,
-                    temperature=self.temperature,
-                    base_url=self.api_url
-                )
-                
-            else:
-                # 对于未知提供商，尝试使用OpenAI兼容模式,刁福元 2025-06-10 10:00:00
-                print(f"⚠️  未知提供商 '{self.model_provider}'，尝试使用OpenAI兼容模式")
-                
-                # 设置环境变量
-                if self.api_key:
-                    os.environ["OPENAI_API_KEY"] = self.api_key
-                if self.api_url:
-                    os.environ["OPENAI_API_BASE"] = self.api_url
-                    
-                # 创建ChatOpenAI实例
-                self.llm = ChatOpenAI(
-                    model_name=self.model_name,
-                    temperature=self.temperature,
-                    openai_api_key=self.api_key,
-                    openai_api_base=self.api_url,
-                )
-                print(f"✅ 成功使用OpenAI兼容模式初始化: {self.model_name}")
-                
+            self.llm = llm_client_pool.get(self.model_provider, self.model_name, self.temperature, self.api_key, self.api_url)
         except Exception as e:
             print(f"初始化大模型时出错: {str(e)}")
             print(f"模型提供商: {self.model_provider}")
@@ -231,27 +351,33 @@ class RAGGenerator:
             print(f"API密钥: {'已设置' if self.api_key else '未设置'}")
             print(f"API URL: {self.api_url or '未设置'}")
             raise
+    
+    
+    def _format_documents(self, docs: List[Union[Document, tuple]], query: str = "") -> str:
+        """
+        将文档按token预算打包为字符串，统计信息记录在last_context_stats中
         
-        # 创建提示模板
-        self.prompt_template = PromptTemplate.from_template(
-            """
-            你是一个专业的智能助手。请基于以下检索到的文档内容，回答用户的问题。
-            如果检索到的文档不包含足够的信息来回答问题，请诚实地说明你不知道，不要编造信息。
-            
-            检索到的文档:
-            {context}
-
-            对话历史:
-            {chat_history}
+        参数:
+            docs: 文档列表或(文档,分数)元组列表
+            query: 用户问题（用于定位片段的截取位置）
             
-            用户问题: {question}
-            请提供详细、准确、有条理的回答，并尽可能引用文档中的具体信息。但是不要直接引用原文内容，而是需要你进行总结再输出。
-            """
-        )
+        返回:
+            格式化后的文档字符串
+        """
+        if self.context_packer.token_budget <= 0:
+            return self._format_documents_full(docs)
+        
+        # 节省的token数由打包器按各片段的token数估算，不再对完整拼接的上下文重新分词
+        context, stats = self.context_packer.pack(docs, query)
+        self.last_context_stats = stats
+        print(f"上下文打包: {stats['chunks_used']}/{stats['chunks']} 个片段, "
+              f"{stats['context_tokens']} tokens (预算 {stats['budget']}, 节省 {stats['tokens_saved']}), "
+              f"去重 {stats['duplicates_removed']}, 截取 {stats['trimmed']}, 丢弃 {stats['dropped']}")
+        return context
     
-    def _format_documents(self, docs: List[Union[Document, tuple]]) -> str:
+    def _format_documents_full(self, docs: List[Union[Document, tuple]]) -> str:
         """
-        将文档格式化为字符串
+        将文档完整格式化为字符串（不限制token数）
         
         参数:
             docs: 文档列表或(文档,分数)元组列表
@@ -299,51 +425,42 @@ class RAGGenerator:
         
         return "\n\n".join(formatted_docs)
 
+    def get_history(self) -> List[tuple]:
+        """最近的对话历史，(角色, 内容)列表"""
+        if self.session_id:
+            return conversation_store.get_messages(self.session_id, self.memory_window_size)
+        return list(self._local_history)
+
     def _format_chat_history(self) -> str:
         """格式化聊天历史为字符串"""
         formatted_history = []
-        messages = self.chat_history.messages
         
-        for i, message in enumerate(messages):
-            if isinstance(message, HumanMessage):
-                formatted_history.append(f"用户: {message.content}")
+        for role, content in self.get_history():
+            if role == ROLE_USER:
+                formatted_history.append(f"用户: {content}")
             else:  # 假设是AI消息
-                formatted_history.append(f"AI助手: {message.content}")
+                formatted_history.append(f"AI助手: {content}")
     
         return "\n".join(formatted_history)
     
     def add_message_to_history(self, role: str, content: str):
-        if role.lower() == "user":
-            self.chat_history.add_user_message(content)
+        role = ROLE_USER if role.lower() == "user" else ROLE_ASSISTANT
+        # 超过窗口大小的最早消息自动丢弃
+        if self.session_id:
+            conversation_store.append(self.session_id, role, content, self.memory_window_size)
         else:
-            self.chat_history.add_ai_message(content)
-        # 如果历史记录超过窗口大小，移除最早的消息
-        while len(self.chat_history.messages) > self.memory_window_size * 2:  # *2 因为每轮对话有用户和AI两条消息
-            self.chat_history.messages.pop(0)
+            self._local_history.append((role, content))
     
     def clear_history(self):
         """清除历史记录"""
-        self.chat_history.clear()
+        if self.session_id:
+            conversation_store.clear(self.session_id)
+        self._local_history.clear()
 
     
-    def retrieve_and_generate(self, query: str, knowledge_base_ids: List[str] = None, return_source_documents: bool = False, force_vectorstore: bool = False, retriever_type: str = "auto") -> Dict[str, Any]:
-        """
-        检索相关文档并生成回答
-        
-        参数:
-            query: 用户查询
-            knowledge_base_ids: 要搜索的知识库ID列表
-            return_source_documents: 是否返回源文档
-            force_vectorstore: 是否强制使用向量存储检索器
-            retriever_type: 检索器类型 ("auto", "hierarchical", "keyword_ensemble", "vectorstore")
-            
-        返回:
-            包含生成回答和可选源文档的字典
-        """
-        # 检索相关文档，使用实例的配置参数
-        docs = search_documents(
-            query=query,
-            knowledge_base_ids=knowledge_base_ids,
+    def _search_kwargs(self, force_vectorstore: bool = False, retriever_type: str = "auto") -> Dict[str, Any]:
+        """检索参数（使用实例的配置参数）"""
+        return dict(
             top_k=self.top_k,
             return_scores=True,
             enable_context_enrichment=self.enable_context_enrichment,
@@ -358,13 +475,80 @@ class RAGGenerator:
             force_vectorstore=force_vectorstore,
             retriever_type=retriever_type  # 传递检索器类型
         )
-
+    
+    def _retrieve(self, query: str, knowledge_base_ids: List[str] = None, force_vectorstore: bool = False, retriever_type: str = "auto") -> List[tuple]:
+        """检索相关文档，返回(文档,分数)元组列表"""
+        return search_documents(query, knowledge_base_ids, **self._search_kwargs(force_vectorstore, retriever_type))
+    
+    async def _aretrieve(self, query: str, knowledge_base_ids: List[str] = None, force_vectorstore: bool = False, retriever_type: str = "auto") -> List[tuple]:
+        """在检索线程池中检索相关文档，不阻塞事件循环"""
+        return await asearch_documents(query, knowledge_base_ids, **self._search_kwargs(force_vectorstore, retriever_type))
+    
+    def _answer_cache_key(self, query: str, knowledge_base_ids: List[str] = None, force_vectorstore: bool = False, retriever_type: str = "auto") -> Optional[tuple]:
+        """
+        回答缓存的查找参数(问题向量, 配置范围, 知识库版本)
+        
+        有对话历史时回答依赖上下文，不使用缓存，返回None
+        """
+        if not answer_cache.enabled or not knowledge_base_ids or self.get_history():
+            return None
+        kb_ids = tuple(sorted(str(kb_id) for kb_id in knowledge_base_ids))
+        scope = (
+            kb_ids,
+            self.model_provider,
+            self.model_name,
+            self.api_url,
+            self.temperature,
+            self.context_packer.token_budget,
+            tuple(sorted(self._search_kwargs(force_vectorstore, retriever_type).items())),
+        )
+        return embed_query(query), scope, get_knowledge_base_versions(kb_ids)
+    
+    async def _aanswer_cache_key(self, query: str, knowledge_base_ids: List[str] = None, force_vectorstore: bool = False, retriever_type: str = "auto") -> Optional[tuple]:
+        """在检索专用线程池中计算回答缓存的查找参数（问题向量化不阻塞事件循环，也不占用默认线程池）"""
+        return await run_in_retrieval_executor(
+            self._answer_cache_key, query, knowledge_base_ids, force_vectorstore, retriever_type
+        )
+    
+    def _lookup_cached_answer(self, query: str, cache_key: Optional[tuple]) -> Optional[Dict[str, Any]]:
+        """查找缓存的回答，命中时把问答记入对话历史"""
+        if cache_key is None:
+            return None
+        embedding, scope, versions = cache_key
+        cached = answer_cache.lookup(query, embedding, scope, versions)
+        if cached:
+            print(f"✅ 命中回答缓存 (相似度 {cached['similarity']}, 缓存问题: {cached['cached_query']})")
+            self.add_message_to_history("user", query)
+            self.add_message_to_history("assistant", cached["answer"])
+        return cached
+    
+    def _store_cached_answer(self, query: str, cache_key: Optional[tuple], answer: str, docs: List[tuple]):
+        """缓存生成的回答（没有检索到文档时不缓存，避免检索临时失败的结果被复用）"""
+        if cache_key is None or not docs or not answer:
+            return
+        embedding, scope, versions = cache_key
+        answer_cache.store(query, embedding, scope, versions, answer, [doc for doc, _ in docs])
+    
+    def _cached_result(self, query: str, cached: Dict[str, Any], return_source_documents: bool) -> Dict[str, Any]:
+        result = {
+            "query": query,
+            "answer": cached["answer"],
+            "context_stats": None,
+            "cached": True,
+        }
+        if return_source_documents:
+            result["source_documents"] = list(cached["source_documents"])
+        return result
+    
+    def _build_rag_chain(self, query: str, docs: List[tuple]):
+        """记录用户问题并创建RAG链（文档和对话历史在创建时格式化）"""
         # 将用户问题添加到历史记录
         self.add_message_to_history("user", query)
         
         # 格式化文档
+        self.last_context_stats = None
         if docs:
-            formatted_docs = self._format_documents(docs)
+            formatted_docs = self._format_documents(docs, query)
             print(f"✅ 检索到 {len(docs)} 个相关文档，正在生成回答...")
         else:
             formatted_docs = "没有检索到相关文档。"
@@ -373,7 +557,7 @@ class RAGGenerator:
         # 格式化聊天历史
         formatted_history = self._format_chat_history()
         # 创建RAG链
-        rag_chain = (
+        return (
             {"context": lambda x: formatted_docs, 
              "chat_history": lambda x: formatted_history, 
              "question": RunnablePassthrough(),}
@@ -381,12 +565,37 @@ class RAGGenerator:
             | self.llm
             | StrOutputParser()
         )
+    
+    def retrieve_and_generate(self, query: str, knowledge_base_ids: List[str] = None, return_source_documents: bool = False, force_vectorstore: bool = False, retriever_type: str = "auto", use_cache: bool = True) -> Dict[str, Any]:
+        """
+        检索相关文档并生成回答
+        
+        参数:
+            query: 用户查询
+            knowledge_base_ids: 要搜索的知识库ID列表
+            return_source_documents: 是否返回源文档
+            force_vectorstore: 是否强制使用向量存储检索器
+            retriever_type: 检索器类型 ("auto", "hierarchical", "keyword_ensemble", "vectorstore")
+            use_cache: 是否使用回答缓存，为False时总是重新检索和生成（结果也不写入缓存）
+            
+        返回:
+            包含生成回答和可选源文档的字典，cached表示回答是否来自缓存
+        """
+        cache_key = self._answer_cache_key(query, knowledge_base_ids, force_vectorstore, retriever_type) if use_cache else None
+        cached = self._lookup_cached_answer(query, cache_key)
+        if cached:
+            return self._cached_result(query, cached, return_source_documents)
+        
+        # 检索相关文档
+        docs = self._retrieve(query, knowledge_base_ids, force_vectorstore, retriever_type)
+        rag_chain = self._build_rag_chain(query, docs)
         
         # 生成回答
         try:
             answer = rag_chain.invoke(query)
             # 将AI回答添加到历史记录
             self.add_message_to_history("assistant", answer)
+            self._store_cached_answer(query, cache_key, answer, docs)
         except Exception as e:
             print(f"生成回答时出错: {str(e)}")
             answer = f"抱歉，生成回答时出现错误: {str(e)}"
@@ -395,12 +604,135 @@ class RAGGenerator:
         result = {
             "query": query,
             "answer": answer,
+            "context_stats": self.last_context_stats,
+            "cached": False,
         }
         
         if return_source_documents:
             result["source_documents"] = [doc for doc, _ in docs]
         
         return result
+    
+    async def aretrieve_and_generate(self, query: str, knowledge_base_ids: List[str] = None, return_source_documents: bool = False, force_vectorstore: bool = False, retriever_type: str = "auto", use_cache: bool = True) -> Dict[str, Any]:
+        """
+        retrieve_and_generate的异步版本（参数和返回值相同）
+        
+        检索在专用线程池中执行，生成使用大模型客户端的异步接口，整个过程不阻塞事件循环
+        """
+        cache_key = await self._aanswer_cache_key(query, knowledge_base_ids, force_vectorstore, retriever_type) if use_cache else None
+        cached = self._lookup_cached_answer(query, cache_key)
+        if cached:
+            return self._cached_result(query, cached, return_source_documents)
+        
+        docs = await self._aretrieve(query, knowledge_base_ids, force_vectorstore, retriever_type)
+        rag_chain = self._build_rag_chain(query, docs)
+        
+        # 生成回答
+        try:
+            answer = await rag_chain.ainvoke(query)
+            # 将AI回答添加到历史记录
+            self.add_message_to_history("assistant", answer)
+            self._store_cached_answer(query, cache_key, answer, docs)
+        except Exception as e:
+            print(f"生成回答时出错: {str(e)}")
+            answer = f"抱歉，生成回答时出现错误: {str(e)}"
+            self.add_message_to_history("assistant", answer)
+        
+        result = {
+            "query": query,
+            "answer": answer,
+            "context_stats": self.last_context_stats,
+            "cached": False,
+        }
+        
+        if return_source_documents:
+            result["source_documents"] = [doc for doc, _ in docs]
+        
+        return result
+    
+    async def astream_retrieve_and_generate(self, query: str, knowledge_base_ids: List[str] = None, force_vectorstore: bool = False, retriever_type: str = "auto", use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """
+        检索相关文档并流式生成回答
+        
+        检索在专用线程池中执行，不阻塞事件循环。检索完成后立即产出检索结果，再构建提示词并启动大模型请求，
+        文本片段到达后立即产出。
+        
+        参数:
+            query: 用户查询
+            knowledge_base_ids: 要搜索的知识库ID列表
+            force_vectorstore: 是否强制使用向量存储检索器
+            retriever_type: 检索器类型 ("auto", "hierarchical", "keyword_ensemble", "vectorstore")
+            use_cache: 是否使用回答缓存
+            
+        产出:
+            {"type": "sources", "source_documents": [...], "retrieval_ms": ...}  检索完成
+            {"type": "token", "content": "..."}                                  大模型生成的文本片段
+            {"type": "answer", "answer": "...", "timings": {...}, "cached": ...}  生成结束，完整回答和各阶段耗时
+        
+        timings包含retrieval_ms（检索）、ttft_ms（从调用开始到第一个文本片段）和total_ms（总耗时），单位毫秒。
+        命中回答缓存时不检索也不调用大模型，缓存的来源和完整回答作为一个文本片段依次产出。
+        生成出错时异常会继续抛出（已生成的部分和错误信息会记入对话历史），由调用方决定如何提示用户
+        """
+        started = time.perf_counter()
+        elapsed_ms = lambda: round((time.perf_counter() - started) * 1000, 1)
+        
+        cache_key = await self._aanswer_cache_key(query, knowledge_base_ids, force_vectorstore, retriever_type) if use_cache else None
+        cached = self._lookup_cached_answer(query, cache_key)
+        if cached:
+            timings = {"retrieval_ms": elapsed_ms(), "ttft_ms": None, "total_ms": None}
+            yield {"type": "sources", "source_documents": list(cached["source_documents"]), "retrieval_ms": timings["retrieval_ms"]}
+            timings["ttft_ms"] = timings["total_ms"] = elapsed_ms()
+            yield {"type": "token", "content": cached["answer"]}
+            yield {"type": "answer", "answer": cached["answer"], "timings": timings, "context_stats": None, "cached": True}
+            return
+        
+        docs = await self._aretrieve(query, knowledge_base_ids, force_vectorstore, retriever_type)
+        timings = {"retrieval_ms": elapsed_ms(), "ttft_ms": None, "total_ms": None}
+        yield {
+            "type": "sources",
+            "source_documents": [doc for doc, _ in docs],
+            "retrieval_ms": timings["retrieval_ms"]
+        }
+        
+        # 大模型在后台任务中生成，文本片段经队列转交，结束时放入None
+        rag_chain = self._build_rag_chain(query, docs)
+        chunks: asyncio.Queue = asyncio.Queue()
+        
+        async def produce():
+            try:
+                async for token in rag_chain.astream(query):
+                    if token:
+                        await chunks.put(token)
+                await chunks.put(None)
+            except Exception as e:
+                await chunks.put(e)
+        
+        producer = asyncio.create_task(produce())
+        parts = []
+        try:
+            while True:
+                item = await chunks.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    print(f"生成回答时出错: {str(item)}")
+                    self.add_message_to_history("assistant", "".join(parts) or f"抱歉，生成回答时出现错误: {str(item)}")
+                    raise item
+                if timings["ttft_ms"] is None:
+                    timings["ttft_ms"] = elapsed_ms()
+                parts.append(item)
+                yield {"type": "token", "content": item}
+        finally:
+            # 调用方提前停止（如客户端断开）时取消大模型请求
+            if not producer.done():
+                producer.cancel()
+        
+        answer = "".join(parts)
+        self.add_message_to_history("assistant", answer)
+        self._store_cached_answer(query, cache_key, answer, docs)
+        timings["total_ms"] = elapsed_ms()
+        print(f"流式生成耗时: 检索 {timings['retrieval_ms']}ms, 首个片段 {timings['ttft_ms']}ms, 总计 {timings['total_ms']}ms")
+        yield {"type": "answer", "answer": answer, "timings": timings, "context_stats": self.last_context_stats, "cached": False}
 
 
 # 使用示例
@@ -2,14 +2,20 @@ from .document_loaders.unstrcutured_loader import UnstructuredLoader
 from .text_splitter.chinese_recursive_text_splitter import ChineseRecursiveTextSplitter
 import os 
 import mimetypes
-from typing import Optional
+import time
+from typing import Callable, Optional
 from langchain_huggingface import HuggingFaceEmbeddings
 import torch
 from langchain_community.vectorstores import FAISS
-import hashlib
+from langchain_core.documents import Document
 import json
 from datetime import datetime
 import gc
+import pickle
+import tempfile
+from .chunk_dedup import ChunkDeduplicator, chunk_text_hash
+from .file_fingerprint import FILE_CHANGED, FILE_TOUCHED, check_file_change, compute_file_hash
+from .vector_manifest import VectorManifest, delete_vector_ids, remove_document_vectors, vector_store_lock
 
 def test_chunk(chunks):
     for i, chunk in enumerate(chunks):
@@ -31,6 +37,55 @@ def _get_optimal_device():
         return "cuda"
     return "cpu"
 
+
+class _EmbeddedChunkSpool:
+    """
+    在向量库锁外准备好的分块及其向量，按批写入临时文件
+
+    超大表格文件逐批解析和向量化，合并时再逐批读出，内存占用只与批大小相关
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._offsets = []
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def append(self, chunks, vectors: dict):
+        """写入一批分块和 分块文本->向量"""
+        self._file.seek(0, os.SEEK_END)
+        self._offsets.append(self._file.tell())
+        pickle.dump((chunks, vectors), self._file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def read(self, start: int = 0, end: Optional[int] = None):
+        """逐批读出第start到end（不含）批"""
+        end = len(self._offsets) if end is None else end
+        for index in range(start, end):
+            self._file.seek(self._offsets[index])
+            yield pickle.load(self._file)
+
+    def close(self):
+        self._file.close()
+
+
+def create_text_splitter(file_type: str) -> ChineseRecursiveTextSplitter:
+    """根据文件类型创建分块器"""
+    # 根据文件类型选择不同的分块大小
+    if file_type == "excel":
+        chunk_size = 3000
+        chunk_overlap = 0
+    else:
+        chunk_size = 1500  # 增加块大小，减少块数量
+        chunk_overlap = 150  # 保持10%的重叠率
+    
+    # 使用相同的分词器但不同的参数
+    return ChineseRecursiveTextSplitter(
+        keep_separator=True,
+        is_separator_regex=True,
+        chunk_size=chunk_size, 
+        chunk_overlap=chunk_overlap)
+
 class RAGPipeline:
     def __init__(
         self, 
@@ -38,7 +93,8 @@ class RAGPipeline:
         vector_store_path: str = None,
         embedding_config_id: Optional[int] = None,
         embedding_config: Optional[dict] = None,
-        use_local_embedding: bool = True
+        use_local_embedding: bool = True,
+        progress_callback: Optional[Callable[[str, dict], None]] = None
     ):
         """
         初始化RAG管道
@@ -49,8 +105,12 @@ class RAGPipeline:
             embedding_config_id: embedding模型配置ID（从数据库获取）
             embedding_config: embedding模型配置字典（直接传入配置）
             use_local_embedding: 是否使用本地embedding模型（当未提供配置时的默认行为）
+            progress_callback: 单文档处理进度回调 callback(stage, info)，
+                               stage为parsing/embedding/indexing，info包含分块数和吞吐量
         """
         self.file_path = file_path
+        self.progress_callback = progress_callback
+        self._progress = None
         # 如果指定了vector_store_path，使用指定路径，否则使用默认路径
         if vector_store_path:
             self.vector_store_path = vector_store_path
@@ -74,6 +134,18 @@ class RAGPipeline:
         if not os.path.exists(self.vector_store_path):
             os.makedirs(self.vector_store_path)
         
+        # 分块去重：完全相同（可选近似相同）的分块只向量化一次
+        self.deduplicator = ChunkDeduplicator(self.vector_store_path)
+        self.last_dedup_stats = None
+        
+        # 增量重新向量化：文档之前的 分块哈希->向量ID，未变化的分块直接复用
+        self._delta_chunks = {}
+        self._delta_stats = None
+        self.last_delta_stats = None
+        
+        # 合并时使用的锁外预先计算的向量：分块文本->向量
+        self._precomputed_embeddings = {}
+        
         # 初始化 FAISS GPU 支持
         self._initialize_faiss_gpu()
 
@@ -270,10 +342,8 @@ class RAGPipeline:
             print(f"清理显存时出现警告: {str(e)}")
 
     def _get_file_hash(self, file_path):
-        """获取文件的MD5哈希值"""
-        with open(file_path, 'rb') as f:
-            file_hash = hashlib.md5(f.read()).hexdigest()
-        return file_hash
+        """获取文件的MD5哈希值（分块读取）"""
+        return compute_file_hash(file_path)
 
     def _load_file_info(self):
         """加载文件信息记录"""
@@ -287,8 +357,280 @@ class RAGPipeline:
         with open(self.file_info_path, 'w', encoding='utf-8') as f:
             json.dump(file_info, f, ensure_ascii=False, indent=2)
 
-    def load_single_document(self, file_path: str):
-        """加载单个文档并更新向量库"""
+    def _record_document(self, manifest: VectorManifest, doc_key: str, file_path: str):
+        """将当前文档的向量ID和分块哈希写入清单"""
+        refs = self.deduplicator.document_refs
+        manifest.set_document(
+            doc_key,
+            file_path,
+            vector_ids=[vector_id for _, vector_id in refs],
+            chunk_hashes=[chunk_hash for chunk_hash, _ in refs],
+            updated_at=datetime.now().isoformat(),
+        )
+
+    def _create_text_splitter(self, file_type: str) -> ChineseRecursiveTextSplitter:
+        """根据文件类型创建分块器"""
+        return create_text_splitter(file_type)
+
+    def _owns_vector(self, existing: Document, chunk_hash: str, source: Optional[str]) -> bool:
+        """向量是否属于该来源文件（去重记录中的首个来源，没有记录时看向量自身的source）"""
+        if not source:
+            return False
+        record = self.deduplicator.records.get(chunk_hash) if self.deduplicator.enabled else None
+        owner = (record or {}).get("source") or existing.metadata.get("source")
+        return bool(owner) and os.path.abspath(owner) == os.path.abspath(source)
+    
+    def _reuse_unchanged_chunks(self, vectorstore, chunks):
+        """
+        增量重新向量化：与文档之前的分块哈希比对，未变化的分块复用原有向量ID
+        
+        Returns:
+            需要重新向量化的分块（新增或内容变化的分块）
+        """
+        if not self._delta_chunks or vectorstore is None:
+            return chunks
+        
+        changed = []
+        for chunk in chunks:
+            chunk_hash = chunk_text_hash(chunk.page_content)
+            vector_id = self._delta_chunks.get(chunk_hash)
+            existing = vectorstore.docstore.search(vector_id) if vector_id else None
+            if not isinstance(existing, Document):
+                changed.append(chunk)
+                continue
+            # 内容未变，只更新元数据（页码、行号等可能变化）；
+            # 去重后向量可能属于另一个文档，此时只记录本文档的引用，不改动其元数据
+            chunk.metadata["chunk_hash"] = chunk_hash
+            if self._owns_vector(existing, chunk_hash, chunk.metadata.get("source")):
+                duplicate_sources = existing.metadata.get("duplicate_sources")
+                existing.metadata = dict(chunk.metadata)
+                if duplicate_sources:
+                    existing.metadata["duplicate_sources"] = duplicate_sources
+            self.deduplicator.document_refs.append((chunk_hash, vector_id))
+            self._delta_stats["unchanged"] += 1
+        self._delta_stats["embedded"] += len(changed)
+        return changed
+
+    def _reset_progress(self):
+        self._progress = {"chunks": 0, "embedded": 0, "reused": 0, "embed_started": None}
+
+    def _report_progress(self, stage: str, **info):
+        """向progress_callback报告处理进度（回调异常不影响向量化）"""
+        if not self.progress_callback or self._progress is None:
+            return
+        progress = self._progress
+        payload = {
+            "chunks": progress["chunks"],
+            "embedded_chunks": progress["embedded"],
+            "reused_chunks": progress["reused"],
+        }
+        if progress["embed_started"] is not None and progress["embedded"]:
+            elapsed = time.time() - progress["embed_started"]
+            if elapsed > 0:
+                payload["chunks_per_second"] = round(progress["embedded"] / elapsed, 2)
+        payload.update(info)
+        try:
+            self.progress_callback(stage, payload)
+        except Exception as e:
+            print(f"进度回调失败: {e}")
+
+    def _embed_chunks(self, chunks):
+        """
+        分块的向量：优先使用锁外预先计算的结果，其余（锁内复核时已不能复用的分块）现在计算
+        
+        Returns:
+            (与chunks一一对应的向量, 本次新计算的向量数)
+        """
+        texts = [chunk.page_content for chunk in chunks]
+        missing = list(dict.fromkeys(text for text in texts if text not in self._precomputed_embeddings))
+        computed = dict(zip(missing, self.embeddings.embed_documents(missing))) if missing else {}
+        vectors = [computed[text] if text in computed else self._precomputed_embeddings[text] for text in texts]
+        return vectors, len(missing)
+
+    def _add_chunks_to_vectorstore(self, vectorstore, chunks):
+        """将分块去重后添加到向量库，向量库不存在时新建"""
+        total = len(chunks)
+        chunks = self._reuse_unchanged_chunks(vectorstore, chunks)
+        chunks, ids = self.deduplicator.deduplicate(chunks, vectorstore)
+        if self._progress is not None:
+            self._progress["reused"] += total - len(chunks)
+        if not chunks:
+            # 全部为已入库分块的重复，无需向量化
+            return vectorstore
+        
+        # 有进度回调时分批向量化，每批完成后报告进度
+        batch_size = len(chunks)
+        if self.progress_callback:
+            batch_size = max(1, int(os.getenv("EMBEDDING_PROGRESS_BATCH_SIZE", "256")))
+            if self._progress["embed_started"] is None:
+                self._progress["embed_started"] = time.time()
+        
+        for start in range(0, len(chunks), batch_size):
+            batch, batch_ids = chunks[start:start + batch_size], ids[start:start + batch_size]
+            vectors, embedded = self._embed_chunks(batch)
+            text_embeddings = [(chunk.page_content, vector) for chunk, vector in zip(batch, vectors)]
+            metadatas = [chunk.metadata for chunk in batch]
+            if vectorstore is None:
+                vectorstore = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas, ids=batch_ids)
+                print(f"创建新的向量库: {self.vector_store_path}")
+            else:
+                vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=batch_ids)
+            if self._progress is not None:
+                self._progress["embedded"] += embedded
+                self._report_progress("embedding")
+        
+        # 转换为 GPU 索引并优化（新建或添加了新文档后）
+        vectorstore = self._convert_index_to_gpu(vectorstore)
+        vectorstore = self._optimize_gpu_index(vectorstore)
+        return vectorstore
+
+    def _known_chunk_hashes(self, doc_key: str, file_path: str) -> set:
+        """
+        锁外读取的去重记录和文档之前的分块哈希（快照）
+        
+        这些分块合并时大概率可以复用已有向量，不预先向量化；合并时在锁内复核，已不能复用的再向量化
+        """
+        self.deduplicator.reload()
+        known = set(self.deduplicator.records) if self.deduplicator.enabled else set()
+        manifest = VectorManifest(self.vector_store_path)
+        previous_key = doc_key if manifest.get_document(doc_key) else manifest.find_key_by_source(file_path)
+        previous = manifest.get_document(previous_key) if previous_key else None
+        if previous:
+            known.update(previous.get("chunks") or {})
+        return known
+
+    def _embed_new_chunks(self, chunks, known: set) -> dict:
+        """
+        向量化快照中没有的分块（锁外执行）
+        
+        Returns:
+            分块文本->向量
+        """
+        texts = []
+        for chunk in chunks:
+            chunk_hash = chunk_text_hash(chunk.page_content)
+            if chunk_hash not in known:
+                known.add(chunk_hash)
+                texts.append(chunk.page_content)
+        
+        # 有进度回调时分批向量化，每批完成后报告进度
+        batch_size = len(texts) or 1
+        if self.progress_callback:
+            batch_size = max(1, int(os.getenv("EMBEDDING_PROGRESS_BATCH_SIZE", "256")))
+            if self._progress["embed_started"] is None:
+                self._progress["embed_started"] = time.time()
+        
+        vectors = {}
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            vectors.update(zip(batch, self.embeddings.embed_documents(batch)))
+            if self._progress is not None:
+                self._progress["embedded"] += len(batch)
+                self._report_progress("embedding")
+        return vectors
+
+    def _prepare_document(self, file_path: str, known: set, spool: _EmbeddedChunkSpool):
+        """
+        加载、分块并向量化一个文档，结果写入spool（锁外执行，不读写向量库）
+        
+        超大Excel/CSV文件流式分批加载，避免整个文件读入内存
+        
+        Returns:
+            (file_type, loaded)
+        """
+        streaming = self._get_streaming_loader(file_path)
+        if streaming:
+            loader, file_type = streaming
+            text_splitter = self._create_text_splitter(file_type)
+            batches = (text_splitter.split_documents(batch) for batch in loader.iter_batches())
+        else:
+            # 文档加载阶段
+            self.unstructured_loader = UnstructuredLoader(file_path)
+            doc, file_type = self.unstructured_loader.load_file()
+            
+            # 清理加载器占用的内存
+            del self.unstructured_loader
+            self._clear_gpu_memory()
+            
+            if not doc:
+                return file_type, False
+            
+            text_splitter = self._create_text_splitter(file_type)
+            batches = [text_splitter.split_documents(doc)]
+            
+            # 清理文档和分词器占用的内存
+            del doc
+            del text_splitter
+            self._clear_gpu_memory()
+        
+        total_chunks = 0
+        for chunks in batches:
+            if not chunks:
+                continue
+            # 确保每个块都包含文件源信息
+            for chunk in chunks:
+                if 'source' not in chunk.metadata:
+                    chunk.metadata['source'] = file_path
+            total_chunks += len(chunks)
+            if self._progress is not None:
+                self._progress["chunks"] += len(chunks)
+                self._report_progress("parsing", total_chunks=self._progress["chunks"])
+            spool.append(chunks, self._embed_new_chunks(chunks, known))
+            if streaming:
+                print(f"流式加载 {file_type}: 已处理 {total_chunks} 个块")
+        
+        self._clear_gpu_memory()
+        return file_type, total_chunks > 0
+
+    def _spooled_batches(self, spool: _EmbeddedChunkSpool, start: int = 0, end: Optional[int] = None):
+        """逐批读出锁外准备的分块，合并该批时使用预先计算的向量"""
+        try:
+            for chunks, vectors in spool.read(start, end):
+                self._precomputed_embeddings = vectors
+                yield chunks
+        finally:
+            self._precomputed_embeddings = {}
+
+    def _get_streaming_loader(self, file_path: str):
+        """
+        超大表格文件返回流式加载器，其他文件返回None
+        
+        - .xlsx 超过 EXCEL_STREAMING_THRESHOLD_MB（默认20MB）
+        - .csv 超过 CSV_STREAMING_THRESHOLD_MB（默认20MB）
+        
+        Returns:
+            (loader, file_type) 或 None，loader需提供iter_batches()
+        """
+        extension = os.path.splitext(file_path.lower())[1]
+        file_size = os.path.getsize(file_path)
+        
+        if extension == ".xlsx":
+            threshold_mb = float(os.getenv("EXCEL_STREAMING_THRESHOLD_MB", "20"))
+            if file_size >= threshold_mb * 1024 * 1024:
+                from .document_loaders.FilteredExcelLoader import FilteredExcelLoader
+                batch_size = int(os.getenv("EXCEL_STREAMING_BATCH_SIZE", "5000"))
+                return FilteredExcelLoader(file_path, streaming=True, batch_size=batch_size), "excel"
+        elif extension == ".csv":
+            threshold_mb = float(os.getenv("CSV_STREAMING_THRESHOLD_MB", "20"))
+            if file_size >= threshold_mb * 1024 * 1024:
+                from .document_loaders.FilteredCSVloader import FilteredCSVLoader
+                batch_size = int(os.getenv("CSV_STREAMING_BATCH_SIZE", "5000"))
+                return FilteredCSVLoader(file_path, autodetect_encoding=True, batch_size=batch_size), "csv"
+        return None
+
+    def load_single_document(self, file_path: str, doc_id: Optional[str] = None, force: bool = False):
+        """
+        加载单个文档并更新向量库
+        
+        Args:
+            file_path: 文件路径
+            doc_id: 文档ID，用于维护文档向量清单（为空时使用文件路径）
+            force: 文件未变化时也重新向量化
+        
+        解析、分块和向量化在向量库锁外进行，只有合并到向量库和保存时持有锁，
+        处理大文件期间同一知识库的其他文档不需要等待
+        """
+        spool = None
         try:
             if not os.path.exists(file_path):
                 print(f"文件不存在: {file_path}")
@@ -298,223 +640,312 @@ class RAGPipeline:
                 print(f"路径不是文件: {file_path}")
                 return False
             
-            # 加载现有的文件信息
-            file_info = self._load_file_info()
-            
-            # 检查是否已存在向量库
-            vectorstore = None
+            self.deduplicator.reset_stats()
+            self.last_dedup_stats = None
+            self.last_delta_stats = None
             
-            faiss_index_path = os.path.join(self.vector_store_path, "index.faiss")
-            if os.path.exists(faiss_index_path):
-                try:
-                    # 尝试加载现有的向量库
-                    vectorstore = FAISS.load_local(
-                        self.vector_store_path, 
-                        self.embeddings,
-                        allow_dangerous_deserialization=True
-                    )
-                    print(f"已加载现有向量库: {self.vector_store_path}")
-                    
-                    # 转换为 GPU 索引并优化
-                    vectorstore = self._convert_index_to_gpu(vectorstore)
-                    vectorstore = self._optimize_gpu_index(vectorstore)
-                    
-                except Exception as e:
-                    print(f"加载向量库失败: {e}")
-                    # 如果加载失败，将创建新的向量库
-                    vectorstore = None
-            
-            file_hash = self._get_file_hash(file_path)
-            
-            # 检查文件是否已处理过且未变更
-            if file_path in file_info and file_info[file_path]["hash"] == file_hash:
+            # 检查文件是否已处理过且未变更（大小和修改时间未变时不读取文件）
+            file_hash, file_signature, change = check_file_change(file_path, self._load_file_info())
+            if not force and change != FILE_CHANGED:
+                if change == FILE_TOUCHED:
+                    with vector_store_lock(self.vector_store_path):
+                        file_info = self._load_file_info()
+                        check_file_change(file_path, file_info)
+                        self._save_file_info(file_info)
                 print(f"文件 {file_path} 未发生变化，跳过处理")
                 return True
-                
-            print(f"正在处理文件: {file_path}")
             
-            # 文档加载阶段
-            self.unstructured_loader = UnstructuredLoader(file_path)
-            doc, file_type = self.unstructured_loader.load_file()
+            print(f"正在处理文件: {file_path}")
+            self._reset_progress()
+            self._report_progress("parsing")
             
-            # 清理加载器占用的内存
-            del self.unstructured_loader
-            self._clear_gpu_memory()
+            doc_key = doc_id or file_path
+            spool = _EmbeddedChunkSpool()
+            file_type, loaded = self._prepare_document(file_path, self._known_chunk_hashes(doc_key, file_path), spool)
             
             # 检查是否成功加载了文档
-            if not doc:
+            if not loaded:
                 print(f"文件 {file_path} 未成功加载")
                 return False
             
-            # 更新文件信息
-            file_info[file_path] = {
-                "hash": file_hash,
-                "last_updated": datetime.now().isoformat(),
-                "file_type": file_type
-            }
-            
-            # 根据文件类型选择不同的分块大小
-            if file_type == "excel":
-                chunk_size = 3000
-                chunk_overlap = 0
-            else:
-                chunk_size = 1500  # 增加块大小，减少块数量
-                chunk_overlap = 150  # 保持10%的重叠率
-            
-            # 使用相同的分词器但不同的参数
-            text_splitter = ChineseRecursiveTextSplitter(
-                keep_separator=True,
-                is_separator_regex=True,
-                chunk_size=chunk_size, 
-                chunk_overlap=chunk_overlap)
-            
-            chunks = text_splitter.split_documents(doc)
-            
-            # 清理文档和分词器占用的内存
-            del doc
-            del text_splitter
+            with vector_store_lock(self.vector_store_path):
+                return self._merge_single_document(
+                    file_path, doc_key, file_hash, file_signature, file_type, spool, force
+                )
+                
+        except Exception as e:
+            print(f"处理文件 {file_path} 时出错: {e}")
+            self._delta_chunks = {}
+            import traceback
+            traceback.print_exc()
+            # 即使出错也要清理显存
             self._clear_gpu_memory()
-            
-            # 确保每个块都包含文件源信息
+            return False
+        finally:
+            if spool is not None:
+                spool.close()
+
+    def _start_document_update(self, vectorstore, manifest: VectorManifest, doc_key: str, file_path: str, file_info: dict):
+        """
+        开始(重新)向量化一个文档
+        
+        清单中有该文档的分块哈希时进入增量模式：未变化的分块复用向量，
+        处理完成后由_finish_document_update删除已不存在的分块；
+        没有清单记录的旧数据先原地删除之前的向量，避免重复。
+        
+        Returns:
+            文档之前在清单中的键（没有则为None）
+        """
+        self.deduplicator.start_document()
+        self._delta_chunks = {}
+        self._delta_stats = {"unchanged": 0, "embedded": 0, "removed": 0}
+        
+        previous_key = doc_key if manifest.get_document(doc_key) else manifest.find_key_by_source(file_path)
+        if vectorstore is None or (previous_key is None and file_path not in file_info):
+            return previous_key
+        
+        previous = manifest.get_document(previous_key) if previous_key else None
+        if previous and previous.get("chunks"):
+            self._delta_chunks = dict(previous["chunks"])
+            print(f"增量重新向量化: 文档之前有 {len(self._delta_chunks)} 个分块")
+            return previous_key
+        
+        removed = remove_document_vectors(
+            self.vector_store_path,
+            doc_key=previous_key,
+            source=file_path,
+            vectorstore=vectorstore,
+            manifest=manifest,
+            save=False,
+            cleanup_records=False,
+        )
+        self._delta_stats["removed"] = removed["vectors"]
+        print(f"已删除文档之前的向量: {removed}")
+        return None
+
+    def _finish_document_update(self, vectorstore, manifest: VectorManifest, doc_key: str, previous_key: Optional[str], file_path: str):
+        """删除文档中已不存在的分块向量，并更新清单"""
+        previous = manifest.pop_document(previous_key) if previous_key else None
+        manifest.pop_document(doc_key)
+        if previous and vectorstore is not None:
+            current_ids = {vector_id for _, vector_id in self.deduplicator.document_refs}
+            # 被其他文档共享的向量（分块去重）保留
+            shared = manifest.referenced_ids()
+            stale = [
+                vector_id for vector_id in previous.get("vector_ids", [])
+                if vector_id not in current_ids and vector_id not in shared
+            ]
+            self._delta_stats["removed"] += delete_vector_ids(vectorstore, stale)
+        
+        self._record_document(manifest, doc_key, file_path)
+        self._delta_chunks = {}
+        self.last_delta_stats = dict(self._delta_stats)
+        print(f"增量向量化统计: {self.last_delta_stats}")
+
+    def add_document_chunks(self, vectorstore, manifest: VectorManifest, file_info: dict, doc_key: str, file_path: str, chunk_batches):
+        """
+        将一个文档已分好的块写入向量库（增量替换该文档之前的向量），并更新清单
+
+        只修改内存中的向量库和清单，由调用方负责更新file_info并保存（批量导入时按检查点保存）。
+        调用方需持有向量库锁。
+
+        Args:
+            chunk_batches: 分块列表的可迭代对象（超大表格文件可以逐批产生）
+
+        Returns:
+            (更新后的向量库, 本文档的进度统计{chunks, embedded, reused})
+        """
+        self._reset_progress()
+        
+        def counted(batches):
+            for chunks in batches:
+                self._progress["chunks"] += len(chunks)
+                yield chunks
+        
+        vectorstore = self._merge_document_chunks(vectorstore, manifest, file_info, doc_key, file_path, counted(chunk_batches))
+        progress = {key: self._progress[key] for key in ("chunks", "embedded", "reused")}
+        return vectorstore, progress
+
+    def _merge_document_chunks(self, vectorstore, manifest: VectorManifest, file_info: dict, doc_key: str, file_path: str, chunk_batches):
+        """
+        将文档的分块合并到向量库（增量替换该文档之前的向量）并更新清单（调用方持有向量库锁）
+        
+        Returns:
+            更新后的向量库
+        """
+        # 去重记录在锁外读取，期间可能已被其他任务修改
+        self.deduplicator.reload()
+        previous_key = self._start_document_update(vectorstore, manifest, doc_key, file_path, file_info)
+        for chunks in chunk_batches:
             for chunk in chunks:
                 if 'source' not in chunk.metadata:
                     chunk.metadata['source'] = file_path
-            
-            # 将文档添加到向量库
-            if vectorstore is None:
-                vectorstore = FAISS.from_documents(chunks, self.embeddings)
-                print(f"创建新的向量库: {self.vector_store_path}")
+            vectorstore = self._add_chunks_to_vectorstore(vectorstore, chunks)
+        self._finish_document_update(vectorstore, manifest, doc_key, previous_key, file_path)
+        return vectorstore
+
+    def _merge_single_document(self, file_path: str, doc_key: str, file_hash: str, file_signature: dict, file_type: str, spool: _EmbeddedChunkSpool, force: bool):
+        """把锁外准备好的文档合并到向量库并保存（调用方持有向量库锁）"""
+        # 持有锁后重新读取文件信息，其他任务的修改不会被覆盖
+        file_info = self._load_file_info()
+        if not force and file_info.get(file_path, {}).get("hash") == file_hash:
+            print(f"文件 {file_path} 已由其他任务处理，跳过合并")
+            return True
+        
+        # 检查是否已存在向量库
+        vectorstore = None
+        
+        faiss_index_path = os.path.join(self.vector_store_path, "index.faiss")
+        if os.path.exists(faiss_index_path):
+            try:
+                # 尝试加载现有的向量库
+                vectorstore = FAISS.load_local(
+                    self.vector_store_path, 
+                    self.embeddings,
+                    allow_dangerous_deserialization=True
+                )
+                print(f"已加载现有向量库: {self.vector_store_path}")
                 
                 # 转换为 GPU 索引并优化
                 vectorstore = self._convert_index_to_gpu(vectorstore)
                 vectorstore = self._optimize_gpu_index(vectorstore)
-            else:
-                vectorstore.add_documents(chunks)
                 
-                # 重新转换和优化（因为添加了新文档）
-                vectorstore = self._convert_index_to_gpu(vectorstore)
-                vectorstore = self._optimize_gpu_index(vectorstore)
-            
-            # 清理chunks占用的内存
-            del chunks
-            self._clear_gpu_memory()
-            
-            print(f"已处理文件: {file_path}, 向量化完成")
-            
-            # 保存向量库和文件信息
-            if vectorstore:
-                try:
-                    # 确保向量存储目录存在
-                    if not os.path.exists(self.vector_store_path):
-                        os.makedirs(self.vector_store_path, exist_ok=True)
+            except Exception as e:
+                print(f"加载向量库失败: {e}")
+                # 如果加载失败，将创建新的向量库
+                vectorstore = None
+        
+        # 合并分块，删除文档中已不存在的分块
+        manifest = VectorManifest(self.vector_store_path)
+        vectorstore = self._merge_document_chunks(
+            vectorstore, manifest, file_info, doc_key, file_path, self._spooled_batches(spool)
+        )
+        
+        # 更新文件信息
+        file_info[file_path] = {
+            "hash": file_hash,
+            **file_signature,
+            "last_updated": datetime.now().isoformat(),
+            "file_type": file_type
+        }
+        
+        print(f"已处理文件: {file_path}, 向量化完成")
+        
+        # 保存向量库和文件信息
+        if vectorstore:
+            self._report_progress("indexing")
+            try:
+                # 确保向量存储目录存在
+                if not os.path.exists(self.vector_store_path):
+                    os.makedirs(self.vector_store_path, exist_ok=True)
+                
+                # 检查路径是否包含中文字符
+                has_chinese = any('\u4e00' <= char <= '\u9fff' for char in self.vector_store_path)
+                
+                if has_chinese:
+                    # 如果路径包含中文，使用临时英文路径保存，然后移动文件
+                    import tempfile
+                    import shutil
                     
-                    # 检查路径是否包含中文字符
-                    has_chinese = any('\u4e00' <= char <= '\u9fff' for char in self.vector_store_path)
+                    # 创建临时目录
+                    temp_dir = tempfile.mkdtemp()
+                    print(f"使用临时路径保存向量库: {temp_dir}")
                     
-                    if has_chinese:
-                        # 如果路径包含中文，使用临时英文路径保存，然后移动文件
-                        import tempfile
-                        import shutil
-                        
-                        # 创建临时目录
-                        temp_dir = tempfile.mkdtemp()
-                        print(f"使用临时路径保存向量库: {temp_dir}")
-                        
-                        # 检查是否为 GPU 索引，如果是则转换为 CPU 索引后保存
-                        if hasattr(vectorstore, 'index') and 'Gpu' in type(vectorstore.index).__name__:
-                            print("检测到 GPU 索引，转换为 CPU 索引后保存")
-                            try:
-                                import faiss
-                                # 将 GPU 索引转换为 CPU 索引
-                                cpu_index = faiss.index_gpu_to_cpu(vectorstore.index)
-                                # 临时替换索引
-                                original_index = vectorstore.index
-                                vectorstore.index = cpu_index
-                                # 保存到临时目录
-                                vectorstore.save_local(temp_dir)
-                                # 恢复 GPU 索引
-                                vectorstore.index = original_index
-                                print("GPU 索引转换保存完成")
-                            except Exception as e:
-                                print(f"GPU 索引转换保存失败: {e}")
-                                # 如果转换失败，尝试直接保存
-                                vectorstore.save_local(temp_dir)
-                        else:
+                    # 检查是否为 GPU 索引，如果是则转换为 CPU 索引后保存
+                    if hasattr(vectorstore, 'index') and 'Gpu' in type(vectorstore.index).__name__:
+                        print("检测到 GPU 索引，转换为 CPU 索引后保存")
+                        try:
+                            import faiss
+                            # 将 GPU 索引转换为 CPU 索引
+                            cpu_index = faiss.index_gpu_to_cpu(vectorstore.index)
+                            # 临时替换索引
+                            original_index = vectorstore.index
+                            vectorstore.index = cpu_index
                             # 保存到临时目录
                             vectorstore.save_local(temp_dir)
-                        
-                        # 移动文件到目标目录
-                        temp_index_file = os.path.join(temp_dir, "index.faiss")
-                        temp_pkl_file = os.path.join(temp_dir, "index.pkl")
-                        
-                        target_index_file = os.path.join(self.vector_store_path, "index.faiss")
-                        target_pkl_file = os.path.join(self.vector_store_path, "index.pkl")
-                        
-                        if os.path.exists(temp_index_file):
-                            shutil.move(temp_index_file, target_index_file)
-                        if os.path.exists(temp_pkl_file):
-                            shutil.move(temp_pkl_file, target_pkl_file)
-                            
-                        # 清理临时目录
-                        shutil.rmtree(temp_dir)
-                        print(f"向量库文件已移动到: {self.vector_store_path}")
+                            # 恢复 GPU 索引
+                            vectorstore.index = original_index
+                            print("GPU 索引转换保存完成")
+                        except Exception as e:
+                            print(f"GPU 索引转换保存失败: {e}")
+                            # 如果转换失败，尝试直接保存
+                            vectorstore.save_local(temp_dir)
                     else:
-                        # 如果路径不包含中文，直接保存
-                        abs_vector_path = os.path.abspath(self.vector_store_path)
-                        print(f"准备保存向量库到: {abs_vector_path}")
-                        os.makedirs(abs_vector_path, exist_ok=True)
-                        
-                        # 检查是否为 GPU 索引，如果是则转换为 CPU 索引后保存
-                        if hasattr(vectorstore, 'index') and 'Gpu' in type(vectorstore.index).__name__:
-                            print("检测到 GPU 索引，转换为 CPU 索引后保存")
-                            try:
-                                import faiss
-                                # 将 GPU 索引转换为 CPU 索引
-                                cpu_index = faiss.index_gpu_to_cpu(vectorstore.index)
-                                # 临时替换索引
-                                original_index = vectorstore.index
-                                vectorstore.index = cpu_index
-                                # 保存
-                                vectorstore.save_local(abs_vector_path)
-                                # 恢复 GPU 索引
-                                vectorstore.index = original_index
-                                print("GPU 索引转换保存完成")
-                            except Exception as e:
-                                print(f"GPU 索引转换保存失败: {e}")
-                                # 如果转换失败，尝试直接保存
-                                vectorstore.save_local(abs_vector_path)
-                        else:
-                            vectorstore.save_local(abs_vector_path)
+                        # 保存到临时目录
+                        vectorstore.save_local(temp_dir)
                     
-                    # 清理向量库占用的内存
-                    del vectorstore
-                    self._clear_gpu_memory()
+                    # 移动文件到目标目录
+                    temp_index_file = os.path.join(temp_dir, "index.faiss")
+                    temp_pkl_file = os.path.join(temp_dir, "index.pkl")
                     
-                    self._save_file_info(file_info)
-                    print(f"单个文档向量化完成: {file_path}")
-                    return True
+                    target_index_file = os.path.join(self.vector_store_path, "index.faiss")
+                    target_pkl_file = os.path.join(self.vector_store_path, "index.pkl")
                     
-                except Exception as e:
-                    print(f"保存向量库失败: {e}")
-                    print(f"向量存储路径: {self.vector_store_path}")
-                    print(f"路径是否存在: {os.path.exists(self.vector_store_path)}")
-                    import traceback
-                    traceback.print_exc()
-                    return False
-            else:
-                print("向量库创建失败")
-                return False
+                    if os.path.exists(temp_index_file):
+                        shutil.move(temp_index_file, target_index_file)
+                    if os.path.exists(temp_pkl_file):
+                        shutil.move(temp_pkl_file, target_pkl_file)
+                        
+                    # 清理临时目录
+                    shutil.rmtree(temp_dir)
+                    print(f"向量库文件已移动到: {self.vector_store_path}")
+                else:
+                    # 如果路径不包含中文，直接保存
+                    abs_vector_path = os.path.abspath(self.vector_store_path)
+                    print(f"准备保存向量库到: {abs_vector_path}")
+                    os.makedirs(abs_vector_path, exist_ok=True)
+                    
+                    # 检查是否为 GPU 索引，如果是则转换为 CPU 索引后保存
+                    if hasattr(vectorstore, 'index') and 'Gpu' in type(vectorstore.index).__name__:
+                        print("检测到 GPU 索引，转换为 CPU 索引后保存")
+                        try:
+                            import faiss
+                            # 将 GPU 索引转换为 CPU 索引
+                            cpu_index = faiss.index_gpu_to_cpu(vectorstore.index)
+                            # 临时替换索引
+                            original_index = vectorstore.index
+                            vectorstore.index = cpu_index
+                            # 保存
+                            vectorstore.save_local(abs_vector_path)
+                            # 恢复 GPU 索引
+                            vectorstore.index = original_index
+                            print("GPU 索引转换保存完成")
+                        except Exception as e:
+                            print(f"GPU 索引转换保存失败: {e}")
+                            # 如果转换失败，尝试直接保存
+                            vectorstore.save_local(abs_vector_path)
+                    else:
+                        vectorstore.save_local(abs_vector_path)
                 
-        except Exception as e:
-            print(f"处理文件 {file_path} 时出错: {e}")
-            import traceback
-            traceback.print_exc()
-            # 即使出错也要清理显存
-            self._clear_gpu_memory()
+                # 清理向量库占用的内存
+                del vectorstore
+                self._clear_gpu_memory()
+                
+                self.deduplicator.save()
+                self._save_file_info(file_info)
+                manifest.save()
+                self.last_dedup_stats = self.deduplicator.get_stats()
+                print(f"分块去重统计: {self.last_dedup_stats}")
+                print(f"单个文档向量化完成: {file_path}")
+                return True
+                
+            except Exception as e:
+                print(f"保存向量库失败: {e}")
+                print(f"向量存储路径: {self.vector_store_path}")
+                print(f"路径是否存在: {os.path.exists(self.vector_store_path)}")
+                import traceback
+                traceback.print_exc()
+                return False
+        else:
+            print("向量库创建失败")
             return False
 
     def load_documents(self):
-        """加载文档并增量更新向量库"""
+        """
+        加载文档并增量更新向量库
+        
+        解析、分块和向量化在向量库锁外进行，只有合并到向量库和保存时持有锁
+        """
         # 获取目录下所有文件
         if not os.path.exists(self.file_path):
             print(f"文件路径不存在: {self.file_path}")
@@ -525,7 +956,7 @@ class RAGPipeline:
         filtered_files = []
         for file_path_name in file_paths:
             # 跳过元数据文件和隐藏文件
-            if file_path_name.startswith('.') or file_path_name == 'documents_metadata.json':
+            if file_path_name.startswith('.') or file_path_name.startswith('documents_metadata'):
                 print(f"跳过非文档文件: {file_path_name}")
                 continue
             filtered_files.append(os.path.join(self.file_path, file_path_name))
@@ -535,6 +966,65 @@ class RAGPipeline:
         # 加载现有的文件信息
         file_info = self._load_file_info()
         
+        # 先找出新增或变化的文件（大小和修改时间未变的文件不读取内容），都未变化时不加载向量库
+        changed_files = []
+        touched_files = []
+        for file in file_ob_paths:
+            if not os.path.isfile(file):
+                continue
+            file_hash, file_signature, change = check_file_change(file, file_info)
+            if change == FILE_CHANGED:
+                changed_files.append((file, file_hash, file_signature))
+            else:
+                if change == FILE_TOUCHED:
+                    touched_files.append(file)
+                print(f"文件 {file} 未发生变化，跳过处理")
+        
+        if not changed_files:
+            if touched_files:
+                with vector_store_lock(self.vector_store_path):
+                    file_info = self._load_file_info()
+                    for file in touched_files:
+                        check_file_change(file, file_info)
+                    self._save_file_info(file_info)
+            print("没有检测到新文件或文件变更，向量库保持不变")
+            return
+        
+        self.deduplicator.reset_stats()
+        manifest = VectorManifest(self.vector_store_path)
+        spool = _EmbeddedChunkSpool()
+        try:
+            # 锁外加载、分块并向量化，每个文件在spool中占[start, end)批
+            prepared = []
+            for file, file_hash, file_signature in changed_files:
+                print("--------------------------------正在处理{}文件".format(file))
+                try:
+                    doc_key = manifest.find_key_by_source(file) or file
+                    start = len(spool)
+                    file_type, loaded = self._prepare_document(file, self._known_chunk_hashes(doc_key, file), spool)
+                    
+                    # 检查是否成功加载了文档
+                    if not loaded:
+                        print(f"文件 {file} 未成功加载，跳过")
+                        continue
+                    prepared.append((file, file_hash, file_signature, file_type, start, len(spool)))
+                except Exception as e:
+                    print(f"处理文件 {file} 时出错: {e}")
+                    import traceback
+                    traceback.print_exc()
+            
+            with vector_store_lock(self.vector_store_path):
+                self._merge_documents(prepared, touched_files, spool)
+        finally:
+            spool.close()
+
+    def _merge_documents(self, prepared, touched_files, spool: _EmbeddedChunkSpool):
+        """把锁外准备好的多个文档合并到向量库并保存（调用方持有向量库锁）"""
+        # 持有锁后重新读取文件信息，其他任务的修改不会被覆盖
+        file_info = self._load_file_info()
+        for file in touched_files:
+            check_file_change(file, file_info)
+        
         # 检查是否已存在向量库
         vectorstore = None
         
@@ -560,78 +1050,34 @@ class RAGPipeline:
         
         updated = False
         total_processed = 0
+        manifest = VectorManifest(self.vector_store_path)
         
-        for file in file_ob_paths:
-            if not os.path.isfile(file):
+        for file, file_hash, file_signature, file_type, start, end in prepared:
+            if file_info.get(file, {}).get("hash") == file_hash:
+                print(f"文件 {file} 已由其他任务处理，跳过合并")
                 continue
-                
-            file_hash = self._get_file_hash(file)
-            
-            # 检查文件是否已处理过且未变更
-            if file in file_info and file_info[file]["hash"] == file_hash:
-                print(f"文件 {file} 未发生变化，跳过处理")
-                continue
-                
-            print("--------------------------------正在处理{}文件".format(file))
             try:
-                self.unstructured_loader = UnstructuredLoader(file)
-                doc, file_type = self.unstructured_loader.load_file()
-                
-                # 检查是否成功加载了文档
-                if not doc:
-                    print(f"文件 {file} 未成功加载，跳过")
-                    continue
+                # 文件有变更时只向量化新增或变化的分块
+                doc_key = manifest.find_key_by_source(file) or file
+                vectorstore = self._merge_document_chunks(
+                    vectorstore, manifest, file_info, doc_key, file, self._spooled_batches(spool, start, end)
+                )
                 
                 # 更新文件信息
                 file_info[file] = {
                     "hash": file_hash,
+                    **file_signature,
                     "last_updated": datetime.now().isoformat(),
                     "file_type": file_type
                 }
                 updated = True
                 
-                # 根据文件类型选择不同的分块大小
-                if file_type == "excel":
-                    chunk_size = 3000
-                    chunk_overlap = 0
-                else:
-                    chunk_size = 1500  # 增加块大小，减少块数量
-                    chunk_overlap = 150  # 保持10%的重叠率
-                
-                # 使用相同的分词器但不同的参数
-                text_splitter = ChineseRecursiveTextSplitter(
-                    keep_separator=True,
-                    is_separator_regex=True,
-                    chunk_size=chunk_size, 
-                    chunk_overlap=chunk_overlap)
-                
-                chunks = text_splitter.split_documents(doc)
-                
-                # 确保每个块都包含文件源信息
-                for chunk in chunks:
-                    if 'source' not in chunk.metadata:
-                        chunk.metadata['source'] = file
-                
-                # 将文档添加到向量库
-                if vectorstore is None:
-                    vectorstore = FAISS.from_documents(chunks, self.embeddings)
-                    print(f"创建新的向量库: {self.vector_store_path}")
-                    
-                    # 转换为 GPU 索引并优化
-                    vectorstore = self._convert_index_to_gpu(vectorstore)
-                    vectorstore = self._optimize_gpu_index(vectorstore)
-                else:
-                    vectorstore.add_documents(chunks)
-                    
-                    # 重新转换和优化（因为添加了新文档）
-                    vectorstore = self._convert_index_to_gpu(vectorstore)
-                    vectorstore = self._optimize_gpu_index(vectorstore)
-                
                 total_processed += 1
-                print(f"已处理文件: {file}, 生成 {len(chunks)} 个块")
+                print(f"已处理文件: {file}")
                 
             except Exception as e:
                 print(f"处理文件 {file} 时出错: {e}")
+                self._delta_chunks = {}
                 import traceback
                 traceback.print_exc()
         
@@ -721,8 +1167,12 @@ class RAGPipeline:
                         else:
                             vectorstore.save_local(abs_vector_path)
                     
+                    self.deduplicator.save()
                     self._save_file_info(file_info)
+                    manifest.save()
+                    self.last_dedup_stats = self.deduplicator.get_stats()
                     print(f"向量库已保存到: {self.vector_store_path}, 共处理 {total_processed} 个文件")
+                    print(f"分块去重统计: {self.last_dedup_stats}")
                 except Exception as e:
                     print(f"保存向量库失败: {e}")
                     print(f"向量存储路径: {self.vector_store_path}")
@@ -732,6 +1182,8 @@ class RAGPipeline:
             else:
                 print("没有文件被成功处理，向量库未更新")
         else:
+            if touched_files:
+                self._save_file_info(file_info)
             print("没有检测到新文件或文件变更，向量库保持不变")
 
 
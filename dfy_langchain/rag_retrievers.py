@@ -11,6 +11,10 @@ import sys
 import json
 import tempfile
 import shutil
+import asyncio
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional, Union, Tuple
 from dotenv import load_dotenv
 
@@ -31,6 +35,15 @@ if current_dir not in sys.path:
 
 load_dotenv()
 
+try:
+    from answer_cache import get_index_version
+    from retrieval_cache import RetrievalResultCache, copy_results
+    from single_flight import SingleFlight, get_single_flight_stats
+except ImportError:
+    from .answer_cache import get_index_version
+    from .retrieval_cache import RetrievalResultCache, copy_results
+    from .single_flight import SingleFlight, get_single_flight_stats
+
 
 class SimpleRetrieverService:
     """简化的检索器服务类（总是可用的后备方案）"""
@@ -1095,6 +1108,10 @@ class DocumentSearcher:
     def __init__(self):
         # 创建默认的factory，但会在search_documents中根据知识库动态创建新的manager
         self.default_factory = RetrieverServiceFactory()
+        # 检索结果缓存，知识库索引更新后自动失效
+        self.result_cache = RetrievalResultCache()
+        # 合并并发的相同检索
+        self._search_flight = SingleFlight("retrieval")
     
     def search_documents(self, query: str, knowledge_base_ids: List[str] = None, 
                         top_k: int = 5, return_scores: bool = False,
@@ -1134,8 +1151,45 @@ class DocumentSearcher:
             print("没有指定知识库ID，无法进行检索")
             return []
         
-
+        cache_key = self.result_cache.make_key(
+            query, knowledge_base_ids,
+            top_k=top_k, return_scores=return_scores,
+            enable_context_enrichment=enable_context_enrichment, enable_ranking=enable_ranking,
+            keyword_threshold=keyword_threshold, context_window=context_window,
+            score_threshold=score_threshold, weight_keyword_freq=weight_keyword_freq,
+            weight_keyword_pos=weight_keyword_pos, weight_keyword_coverage=weight_keyword_coverage,
+            retriever_type=retriever_type, force_vectorstore=force_vectorstore
+        )
         
+        # 相同的检索请求且知识库索引未更新时直接返回缓存的结果
+        versions = None
+        if self.result_cache.enabled:
+            versions = get_knowledge_base_versions(knowledge_base_ids)
+            cached = self.result_cache.get(cache_key, versions)
+            if cached is not None:
+                print(f"✅ 命中检索结果缓存，返回 {len(cached)} 个文档")
+                return cached
+        
+        # 相同的检索正在进行时等待其结果，不重复加载索引和检索
+        results, shared = self._search_flight.do(
+            cache_key, self._search_uncached, query, knowledge_base_ids, top_k, return_scores,
+            enable_context_enrichment, enable_ranking, keyword_threshold, context_window,
+            score_threshold, weight_keyword_freq, weight_keyword_pos, weight_keyword_coverage,
+            retriever_type, force_vectorstore
+        )
+        if shared:
+            print(f"✅ 合并到进行中的相同检索，返回 {len(results)} 个文档")
+            return copy_results(results)
+        if self.result_cache.enabled:
+            self.result_cache.put(cache_key, versions, results)
+        return results
+    
+    def _search_uncached(self, query: str, knowledge_base_ids: List[str], top_k: int, return_scores: bool,
+                         enable_context_enrichment: bool, enable_ranking: bool, keyword_threshold: int,
+                         context_window: int, score_threshold: float, weight_keyword_freq: float,
+                         weight_keyword_pos: float, weight_keyword_coverage: float,
+                         retriever_type: str, force_vectorstore: bool) -> List:
+        """执行完整的检索流程（不使用缓存）"""
         # 为每次搜索创建新的KnowledgeBaseManager，确保使用正确的embedding配置
         kb_manager = KnowledgeBaseManager(self.default_factory)
         
@@ -1278,6 +1332,11 @@ class DocumentInfoExtractor:
 _document_searcher = DocumentSearcher()
 _info_extractor = DocumentInfoExtractor()
 
+# 异步检索使用的专用线程池：检索涉及FAISS加载、向量化和分词等CPU密集操作，
+# 放在独立的有界线程池中执行，既不阻塞事件循环，也不会占满默认线程池
+RETRIEVAL_MAX_WORKERS = max(1, int(os.getenv("RAG_RETRIEVAL_WORKERS", "4")))
+_retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_MAX_WORKERS, thread_name_prefix="rag-retrieval")
+
 # 兼容性接口
 def search_documents(query: str, knowledge_base_ids: List[str] = None, top_k: int = 5,
                     return_scores: bool = False, enable_context_enrichment: bool = True,
@@ -1300,6 +1359,69 @@ def search_documents(query: str, knowledge_base_ids: List[str] = None, top_k: in
         force_vectorstore=force_vectorstore
     )
 
+_search_signature = inspect.signature(search_documents)
+_async_search_flight = SingleFlight("retrieval_async")
+
+async def asearch_documents(query: str, knowledge_base_ids: List[str] = None, **kwargs) -> List:
+    """
+    异步搜索文档（参数同search_documents）
+
+    检索在专用线程池中执行，同时进行的检索超过RAG_RETRIEVAL_WORKERS（默认4）时排队等待。
+    相同的检索正在进行时直接等待其结果，不占用线程池
+    """
+    loop = asyncio.get_running_loop()
+    arguments = _search_signature.bind(query, knowledge_base_ids, **kwargs)
+    arguments.apply_defaults()
+    options = dict(arguments.arguments)
+    key = RetrievalResultCache.make_key(options.pop("query"), options.pop("knowledge_base_ids") or [], **options)
+    results, shared = await _async_search_flight.ado(
+        key,
+        lambda: loop.run_in_executor(
+            _retrieval_executor,
+            functools.partial(search_documents, query, knowledge_base_ids, **kwargs)
+        )
+    )
+    return copy_results(results) if shared else results
+
+async def run_in_retrieval_executor(func, *args, **kwargs):
+    """在检索专用线程池中执行阻塞调用（如问题向量化），与检索共用RAG_RETRIEVAL_WORKERS的并发上限"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_retrieval_executor, functools.partial(func, *args, **kwargs))
+
+def embed_query(query: str) -> Optional[List[float]]:
+    """用默认嵌入模型计算问题向量（回答缓存按问题相似度匹配），模型不可用时返回None"""
+    embeddings = getattr(_document_searcher.default_factory, "embeddings", None)
+    if embeddings is None:
+        return None
+    try:
+        return embeddings.embed_query(query)
+    except Exception as e:
+        print(f"计算问题向量失败: {e}")
+        return None
+
+def get_knowledge_base_versions(knowledge_base_ids: List[str]) -> Tuple:
+    """各知识库索引文件的当前版本，知识库重新向量化后会变化（找不到的知识库版本为None）"""
+    kb_manager = KnowledgeBaseManager(_document_searcher.default_factory)
+    versions = []
+    for knowledge_base_id in sorted(str(kb_id) for kb_id in knowledge_base_ids or []):
+        kb_name = kb_manager.resolve_knowledge_base_name(knowledge_base_id)
+        kb_dir = None
+        if kb_name:
+            for path in (os.path.join("data", "knowledge_base", kb_name),
+                         os.path.join("..", "data", "knowledge_base", kb_name)):
+                if os.path.isdir(path):
+                    kb_dir = path
+                    break
+        versions.append((knowledge_base_id, get_index_version(kb_dir) if kb_dir else None))
+    return tuple(versions)
+
+def get_retrieval_cache_stats() -> Dict[str, Any]:
+    """检索结果缓存和并发合并统计"""
+    return {
+        **_document_searcher.result_cache.get_stats(),
+        "single_flight": get_single_flight_stats(),
+    }
+
 def get_document_source_info(doc) -> str:
     """获取文档来源信息的兼容性接口"""
     return _info_extractor.get_document_source_info(doc)
@@ -0,0 +1,181 @@
+"""
+RAG检索结果缓存
+
+相同的检索请求（归一化后的问题、知识库、检索器类型和全部排序参数都相同，且知识库索引未更新）
+直接返回之前的结果，跳过问题分析、摘要检索、片段检索、排序和上下文增强。
+
+检索结果中的文档片段按内容和来源存入共享的片段表（多个结果引用同一片段时只保存一份），
+每个结果只记录片段键和分数。返回的片段可能经过上下文增强，无法按向量库ID重建，
+因此片段表保存的是完整的片段内容和元数据：内存占用约为所有缓存结果中不重复片段的字符数之和，
+由RAG_RETRIEVAL_CACHE_MAX_CHARS限制，超出时淘汰最久未使用的结果。
+命中时返回新的Document对象，调用方修改不影响缓存。
+
+环境变量:
+    RAG_RETRIEVAL_CACHE: 是否启用，默认true
+    RAG_RETRIEVAL_CACHE_SIZE: 最多缓存的检索结果数，默认256
+    RAG_RETRIEVAL_CACHE_TTL: 检索结果的最长缓存时间（秒），默认3600
+    RAG_RETRIEVAL_CACHE_MAX_CHARS: 片段表最多保存的字符数（内容和元数据），默认20000000
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+try:
+    from answer_cache import normalize_query
+except ImportError:
+    from .answer_cache import normalize_query
+
+
+def _document_key(doc) -> Tuple[str, int]:
+    """片段键（内容和元数据的哈希）和片段的字符数"""
+    payload = json.dumps([doc.page_content, doc.metadata], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.md5(payload.encode("utf-8")).hexdigest(), len(payload)
+
+
+def copy_results(results: List) -> List:
+    """复制检索结果（文档和分数字典），多个请求共享同一结果时修改互不影响"""
+    copied = []
+    for item in results:
+        doc, score = item if isinstance(item, tuple) else (item, None)
+        doc = Document(page_content=doc.page_content, metadata=dict(doc.metadata))
+        if isinstance(item, tuple):
+            copied.append((doc, dict(score) if isinstance(score, dict) else score))
+        else:
+            copied.append(doc)
+    return copied
+
+
+class RetrievalResultCache:
+    """检索结果缓存（线程安全）"""
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        max_chars: Optional[int] = None
+    ):
+        self.enabled = enabled if enabled is not None else os.getenv("RAG_RETRIEVAL_CACHE", "true").lower() == "true"
+        self.max_entries = max_entries or int(os.getenv("RAG_RETRIEVAL_CACHE_SIZE", "256"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("RAG_RETRIEVAL_CACHE_TTL", "3600"))
+        self.max_chars = max_chars or int(os.getenv("RAG_RETRIEVAL_CACHE_MAX_CHARS", "20000000"))
+        # 键 -> {"items": [(片段键, 分数)], "versions": ..., "created_at": ...}
+        self._results: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        # 片段键 -> [内容, 元数据, 引用数, 字符数]
+        self._documents: Dict[str, list] = {}
+        # 片段表当前保存的字符数
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    @staticmethod
+    def make_key(query: str, knowledge_base_ids: List[str], **options) -> tuple:
+        """检索请求的缓存键（options为检索器类型和全部排序参数）"""
+        return (
+            normalize_query(query),
+            tuple(sorted(str(kb_id) for kb_id in knowledge_base_ids)),
+            tuple(sorted(options.items())),
+        )
+
+    def get(self, key: tuple, versions: tuple) -> Optional[List]:
+        """
+        获取缓存的检索结果，知识库索引版本不一致或过期时删除条目
+
+        Returns:
+            与search_documents相同格式的结果（分数为None的条目只返回文档），未命中返回None
+        """
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and (entry["versions"] != versions or time.time() - entry["created_at"] > self.ttl_seconds):
+                self._remove(key)
+                self.invalidated += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._results.move_to_end(key)
+            results = []
+            for doc_key, score in entry["items"]:
+                content, metadata = self._documents[doc_key][:2]
+                doc = Document(page_content=content, metadata=dict(metadata))
+                if entry["docs_only"]:
+                    results.append(doc)
+                else:
+                    results.append((doc, dict(score) if isinstance(score, dict) else score))
+            return results
+
+    def put(self, key: tuple, versions: tuple, results: List):
+        """
+        缓存检索结果（空结果不缓存，单个结果超过字符上限时不缓存）
+
+        超出结果数或字符数上限时淘汰最久未使用的结果
+        """
+        if not results:
+            return
+        docs_only = not isinstance(results[0], tuple)
+        pairs = [((item, None) if docs_only else item) for item in results]
+        keys = [_document_key(doc) for doc, _ in pairs]
+        if sum(dict(keys).values()) > self.max_chars:
+            return
+        with self._lock:
+            if key in self._results:
+                self._remove(key)
+            items = []
+            for (doc, score), (doc_key, size) in zip(pairs, keys):
+                record = self._documents.get(doc_key)
+                if record is None:
+                    record = self._documents[doc_key] = [doc.page_content, dict(doc.metadata), 0, size]
+                    self._chars += size
+                record[2] += 1
+                items.append((doc_key, dict(score) if isinstance(score, dict) else score))
+            self._results[key] = {
+                "items": items,
+                "docs_only": docs_only,
+                "versions": versions,
+                "created_at": time.time(),
+            }
+            while len(self._results) > self.max_entries or self._chars > self.max_chars:
+                self._remove(next(iter(self._results)))
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._documents.clear()
+            self._chars = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._results),
+                "documents": len(self._documents),
+                "chars": self._chars,
+                "max_chars": self.max_chars,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidated": self.invalidated,
+            }
+
+    def _remove(self, key: tuple):
+        """删除结果并释放不再被引用的片段（调用方持有锁）"""
+        entry = self._results.pop(key, None)
+        if entry is None:
+            return
+        for doc_key, _ in entry["items"]:
+            record = self._documents.get(doc_key)
+            if record is not None:
+                record[2] -= 1
+                if record[2] <= 0:
+                    del self._documents[doc_key]
+                    self._chars -= record[3]
@@ -7,6 +7,7 @@ AI查询分析器
 
 import os
 import sys
+import copy
 import json
 import logging
 from typing import List, Dict, Any, Optional, Tuple
@@ -26,8 +27,16 @@ except ImportError as e:
     print(f"⚠️ 数据库或LangChain模块导入失败: {e}")
     DB_AVAILABLE = False
 
+try:
+    from single_flight import SingleFlight
+except ImportError:
+    from dfy_langchain.single_flight import SingleFlight
+
 logger = logging.getLogger(__name__)
 
+# 合并并发的相同查询分析（每次检索都会创建新的分析器，因此在模块级共享）
+_analysis_flight = SingleFlight("query_analysis")
+
 
 class AIQueryAnalyzer:
     """AI查询分析器 - 使用数据库配置的AI模型"""
@@ -92,7 +101,16 @@ class AIQueryAnalyzer:
             self.model_config = None
     
     def analyze_query_with_ai(self, query: str) -> Dict[str, Any]:
-        """使用AI大模型分析查询"""
+        """使用AI大模型分析查询（相同模型对同一查询的分析正在进行时等待其结果）"""
+        if not self.llm:
+            return self._analyze_query_with_ai(query)
+        result, shared = _analysis_flight.do(("analysis", self.model_config_id, query), self._analyze_query_with_ai, query)
+        if shared:
+            print(f"🤝 合并到进行中的查询分析: '{query}'")
+            return copy.deepcopy(result)
+        return result
+    
+    def _analyze_query_with_ai(self, query: str) -> Dict[str, Any]:
         if not self.llm:
             print("⚠️ AI模型未初始化，使用基础分析")
             return self._fallback_analysis(query)
@@ -295,10 +313,14 @@ class AIQueryAnalyzer:
         return analysis_result.get("query_intent", "general")
     
     def generate_semantic_expansions_with_ai(self, query: str) -> List[str]:
-        """使用AI生成语义扩展"""
+        """使用AI生成语义扩展（相同模型对同一查询的扩展正在进行时等待其结果）"""
         if not self.llm:
             return []
         
+        expansions, shared = _analysis_flight.do(("expansions", self.model_config_id, query), self._generate_semantic_expansions_with_ai, query)
+        return list(expansions) if shared else expansions
+    
+    def _generate_semantic_expansions_with_ai(self, query: str) -> List[str]:
         try:
             system_prompt = """你是一个语义扩展专家。给定一个查询，请生成3-5个语义相关的扩展词或短语。
 
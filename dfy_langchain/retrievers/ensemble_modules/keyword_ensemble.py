@@ -168,10 +168,13 @@ class KeywordEnsembleRetrieverService(BaseRetrieverService):
         
         # 查找所有关键词在文本中的位置
         positions = []
+        matched_keywords = []
         for keyword in keywords:
             # 找到所有关键词出现的位置
-            for match in re.finditer(re.escape(keyword.lower()), content.lower()):
-                positions.append((match.start(), match.end()))
+            hits = [(match.start(), match.end()) for match in re.finditer(re.escape(keyword.lower()), content.lower())]
+            if hits:
+                positions.extend(hits)
+                matched_keywords.append(keyword)
         
         if not positions:
             return doc
@@ -218,7 +221,9 @@ class KeywordEnsembleRetrieverService(BaseRetrieverService):
             metadata={
                 **doc.metadata,
                 "original_content": content[:100] + "..." if len(content) > 100 else content,
-                "context_enriched": True
+                "context_enriched": True,
+                # 命中的关键词，上下文打包截取片段时以其位置为中心
+                "matched_keywords": matched_keywords
             }
         )
         
@@ -1041,6 +1041,9 @@ class HierarchicalIndexBuilder:
             print(f"💾 保存块向量存储到: {chunk_path}")
             chunk_vectorstore.save_local(chunk_path)
             
+            # 记录每个来源文件对应的摘要ID和块ID，删除文档时可原地移除
+            self._update_manifest(vectorstore_path, summary_vectorstore, chunk_vectorstore)
+            
             print(f"✅ 分层索引已保存到: {os.path.dirname(summary_path)}")
             
             return summary_vectorstore, chunk_vectorstore
@@ -1049,6 +1052,29 @@ class HierarchicalIndexBuilder:
             print(f"❌ 构建分层索引失败: {e}")
             raise
     
+    def _update_manifest(self, vectorstore_path: str, summary_vectorstore, chunk_vectorstore):
+        """将分层索引中各来源文件的摘要ID和块ID写入文档向量清单"""
+        try:
+            from ..vector_manifest import VectorManifest, vector_store_lock
+            
+            sources = {}
+            for kind, store in (("summary_ids", summary_vectorstore), ("chunk_ids", chunk_vectorstore)):
+                for vector_id, doc in store.docstore._dict.items():
+                    doc_sources = doc.metadata.get('sources') or [doc.metadata.get('source')]
+                    for source in doc_sources:
+                        if not source or source == 'unknown':
+                            continue
+                        entry = sources.setdefault(source, {"summary_ids": [], "chunk_ids": []})
+                        entry[kind].append(vector_id)
+            
+            with vector_store_lock(vectorstore_path):
+                manifest = VectorManifest(vectorstore_path)
+                manifest.set_hierarchical(sources)
+                manifest.save()
+            print(f"📝 已更新分层索引清单: {len(sources)} 个来源文件")
+        except Exception as e:
+            print(f"⚠️ 更新分层索引清单失败: {e}")
+    
     def _create_summary_documents(self, documents: List[Document]) -> List[Document]:
         """创建摘要文档（支持智能合并相似文档）"""
         print(f"🔍 开始创建摘要文档，输入文档数量: {len(documents)}")
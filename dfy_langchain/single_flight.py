@@ -0,0 +1,112 @@
+"""
+并发请求合并（single-flight）
+
+同一时刻多个键相同的请求只执行一次计算，其余请求等待并共享这次计算的结果（或异常）。
+计算完成后立即移除，之后的请求重新计算（结果复用由各自的缓存负责）。
+
+共享的结果是同一个对象，调用方如果会修改结果，需要自行复制。
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+# 所有实例，用于统计
+_registry: Dict[str, "SingleFlight"] = {}
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """按键合并并发的相同请求（线程和协程都可使用）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+        _registry[name] = self
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, bool]:
+        """
+        执行fn(*args, **kwargs)，已有相同键的计算在进行时等待其结果
+
+        Returns:
+            (结果, 是否共享了其他请求的结果)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        do的协程版本：等待的请求不占用线程
+
+        计算在独立的任务中执行，所有请求（包括发起计算的请求）都通过shield等待，
+        任何一个请求被取消（如客户端断开）都不会中止计算，也不影响其他等待的请求
+
+        Returns:
+            (结果, 是否共享了其他请求的结果)
+        """
+        with self._lock:
+            task = self._futures.get(key)
+            leader = task is None
+            if leader:
+                task = self._futures[key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda finished: self._finish_task(key, finished))
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        return await asyncio.shield(task), not leader
+
+    def _finish_task(self, key: Hashable, task: asyncio.Future):
+        with self._lock:
+            if self._futures.get(key) is task:
+                del self._futures[key]
+        # 所有请求都已取消时避免"exception was never retrieved"警告
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._futures),
+            }
+
+
+def get_single_flight_stats() -> Dict[str, Dict[str, int]]:
+    """所有合并点的统计"""
+    return {name: flight.get_stats() for name, flight in _registry.items()}
@@ -0,0 +1,172 @@
+"""
+ChineseRecursiveTextSplitter 性能基准
+
+对比当前实现与旧实现（逐层重复re.search、每次重新构造正则、每层都做空白清理）
+在大段中文文本上的耗时，并校验两者输出的分块完全一致。
+
+用法:
+    python -m dfy_langchain.text_splitter.benchmark_splitter
+    python -m dfy_langchain.text_splitter.benchmark_splitter --file 某个大文本.txt --chunk-size 1500 --chunk-overlap 150
+"""
+
+import argparse
+import random
+import re
+import time
+from typing import Any, List, Optional
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from .chinese_recursive_text_splitter import (
+    ChineseRecursiveTextSplitter,
+    _split_text_with_regex_from_end,
+)
+
+
+class LegacyChineseRecursiveTextSplitter(RecursiveCharacterTextSplitter):
+    """旧版实现，仅用于基准对比"""
+
+    def __init__(
+        self,
+        separators: Optional[List[str]] = None,
+        keep_separator: bool = True,
+        is_separator_regex: bool = True,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(keep_separator=keep_separator, **kwargs)
+        self._separators = separators or [
+            "\n\n",
+            "\n",
+            "。|！|？",
+            "\.\s|\!\s|\?\s",
+            "；|;\s",
+            "，|,\s",
+        ]
+        self._is_separator_regex = is_separator_regex
+
+    def _split_text(self, text: str, separators: List[str]) -> List[str]:
+        final_chunks = []
+        separator = separators[-1]
+        new_separators = []
+        for i, _s in enumerate(separators):
+            _separator = _s if self._is_separator_regex else re.escape(_s)
+            if _s == "":
+                separator = _s
+                break
+            if re.search(_separator, text):
+                separator = _s
+                new_separators = separators[i + 1 :]
+                break
+
+        _separator = separator if self._is_separator_regex else re.escape(separator)
+        splits = _split_text_with_regex_from_end(text, _separator, self._keep_separator)
+
+        _good_splits = []
+        _separator = "" if self._keep_separator else separator
+        for s in splits:
+            if self._length_function(s) < self._chunk_size:
+                _good_splits.append(s)
+            else:
+                if _good_splits:
+                    merged_text = self._merge_splits(_good_splits, _separator)
+                    final_chunks.extend(merged_text)
+                    _good_splits = []
+                if not new_separators:
+                    final_chunks.append(s)
+                else:
+                    other_info = self._split_text(s, new_separators)
+                    final_chunks.extend(other_info)
+        if _good_splits:
+            merged_text = self._merge_splits(_good_splits, _separator)
+            final_chunks.extend(merged_text)
+        return [
+            re.sub(r"\n{2,}", "\n", chunk.strip())
+            for chunk in final_chunks
+            if chunk.strip() != ""
+        ]
+
+
+_SAMPLE_SENTENCES = [
+    "前 10 个月，一般贸易进出口 19.5 万亿元，增长 25.1%，比整体进出口增速高出 2.9 个百分点。",
+    "其中，一般贸易出口 10.6 万亿元，增长 25.3%，占出口总额的 60.9%，提升 1.5 个百分点；",
+    "加工贸易进出口 6.8 万亿元，增长 11.8%，占进出口总额的 21.5%，减少 2.0 个百分点！",
+    "服务贸易结构持续优化，知识密集型服务进出口 16917.7 亿元，增长 13.3%。",
+    "全球通胀持续高位运行? 能源价格上涨加大主要经济体的通胀压力, 增加全球经济复苏的不确定性. ",
+    "产业链供应链面临挑战，区域化、近岸化、本土化、短链化趋势凸显",
+    "投诉人反映：商家拒绝退款，要求市场监管部门依法处理。",
+]
+
+
+def generate_text(target_chars: int, seed: int = 42) -> str:
+    """生成指定长度的中文测试文本，包含段落、换行、长句和无标点长串"""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < target_chars:
+        paragraph = "".join(rng.choice(_SAMPLE_SENTENCES) for _ in range(rng.randint(1, 40)))
+        # 偶尔加入没有任何分隔符的超长片段，触发逐级递归
+        if rng.random() < 0.05:
+            paragraph += "无分隔符长串" * rng.randint(100, 600)
+        parts.append(paragraph)
+        parts.append(rng.choice(["\n\n", "\n", "\n\n\n"]))
+        length += len(paragraph) + 2
+    return "".join(parts)
+
+
+def _time_split(splitter, text: str, repeat: int):
+    best = float("inf")
+    chunks = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = splitter.split_text(text)
+        best = min(best, time.perf_counter() - start)
+    return best, chunks
+
+
+def run_benchmark(text: str, chunk_size: int, chunk_overlap: int, repeat: int) -> bool:
+    """运行一次对比，返回两种实现的输出是否一致"""
+    kwargs = dict(
+        keep_separator=True,
+        is_separator_regex=True,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+    legacy_time, legacy_chunks = _time_split(LegacyChineseRecursiveTextSplitter(**kwargs), text, repeat)
+    current_time, current_chunks = _time_split(ChineseRecursiveTextSplitter(**kwargs), text, repeat)
+
+    identical = legacy_chunks == current_chunks
+    print(
+        f"文本长度: {len(text):>10} 字符 | chunk_size={chunk_size} chunk_overlap={chunk_overlap} | "
+        f"块数: {len(current_chunks)}"
+    )
+    print(f"  旧实现: {legacy_time * 1000:10.1f} ms")
+    print(f"  新实现: {current_time * 1000:10.1f} ms  (加速 {legacy_time / max(current_time, 1e-9):.2f}x)")
+    print(f"  输出一致: {'是' if identical else '否'}")
+    return identical
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChineseRecursiveTextSplitter 性能基准")
+    parser.add_argument("--file", help="使用指定文本文件（utf-8）代替生成的测试文本")
+    parser.add_argument("--sizes", default="100000,1000000,5000000", help="生成文本的字符数，逗号分隔")
+    parser.add_argument("--chunk-size", type=int, default=1500)
+    parser.add_argument("--chunk-overlap", type=int, default=150)
+    parser.add_argument("--repeat", type=int, default=3, help="每组重复次数，取最快一次")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            texts = [f.read()]
+    else:
+        texts = [generate_text(int(size)) for size in args.sizes.split(",")]
+
+    all_identical = True
+    for text in texts:
+        all_identical &= run_benchmark(text, args.chunk_size, args.chunk_overlap, args.repeat)
+
+    if not all_identical:
+        raise SystemExit("新旧实现的分块结果不一致")
+
+
+if __name__ == "__main__":
+    main()
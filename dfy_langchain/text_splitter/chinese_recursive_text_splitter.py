@@ -1,9 +1,15 @@
 import logging
 import re
-from typing import Any, List, Optional
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Tuple
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+logger = logging.getLogger(__name__)
+
+# 多个连续换行合并为一个
+_MULTI_NEWLINE_RE = re.compile(r"\n{2,}")
+
 
 def _split_text_with_regex_from_end(
     text: str, separator: str, keep_separator: bool
@@ -24,6 +30,28 @@ def _split_text_with_regex_from_end(
     return [s for s in splits if s != ""]
 
 
+def _split_text_with_compiled_regex(
+    text: str, pattern: Optional[Pattern], keep_separator: bool
+) -> List[str]:
+    """
+    使用预编译的分隔符正则一次扫描完成切分，结果与_split_text_with_regex_from_end一致
+    （保留分隔符时分隔符附在前一段末尾）
+    """
+    if pattern is None:
+        return list(text)
+
+    splits = []
+    start = 0
+    for match in pattern.finditer(text):
+        end = match.end() if keep_separator else match.start()
+        if end > start:
+            splits.append(text[start:end])
+        start = match.end()
+    if start < len(text):
+        splits.append(text[start:])
+    return splits
+
+
 class ChineseRecursiveTextSplitter(RecursiveCharacterTextSplitter):
     def __init__(
         self,
@@ -43,24 +71,50 @@ class ChineseRecursiveTextSplitter(RecursiveCharacterTextSplitter):
             "，|,\s",
         ]
         self._is_separator_regex = is_separator_regex
+        # 分隔符层级只编译一次，按分隔符列表缓存
+        self._compiled_separators: Dict[Tuple[str, ...], List[Tuple[str, Optional[Pattern]]]] = {}
+
+    def _compile_separators(self, separators: List[str]) -> List[Tuple[str, Optional[Pattern]]]:
+        """编译分隔符层级，空分隔符对应None（按字符切分）"""
+        key = tuple(separators)
+        compiled = self._compiled_separators.get(key)
+        if compiled is None:
+            compiled = [
+                (_s, re.compile(_s if self._is_separator_regex else re.escape(_s)) if _s else None)
+                for _s in separators
+            ]
+            self._compiled_separators[key] = compiled
+        return compiled
 
     def _split_text(self, text: str, separators: List[str]) -> List[str]:
         """ 分割文本，并传入分割器"""
+        final_chunks = self._split_recursive(text, self._compile_separators(separators), 0)
+        # 空白清理只在最外层做一次（各层的strip和换行合并都是幂等的，结果与逐层处理一致）
+        results = []
+        for chunk in final_chunks:
+            chunk = chunk.strip()
+            if chunk != "":
+                results.append(_MULTI_NEWLINE_RE.sub("\n", chunk))
+        return results
+
+    def _split_recursive(
+        self, text: str, compiled: List[Tuple[str, Optional[Pattern]]], level: int
+    ) -> List[str]:
+        """从第level级分隔符开始递归切分，不做空白清理"""
         final_chunks = []
-        separator = separators[-1]
-        new_separators = []
-        for i, _s in enumerate(separators):
-            _separator = _s if self._is_separator_regex else re.escape(_s)
-            if _s == "":
-                separator = _s
+        separator, pattern = compiled[-1]
+        next_level = len(compiled)
+        for i in range(level, len(compiled)):
+            _s, _pattern = compiled[i]
+            if _pattern is None:
+                separator, pattern = _s, None
                 break
-            if re.search(_separator, text):
-                separator = _s
-                new_separators = separators[i + 1 :]
+            if _pattern.search(text):
+                separator, pattern = _s, _pattern
+                next_level = i + 1
                 break
 
-        _separator = separator if self._is_separator_regex else re.escape(separator)
-        splits = _split_text_with_regex_from_end(text, _separator, self._keep_separator)
+        splits = _split_text_with_compiled_regex(text, pattern, self._keep_separator)
 
         # Now go merging things, recursively splitting longer texts.
         _good_splits = []
@@ -73,19 +127,64 @@ class ChineseRecursiveTextSplitter(RecursiveCharacterTextSplitter):
                     merged_text = self._merge_splits(_good_splits, _separator)
                     final_chunks.extend(merged_text)
                     _good_splits = []
-                if not new_separators:
+                if next_level >= len(compiled):
                     final_chunks.append(s)
                 else:
-                    other_info = self._split_text(s, new_separators)
+                    other_info = self._split_recursive(s, compiled, next_level)
                     final_chunks.extend(other_info)
         if _good_splits:
             merged_text = self._merge_splits(_good_splits, _separator)
             final_chunks.extend(merged_text)
-        return [
-            re.sub(r"\n{2,}", "\n", chunk.strip())
-            for chunk in final_chunks
-            if chunk.strip() != ""
-        ]
+        return final_chunks
+
+    def _merge_splits(self, splits: Iterable[str], separator: str) -> List[str]:
+        """
+        合并小片段为不超过chunk_size的块，逻辑与父类一致，
+        但缓存片段长度并用deque弹出重叠部分，避免列表切片带来的平方复杂度
+        """
+        separator_len = self._length_function(separator)
+
+        docs = []
+        current_doc: deque = deque()
+        current_lens: deque = deque()
+        total = 0
+        for d in splits:
+            len_ = self._length_function(d)
+            if (
+                total + len_ + (separator_len if len(current_doc) > 0 else 0)
+                > self._chunk_size
+            ):
+                if total > self._chunk_size:
+                    logger.warning(
+                        "Created a chunk of size %d, which is longer than the "
+                        "specified %d",
+                        total,
+                        self._chunk_size,
+                    )
+                if len(current_doc) > 0:
+                    doc = self._join_docs(list(current_doc), separator)
+                    if doc is not None:
+                        docs.append(doc)
+                    # Keep on popping if:
+                    # - we have a larger chunk than in the chunk overlap
+                    # - or if we still have any chunks and the length is long
+                    while total > self._chunk_overlap or (
+                        total + len_ + (separator_len if len(current_doc) > 0 else 0)
+                        > self._chunk_size
+                        and total > 0
+                    ):
+                        total -= current_lens[0] + (
+                            separator_len if len(current_doc) > 1 else 0
+                        )
+                        current_doc.popleft()
+                        current_lens.popleft()
+            current_doc.append(d)
+            current_lens.append(len_)
+            total += len_ + (separator_len if len(current_doc) > 1 else 0)
+        doc = self._join_docs(list(current_doc), separator)
+        if doc is not None:
+            docs.append(doc)
+        return docs
 
 
 if __name__ == "__main__":
@@ -0,0 +1,465 @@
+## 文档 → 向量ID 清单：支持按文档精确删除和重新向量化
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 清单文件名（保存在向量库目录下）
+MANIFEST_FILENAME = "doc_manifest.json"
+# 跨进程锁文件名（保存在向量库目录下）
+LOCK_FILENAME = ".lock"
+
+
+class _StoreLock:
+    """一个向量库的锁：进程内用RLock（可重入），进程间用锁文件"""
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self.rlock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    def acquire(self):
+        self.rlock.acquire()
+        try:
+            if self.depth == 0:
+                self._lock_file()
+            self.depth += 1
+        except BaseException:
+            self.rlock.release()
+            raise
+
+    def release(self):
+        try:
+            self.depth -= 1
+            if self.depth == 0:
+                self._unlock_file()
+        finally:
+            self.rlock.release()
+
+    def _lock_file(self):
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        f = open(self.lock_path, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                # LK_LOCK最多重试10秒，持续等待直到获得锁
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+        except BaseException:
+            f.close()
+            raise
+        self.file = f
+
+    def _unlock_file(self):
+        f, self.file = self.file, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            f.close()
+
+
+_locks: Dict[str, _StoreLock] = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def vector_store_lock(vector_store_path: str):
+    """
+    同一向量库的加载-修改-保存过程串行执行，避免删除与向量化互相覆盖
+
+    同时在向量库目录下的锁文件上加排他锁，API进程与独立的文档处理工作进程之间也互斥
+    """
+    key = os.path.abspath(vector_store_path)
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = _StoreLock(os.path.join(key, LOCK_FILENAME))
+    lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def hierarchical_store_paths(vector_store_path: str) -> Dict[str, str]:
+    """分层索引的摘要/块向量库路径（与HierarchicalIndexBuilder保存位置一致）"""
+    base = os.path.join(os.path.dirname(os.path.abspath(vector_store_path)), "hierarchical_vector_store")
+    return {
+        "summary": os.path.join(base, "summary_vector_store"),
+        "chunk": os.path.join(base, "chunk_vector_store"),
+    }
+
+
+class VectorManifest:
+    """
+    知识库的文档向量清单
+
+    doc_manifest.json 结构:
+    {
+        "documents": {
+            doc_id: {
+                "source": 文件路径, "vector_ids": [...], "chunk_hashes": [...],
+                "chunks": {分块哈希: 向量ID},  # 重新向量化时按哈希比对，未变化的分块复用向量
+                "updated_at": ...
+            }
+        },
+        "hierarchical": {
+            source: {"summary_ids": [...], "chunk_ids": [...]}
+        }
+    }
+    """
+
+    def __init__(self, vector_store_path: str):
+        self.vector_store_path = vector_store_path
+        self.manifest_path = os.path.join(vector_store_path, MANIFEST_FILENAME)
+        self.data = self._load()
+
+    def _load(self) -> Dict:
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                data.setdefault("documents", {})
+                data.setdefault("hierarchical", {})
+                return data
+            except Exception as e:
+                print(f"加载文档向量清单失败: {e}")
+        return {"documents": {}, "hierarchical": {}}
+
+    def save(self):
+        """保存清单（临时文件+替换）"""
+        os.makedirs(self.vector_store_path, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    @property
+    def documents(self) -> Dict[str, Dict]:
+        return self.data["documents"]
+
+    def get_document(self, doc_key: str) -> Optional[Dict]:
+        return self.documents.get(doc_key)
+
+    def find_key_by_source(self, source: str) -> Optional[str]:
+        """按文件路径查找清单中的文档"""
+        target = os.path.abspath(source)
+        for key, entry in self.documents.items():
+            entry_source = entry.get("source")
+            if entry_source and os.path.abspath(entry_source) == target:
+                return key
+        return None
+
+    def set_document(self, doc_key: str, source: str, vector_ids: List[str], chunk_hashes: List[str], updated_at: str):
+        """vector_ids与chunk_hashes按分块一一对应"""
+        # 去重后可能多个分块指向同一个向量，保持顺序去重
+        self.documents[doc_key] = {
+            "source": source,
+            "vector_ids": list(dict.fromkeys(vector_ids)),
+            "chunk_hashes": list(dict.fromkeys(chunk_hashes)),
+            "chunks": dict(zip(chunk_hashes, vector_ids)),
+            "updated_at": updated_at,
+        }
+
+    def pop_document(self, doc_key: str) -> Optional[Dict]:
+        return self.documents.pop(doc_key, None)
+
+    def referenced_ids(self, exclude_key: Optional[str] = None) -> Set[str]:
+        """其他文档仍在引用的向量ID（分块去重后向量可能被多个文档共享）"""
+        ids = set()
+        for key, entry in self.documents.items():
+            if key != exclude_key:
+                ids.update(entry.get("vector_ids", []))
+        return ids
+
+    def set_hierarchical(self, sources: Dict[str, Dict[str, List[str]]]):
+        """记录分层索引中每个来源文件对应的摘要ID和块ID（分层索引整体重建时覆盖）"""
+        self.data["hierarchical"] = sources
+
+    def pop_hierarchical(self, source: str) -> Dict[str, List[str]]:
+        target = os.path.abspath(source)
+        for key in list(self.data["hierarchical"].keys()):
+            if os.path.abspath(key) == target:
+                return self.data["hierarchical"].pop(key)
+        return {}
+
+
+def _source_matches(metadata: Dict, source: str) -> bool:
+    target = os.path.abspath(source)
+    candidates = [metadata.get("source")] + list(metadata.get("sources") or [])
+    return any(c and os.path.abspath(str(c)) == target for c in candidates)
+
+
+def find_ids_by_source(vectorstore, source: str) -> List[str]:
+    """扫描向量库文档元数据，查找来源为source的向量ID（用于没有清单记录的旧数据）"""
+    ids = []
+    for vector_id, doc in getattr(vectorstore.docstore, "_dict", {}).items():
+        if _source_matches(doc.metadata, source):
+            ids.append(vector_id)
+    return ids
+
+
+def delete_vector_ids(vectorstore, ids: Iterable[str]) -> int:
+    """在向量库中原地删除指定ID，返回实际删除数量"""
+    existing = set(vectorstore.index_to_docstore_id.values())
+    ids = [i for i in dict.fromkeys(ids) if i in existing]
+    if ids:
+        if 'Gpu' in type(vectorstore.index).__name__:
+            # GPU索引不支持remove_ids，转回CPU索引后删除
+            import faiss
+            vectorstore.index = faiss.index_gpu_to_cpu(vectorstore.index)
+        vectorstore.delete(ids)
+    return len(ids)
+
+
+def load_vectorstore(path: str, embeddings=None):
+    """加载FAISS向量库（删除操作不需要嵌入模型）"""
+    from langchain_community.vectorstores import FAISS
+
+    if not os.path.exists(os.path.join(path, "index.faiss")):
+        return None
+    return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+
+
+def save_vectorstore(vectorstore, path: str):
+    """保存FAISS向量库；路径含中文时先保存到临时目录再移动（faiss不支持中文路径）"""
+    os.makedirs(path, exist_ok=True)
+    has_chinese = any('\u4e00' <= char <= '\u9fff' for char in path)
+    if not has_chinese:
+        vectorstore.save_local(path)
+        return
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        vectorstore.save_local(temp_dir)
+        for filename in ("index.faiss", "index.pkl"):
+            temp_file = os.path.join(temp_dir, filename)
+            if os.path.exists(temp_file):
+                shutil.move(temp_file, os.path.join(path, filename))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _remove_hierarchical_entries(vector_store_path: str, source: str, entry: Dict[str, List[str]]) -> Dict[str, int]:
+    """从分层索引的摘要库和块库中删除来源文件对应的条目"""
+    removed = {"summary": 0, "chunk": 0}
+    paths = hierarchical_store_paths(vector_store_path)
+    for kind, path in paths.items():
+        try:
+            store = load_vectorstore(path)
+            if store is None:
+                continue
+            ids = list(entry.get(f"{kind}_ids", []))
+            if not ids:
+                # 没有清单记录时按元数据来源查找
+                ids = find_ids_by_source(store, source)
+            docs = getattr(store.docstore, "_dict", {})
+            ids = [i for i in ids if i in docs]
+            if kind == "summary":
+                # 合并了多个来源的摘要只在全部来源都被删除时才删除
+                target = os.path.abspath(source)
+                ids = [
+                    i for i in ids
+                    if all(
+                        os.path.abspath(str(s)) == target
+                        for s in (docs[i].metadata.get("sources") or [docs[i].metadata.get("source")])
+                        if s
+                    )
+                ]
+            count = delete_vector_ids(store, ids)
+            if count:
+                save_vectorstore(store, path)
+            removed[kind] = count
+        except Exception as e:
+            print(f"删除分层索引条目失败 ({kind}): {e}")
+    return removed
+
+
+def remove_document_vectors(
+    vector_store_path: str,
+    doc_key: Optional[str] = None,
+    source: Optional[str] = None,
+    vectorstore=None,
+    manifest: Optional[VectorManifest] = None,
+    save: bool = True,
+    cleanup_records: bool = True,
+) -> Dict:
+    """
+    原地删除一个文档在知识库中的全部向量（主向量库、分层摘要库、分层块库）
+
+    优先使用清单中记录的向量ID；没有清单记录的旧数据按元数据中的source匹配。
+    被其他文档共享的向量（分块去重）不会被删除。
+
+    Args:
+        vector_store_path: 知识库向量库目录
+        doc_key: 文档ID
+        source: 文档文件路径
+        vectorstore: 已加载的主向量库（传入时由调用方负责保存）
+        manifest: 已加载的清单（传入时由调用方负责保存）
+        save: 是否保存主向量库和清单
+        cleanup_records: 是否清理去重记录和文件处理记录（向量化流程自行维护时传False）
+
+    Returns:
+        删除统计
+    """
+    manifest = manifest or VectorManifest(vector_store_path)
+    if doc_key is None and source:
+        doc_key = manifest.find_key_by_source(source)
+    entry = manifest.pop_document(doc_key) if doc_key else None
+    if entry and not source:
+        source = entry.get("source")
+
+    result = {"vectors": 0, "summary": 0, "chunk": 0, "source": source, "transferred": 0}
+
+    own_vectorstore = vectorstore is None
+    if own_vectorstore:
+        vectorstore = load_vectorstore(vector_store_path)
+
+    transferred, updated = {}, 0
+    if vectorstore is not None:
+        if entry:
+            shared = manifest.referenced_ids()
+            ids = [i for i in entry.get("vector_ids", []) if i not in shared]
+            if cleanup_records and source:
+                transferred, updated = _transfer_shared_vectors(vectorstore, manifest, entry, source)
+                result["transferred"] = len(transferred)
+        elif source:
+            ids = find_ids_by_source(vectorstore, source)
+        else:
+            ids = []
+        result["vectors"] = delete_vector_ids(vectorstore, ids)
+        if own_vectorstore and save and (result["vectors"] or updated):
+            save_vectorstore(vectorstore, vector_store_path)
+
+    if source:
+        hierarchical_entry = manifest.pop_hierarchical(source)
+        removed = _remove_hierarchical_entries(vector_store_path, source, hierarchical_entry)
+        result.update(removed)
+
+    if cleanup_records:
+        _cleanup_records(vector_store_path, source, vectorstore, transferred)
+
+    if save:
+        manifest.save()
+    return result
+
+
+def _same_path(a, b) -> bool:
+    return bool(a) and bool(b) and os.path.abspath(str(a)) == os.path.abspath(str(b))
+
+
+def _transfer_shared_vectors(vectorstore, manifest: VectorManifest, entry: Dict, source: str) -> Tuple[Dict[str, str], int]:
+    """
+    被删除文档的向量仍被其他文档引用时（分块去重）保留向量，并从元数据中移除被删除的文件
+
+    向量属于被删除的文档时，把source改为清单中第一个仍引用它的文档，
+    并从duplicate_sources中移除该文档；其他共享向量只从duplicate_sources中移除被删除的文件。
+
+    Returns:
+        (改变了归属的 向量ID->新的来源, 修改了元数据的向量数)
+    """
+    # 调用前已从清单中移除被删除的文档
+    owners = {}
+    for other in manifest.documents.values():
+        for vector_id in other.get("vector_ids", []):
+            owners.setdefault(vector_id, other.get("source"))
+
+    docs = getattr(vectorstore.docstore, "_dict", {})
+    transferred = {}
+    updated = 0
+    for vector_id in entry.get("vector_ids", []):
+        doc = docs.get(vector_id)
+        new_source = owners.get(vector_id)
+        if doc is None or not new_source:
+            continue
+        original = doc.metadata.get("duplicate_sources") or []
+        duplicate_sources = [s for s in original if not _same_path(s, source)]
+        if _same_path(doc.metadata.get("source"), source):
+            doc.metadata["source"] = new_source
+            duplicate_sources = [s for s in duplicate_sources if not _same_path(s, new_source)]
+            transferred[vector_id] = new_source
+        if vector_id not in transferred and len(duplicate_sources) == len(original):
+            continue
+        if duplicate_sources:
+            doc.metadata["duplicate_sources"] = duplicate_sources
+        else:
+            doc.metadata.pop("duplicate_sources", None)
+        updated += 1
+    return transferred, updated
+
+
+def _cleanup_records(vector_store_path: str, source: Optional[str], vectorstore, transferred: Optional[Dict[str, str]] = None):
+    """清理去重记录中已失效的向量ID和被删除的来源，以及文件处理记录"""
+    from .chunk_dedup import CHUNK_HASHES_FILENAME
+
+    transferred = transferred or {}
+    hashes_path = os.path.join(vector_store_path, CHUNK_HASHES_FILENAME)
+    if vectorstore is not None and os.path.exists(hashes_path):
+        try:
+            with open(hashes_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            alive = set(vectorstore.index_to_docstore_id.values())
+            chunks = data.get("chunks", {})
+            stale = [h for h, record in chunks.items() if record.get("id") not in alive]
+            for chunk_hash in stale:
+                chunks.pop(chunk_hash, None)
+                data.get("minhash", {}).pop(chunk_hash, None)
+            changed = bool(stale)
+            if source:
+                # 共享向量的首个来源改为新的归属文档，其他来源中移除被删除的文件
+                for record in chunks.values():
+                    sources = record.get("sources") or []
+                    new_source = transferred.get(record.get("id"))
+                    owner_removed = bool(new_source) and _same_path(record.get("source"), source)
+                    remaining = [
+                        s for s in sources
+                        if not _same_path(s, source) and not (owner_removed and _same_path(s, new_source))
+                    ]
+                    if owner_removed:
+                        record["source"] = new_source
+                    if owner_removed or len(remaining) != len(sources):
+                        record["sources"] = remaining
+                        record["refs"] = max(1, record.get("refs", 1) - 1)
+                        changed = True
+            if changed:
+                with open(hashes_path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(hashes_path + ".tmp", hashes_path)
+        except Exception as e:
+            print(f"清理分块去重记录失败: {e}")
+
+    file_info_path = os.path.join(vector_store_path, "file_info.json")
+    if source and os.path.exists(file_info_path):
+        try:
+            with open(file_info_path, "r", encoding="utf-8") as f:
+                file_info = json.load(f)
+            target = os.path.abspath(source)
+            removed_keys = [k for k in file_info if os.path.abspath(k) == target]
+            for key in removed_keys:
+                file_info.pop(key)
+            if removed_keys:
+                with open(file_info_path, "w", encoding="utf-8") as f:
+                    json.dump(file_info, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"清理文件处理记录失败: {e}")
@@ -0,0 +1,70 @@
+"""
+CSV加载器编码检测测试
+
+编码只根据文件开头的样本检测，样本全是ASCII时会选中utf-8，
+后面出现的GBK行应改用gb18030解码，而不是在读取中途报错
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dfy_langchain", "document_loaders"))
+
+from FilteredCSVloader import FilteredCSVLoader  # noqa: E402
+
+SAMPLE_SIZE = 1024
+
+
+def write_csv(path, rows, encoding):
+    with open(path, "wb") as f:
+        f.write("name,city\r\n".encode("ascii"))
+        for name, city in rows:
+            f.write(f"{name},{city}\r\n".encode(encoding))
+
+
+def ascii_rows(count):
+    return [(f"user{i}", "beijing") for i in range(count)]
+
+
+@pytest.fixture
+def small_sample(monkeypatch):
+    monkeypatch.setattr(FilteredCSVLoader, "ENCODING_SAMPLE_SIZE", SAMPLE_SIZE)
+
+
+def test_gbk_rows_after_ascii_prefix(tmp_path, small_sample):
+    rows = ascii_rows(200) + [("张三", "北京"), ("李四", "上海"), ("王五", "𠀀")]
+    path = str(tmp_path / "data.csv")
+    write_csv(path, rows[:-1], "gbk")
+    with open(path, "ab") as f:
+        # gb18030才能编码的字符
+        f.write(f"{rows[-1][0]},{rows[-1][1]}\r\n".encode("gb18030"))
+    assert os.path.getsize(path) > SAMPLE_SIZE
+
+    docs = FilteredCSVLoader(path, autodetect_encoding=True).load_file()
+
+    assert [doc.page_content for doc in docs] == [f"name:{name}\ncity:{city}" for name, city in rows]
+    assert [doc.metadata["row"] for doc in docs] == list(range(len(rows)))
+
+
+def test_utf8_rows_after_ascii_prefix(tmp_path, small_sample):
+    rows = ascii_rows(200) + [("张三", "北京")]
+    path = str(tmp_path / "data.csv")
+    write_csv(path, rows, "utf-8")
+
+    docs = FilteredCSVLoader(path, autodetect_encoding=True).load_file()
+
+    assert docs[-1].page_content == "name:张三\ncity:北京"
+
+
+def test_quoted_field_spanning_lines(tmp_path, small_sample):
+    path = str(tmp_path / "data.csv")
+    with open(path, "wb") as f:
+        f.write(b"name,city\r\n")
+        for name, city in ascii_rows(200):
+            f.write(f"{name},{city}\r\n".encode("ascii"))
+        f.write('"张\r\n三",北京\r\n'.encode("gbk"))
+
+    docs = FilteredCSVLoader(path, autodetect_encoding=True).load_file()
+
+    assert docs[-1].page_content == "name:张\r\n三\ncity:北京"
@@ -0,0 +1,73 @@
+"""
+Excel加载器流式读取测试
+
+流式读取分批构建DataFrame，检查各种批大小下生成的文档都与pandas一次性读取（load()）一致，
+数字格式不随分批方式变化
+"""
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dfy_langchain", "document_loaders"))
+
+from FilteredExcelLoader import FilteredExcelLoader  # noqa: E402
+
+ROWS = [
+    # 整数, 后面才出现小数, 后面才出现空值, 后面才出现文本, 布尔, 日期, 文本
+    [1, 1, 10, 100, True, datetime(2024, 1, 1), "a"],
+    [2, 2, 20, 200, False, datetime(2024, 1, 2), "b"],
+    [3, 3, 30, 300, True, datetime(2024, 1, 3), "c"],
+    None,  # 中间的空行
+    [4, 4, 40, 400, False, datetime(2024, 1, 4), "d"],
+    [5, 5.5, None, "x", True, datetime(2024, 1, 5), "e"],
+    [6, 6, 60, 600, False, None, None],
+]
+
+
+def write_workbook(path, rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["整数", "小数", "空值", "混合", "布尔", "日期", "文本"])
+    for row in rows:
+        sheet.append(row or [])
+    # 末尾的空行
+    sheet.append([])
+    workbook.save(path)
+
+
+def as_tuples(docs):
+    # 空行的source为NaN，用repr比较
+    return [(doc.page_content, repr(doc.metadata)) for doc in docs]
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 3, 4, 1000])
+def test_streaming_matches_pandas(tmp_path, batch_size):
+    path = str(tmp_path / "data.xlsx")
+    write_workbook(path, ROWS)
+    options = {"source_column": "整数", "metadata_columns": ["小数", "空值", "混合"]}
+
+    expected = FilteredExcelLoader(path, **options).load()
+    streamed = FilteredExcelLoader(path, streaming=True, batch_size=batch_size, **options).load()
+
+    assert as_tuples(streamed) == as_tuples(expected)
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_streaming_all_numeric_sheet(tmp_path, batch_size):
+    # 整列都是数字时按行读取的值统一为小数（与逐行iterrows的旧格式一致）
+    path = str(tmp_path / "numbers.xlsx")
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["a", "b"])
+    for row in ([1, 2], [3, 4.5], [5, None]):
+        sheet.append(row)
+    workbook.save(path)
+
+    expected = FilteredExcelLoader(path).load()
+    streamed = FilteredExcelLoader(path, streaming=True, batch_size=batch_size).load()
+
+    assert as_tuples(streamed) == as_tuples(expected)
+    assert expected[0].page_content == "a:1.0\nb:2.0"
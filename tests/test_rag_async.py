@@ -0,0 +1,73 @@
+"""
+RAG异步检索的并发测试
+
+检索（FAISS加载、向量化、分词）是阻塞操作，aretrieve_and_generate在专用线程池中执行检索。
+用1秒的阻塞sleep模拟检索，同时发起多个请求，检查：
+- 事件循环上的其他任务（50ms的定时器）始终能及时运行
+- 总耗时约为 ceil(请求数 / RAG_RETRIEVAL_WORKERS) 秒
+"""
+import asyncio
+import math
+import os
+import sys
+import time
+
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dfy_langchain"))
+
+import rag_generation  # noqa: E402
+import rag_retrievers  # noqa: E402
+
+RETRIEVAL_SECONDS = 1.0
+TICK_SECONDS = 0.05
+# 定时器允许的最大延迟
+MAX_TICK_LAG = 0.2
+
+
+def blocking_search(query, knowledge_base_ids=None, **kwargs):
+    time.sleep(RETRIEVAL_SECONDS)
+    return [(Document(page_content=f"{query}的相关内容", metadata={"source": "test.txt"}), 0.9)]
+
+
+def make_generator():
+    generator = rag_generation.RAGGenerator(model_provider="openai", model_name="test-model", api_key="test")
+    generator.llm = FakeListChatModel(responses=["测试回答"])
+    return generator
+
+
+async def run_with_ticker(num_requests):
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK_SECONDS)
+            lags.append(time.perf_counter() - started - TICK_SECONDS)
+
+    ticker_task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    # 每个请求使用不同的问题，避免被合并为一次检索
+    results = await asyncio.gather(*[
+        make_generator().aretrieve_and_generate(f"问题{i}", ["test"], use_cache=False)
+        for i in range(num_requests)
+    ])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker_task
+    return results, elapsed, lags
+
+
+def test_concurrent_retrieval_keeps_event_loop_responsive(monkeypatch):
+    monkeypatch.setattr(rag_retrievers, "search_documents", blocking_search)
+    workers = rag_retrievers.RETRIEVAL_MAX_WORKERS
+    num_requests = workers * 2
+
+    results, elapsed, lags = asyncio.run(run_with_ticker(num_requests))
+
+    assert [result["answer"] for result in results] == ["测试回答"] * num_requests
+    assert lags and max(lags) < MAX_TICK_LAG
+    expected = math.ceil(num_requests / workers) * RETRIEVAL_SECONDS
+    assert expected - 0.1 <= elapsed < expected + 0.8